@@ -0,0 +1,378 @@
+"""Offline benchmarks of the Lambda handlers against in-process Bedrock, S3 and SageMaker stand-ins.
+
+    python benchmarks/run.py                          # every scenario
+    python benchmarks/run.py 'docker.*' --iterations 500 --concurrency 8
+    python benchmarks/run.py --output before.json
+    python benchmarks/run.py --output after.json --compare before.json
+
+Each scenario runs in a fresh Python process, so module state, import costs and peak RSS are
+measured per code path. See benchmarks/README.md for the reported numbers.
+"""
+import argparse
+import fnmatch
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+
+from scenarios import REPO, SCENARIOS, Context, Skip, is_error
+
+# Environment the handlers are imported with; variables already set in the shell take precedence
+BENCH_ENVIRONMENT = {
+    'S3_IMAGE_BUCKET': 'bench-images',
+    'AWS_REGION': 'us-west-2',
+    'AWS_DEFAULT_REGION': 'us-west-2',
+    'BWB_REGION_NAME': 'us-west-2',
+    'ENDPOINT': 'falcon-bench',
+    'AWS_ACCESS_KEY_ID': 'bench',
+    'AWS_SECRET_ACCESS_KEY': 'bench',
+}
+
+# Metrics compared against a baseline: (label, path in the scenario result, True when higher is better)
+COMPARED_METRICS = (
+    ('p50 ms', ('latencyMs', 'p50'), False),
+    ('p95 ms', ('latencyMs', 'p95'), False),
+    ('p99 ms', ('latencyMs', 'p99'), False),
+    ('calls/s', ('throughputPerSecond',), True),
+    ('MB/s', ('mbPerSecond',), True),
+    ('CPU ms/call', ('cpuMsPerCall',), False),
+    ('alloc KiB/call', ('allocations', 'peakKiBPerCallP50'), False),
+    ('peak RSS KiB', ('peakRssKiB',), False),
+    ('import ms', ('importMs', 'p50'), False),
+    ('SDK import ms', ('sdkImportMs', 'p50'), False),
+    ('first response ms', ('firstResponseMs', 'p50'), False),
+)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile (0-100) of a list of numbers."""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(values):
+    return {
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "p99": round(percentile(values, 99), 3),
+        "mean": round(sum(values) / len(values), 3),
+        "min": round(min(values), 3),
+        "max": round(max(values), 3),
+    }
+
+
+def peak_rss_kib():
+    """Peak resident set size of this process in KiB, or None where the resource module is missing."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak  # bytes on macOS, KiB on Linux
+
+
+def standin_config(settings, overrides):
+    from standin import StandInConfig
+
+    width, height = (int(value) for value in settings['image_size'].lower().split('x'))
+    options = dict(
+        text_latency=settings['text_latency'],
+        image_latency=settings['image_latency'],
+        s3_latency=settings['s3_latency'],
+        sagemaker_latency=settings['sagemaker_latency'],
+        throttle_rate=settings['throttle_rate'],
+        model_concurrency=settings['model_concurrency'],
+        retry_after=settings['retry_after'],
+        text_chars=settings['text_chars'],
+        image_size=(width, height),
+        seed=settings['seed'],
+    )
+    options.update(overrides)
+    return StandInConfig(**options)
+
+
+def measure_warm(call, ctx, settings, iterations):
+    """Runs call() warm: a timed pass (optionally concurrent), then a tracemalloc pass for allocations."""
+    for i in range(settings['warmup']):
+        call(-1 - i)
+
+    def timed(i):
+        start = time.perf_counter()
+        response = call(i)
+        return time.perf_counter() - start, is_error(response)
+
+    concurrency = settings['concurrency']
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(timed, range(iterations)))
+    else:
+        samples = [timed(i) for i in range(iterations)]
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+    # Allocations are measured in a separate, sequential pass because tracing slows every call down
+    alloc_iterations = min(settings['alloc_iterations'], iterations)
+    peaks = []
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    for i in range(alloc_iterations):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        call(iterations + i)
+        peaks.append((tracemalloc.get_traced_memory()[1] - before) / 1024)
+    retained = (tracemalloc.get_traced_memory()[0] - baseline) / 1024
+    tracemalloc.stop()
+
+    latencies = [seconds * 1000 for seconds, _ in samples]
+    errors = sum(error for _, error in samples)
+    result = {
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "errors": errors,
+        "errorRate": round(errors / iterations, 4),
+        "throughputPerSecond": round(iterations / wall, 2),
+        "latencyMs": summarize(latencies),
+        "cpuMsPerCall": round(cpu * 1000 / iterations, 3),
+        "allocations": {
+            "iterations": alloc_iterations,
+            "peakKiBPerCallP50": round(percentile(peaks, 50), 1) if peaks else None,
+            "peakKiBPerCallMax": round(max(peaks), 1) if peaks else None,
+            "retainedKiB": round(retained, 1),
+        },
+    }
+    if ctx.bytes_per_call:
+        result["mbPerSecond"] = round(ctx.bytes_per_call * iterations / wall / (1024 * 1024), 2)
+        result["bytesPerCall"] = ctx.bytes_per_call
+    return result
+
+
+def run_child(name, settings):
+    """Runs one scenario in this process and returns its result."""
+    for key, value in BENCH_ENVIRONMENT.items():
+        os.environ.setdefault(key, value)
+    # The handlers print every event and log every throttle; keep that out of the measurements
+    logging.disable(logging.CRITICAL)
+
+    scenario = SCENARIOS[name]
+    start = time.perf_counter()
+    try:
+        # The stand-in patches boto3, so the SDK is imported before any scenario code; cold starts report it separately
+        from standin import StandIn
+    except ImportError as e:
+        return {"status": "skipped", "reason": f"{e.name} is not installed"}
+    sdk_import_ms = (time.perf_counter() - start) * 1000
+
+    standin = StandIn(standin_config(settings, scenario.config)).install()
+    ctx = Context(standin, settings)
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        try:
+            if scenario.cold:
+                result = {"sample": dict(scenario.setup(ctx), sdkImportMs=sdk_import_ms)}
+            else:
+                call = scenario.setup(ctx)
+                result = measure_warm(call, ctx, settings, scenario.iterations or settings['iterations'])
+        except Skip as e:
+            return {"status": "skipped", "reason": str(e)}
+        except ImportError as e:
+            return {"status": "skipped", "reason": f"{e.name} is not installed"}
+
+    result.update(status="ok", peakRssKiB=peak_rss_kib())
+    if ctx.notes:
+        result["notes"] = {key: round(sum(values) / len(values), 2) for key, values in ctx.notes.items()}
+    result["standIn"] = {
+        "bedrockCalls": standin.bedrock.calls,
+        "bedrockThrottles": standin.bedrock.throttles,
+        "s3Calls": standin.s3.calls,
+        "sagemakerCalls": standin.sagemaker.calls,
+    }
+    return result
+
+
+def spawn(name, settings, timeout):
+    """Runs one scenario in a fresh interpreter and returns its result."""
+    with tempfile.TemporaryDirectory() as directory:
+        settings_path = os.path.join(directory, 'settings.json')
+        result_path = os.path.join(directory, 'result.json')
+        with open(settings_path, 'w') as f:
+            json.dump(settings, f)
+        try:
+            process = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', name, settings_path, result_path],
+                capture_output=True, text=True, timeout=timeout
+            )
+        except subprocess.TimeoutExpired:
+            return {"status": "failed", "reason": f"Timed out after {timeout}s"}
+        if process.returncode != 0 or not os.path.exists(result_path):
+            lines = process.stderr.strip().splitlines()
+            return {"status": "failed", "reason": lines[-1] if lines else f"Exit code {process.returncode}"}
+        with open(result_path) as f:
+            return json.load(f)
+
+
+def run_scenario(scenario, settings):
+    if not scenario.cold:
+        return spawn(scenario.name, settings, settings['timeout'])
+
+    # A cold start is one sample per process
+    samples = []
+    rss = []
+    for _ in range(settings['cold_runs']):
+        result = spawn(scenario.name, settings, settings['timeout'])
+        if result['status'] != 'ok':
+            return result
+        samples.append(result['sample'])
+        rss.append(result['peakRssKiB'])
+    summary = {"status": "ok", "runs": len(samples)}
+    for key in samples[0]:
+        summary[key] = summarize([sample[key] for sample in samples])
+    summary["peakRssKiB"] = max(rss) if None not in rss else None
+    return summary
+
+
+def lookup(result, path):
+    for key in path:
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+
+def compare(results, baseline, threshold):
+    """Prints the change of every compared metric against a baseline; returns the regressions."""
+    regressions = []
+    print(f"\nCompared with {baseline['meta'].get('gitRevision') or 'baseline'} (regression threshold {threshold:g}%)")
+    changed = sorted(key for key, value in results['meta']['settings'].items() if baseline['meta'].get('settings', {}).get(key) != value)
+    if changed:
+        print(f"  Note: the runs used different settings ({', '.join(changed)}), so the numbers are not directly comparable")
+    for name, current in results['scenarios'].items():
+        previous = baseline['scenarios'].get(name)
+        if current.get('status') != 'ok' or not previous or previous.get('status') != 'ok':
+            continue
+        for label, path, higher_is_better in COMPARED_METRICS:
+            new, old = lookup(current, path), lookup(previous, path)
+            if new is None or not old:
+                continue
+            change = (new - old) / old * 100
+            worse = -change if higher_is_better else change
+            flag = ' REGRESSION' if worse > threshold else ''
+            if flag:
+                regressions.append((name, label, change))
+            print(f"  {name:28} {label:18} {old:>12,.2f} -> {new:>12,.2f} {change:+7.1f}%{flag}")
+    return regressions
+
+
+def print_result(name, result):
+    if result['status'] != 'ok':
+        print(f"{name:28} {result['status']}: {result['reason']}")
+        return
+    rss = f"{result['peakRssKiB'] / 1024:.0f} MiB RSS" if result.get('peakRssKiB') else ''
+    if 'latencyMs' in result:
+        latency = result['latencyMs']
+        extra = f"{result['mbPerSecond']:.1f} MB/s" if 'mbPerSecond' in result else f"{result['throughputPerSecond']:.1f}/s"
+        print(f"{name:28} p50 {latency['p50']:8.2f} ms  p95 {latency['p95']:8.2f}  p99 {latency['p99']:8.2f}  {extra:>10}  "
+              f"cpu {result['cpuMsPerCall']:7.2f} ms  alloc {result['allocations']['peakKiBPerCallP50'] or 0:9.1f} KiB  "
+              f"{rss}  errors {result['errors']}" + (f"  {result['notes']}" if 'notes' in result else ''))
+    else:
+        timings = '  '.join(f"{key} p50 {value['p50']:.1f} (max {value['max']:.1f})"
+                            for key, value in result.items() if isinstance(value, dict))
+        print(f"{name:28} {timings}  {rss}  runs {result['runs']}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('patterns', nargs='*', default=['*'], help="scenario names or glob patterns (default: all)")
+    parser.add_argument('--list', action='store_true', help="list the scenarios and exit")
+    parser.add_argument('--iterations', type=int, default=200, help="timed calls per warm scenario")
+    parser.add_argument('--warmup', type=int, default=5, help="untimed calls before the timed pass")
+    parser.add_argument('--concurrency', type=int, default=1, help="threads issuing calls in the timed pass")
+    parser.add_argument('--alloc-iterations', type=int, default=20, help="calls traced with tracemalloc")
+    parser.add_argument('--cold-runs', type=int, default=5, help="fresh processes per cold start scenario")
+    parser.add_argument('--text-latency', default='lognormal:20:0.5', help="text model latency: const:MS, uniform:MIN:MAX or lognormal:MEDIAN:SIGMA")
+    parser.add_argument('--image-latency', default='lognormal:60:0.4', help="image model latency")
+    parser.add_argument('--s3-latency', default='const:2', help="S3 request latency")
+    parser.add_argument('--sagemaker-latency', default='lognormal:15:0.3', help="SageMaker endpoint latency")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="probability that a Bedrock call is throttled")
+    parser.add_argument('--model-concurrency', type=int, default=None, help="concurrent calls per model before Bedrock throttles")
+    parser.add_argument('--retry-after', type=float, default=None, help="Retry-After seconds sent with throttles")
+    parser.add_argument('--text-chars', type=int, default=1200, help="length of the canned text answers")
+    parser.add_argument('--image-size', default='1024x1024', help="size of the generated and reference images")
+    parser.add_argument('--stream-mb', type=float, default=8, help="size of the synthetic agent event stream")
+    parser.add_argument('--stream-file', help="decode a recorded agent event stream instead of the synthetic one")
+    parser.add_argument('--seed', type=int, default=1, help="seed of the stand-in's latency and throttling draws")
+    parser.add_argument('--timeout', type=int, default=900, help="seconds before a scenario process is stopped")
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--compare', help="baseline results JSON to compare with")
+    parser.add_argument('--threshold', type=float, default=10, help="percent change counted as a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    if argv[:1] == ['--child']:
+        name, settings_path, result_path = argv[1:4]
+        with open(settings_path) as f:
+            settings = json.load(f)
+        result = run_child(name, settings)
+        with open(result_path, 'w') as f:
+            json.dump(result, f)
+        return 0
+
+    args = parse_args(argv)
+    names = [name for name in SCENARIOS if any(fnmatch.fnmatchcase(name, pattern) for pattern in args.patterns)]
+    if args.list:
+        for name in names:
+            print(f"{name:28} {SCENARIOS[name].description}")
+        return 0
+    if not names:
+        print(f"No scenario matches {' '.join(args.patterns)}; see --list", file=sys.stderr)
+        return 2
+
+    settings = {key: value for key, value in vars(args).items() if key not in ('patterns', 'list', 'output', 'compare', 'threshold')}
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            "gitRevision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpuCount": os.cpu_count(),
+            "settings": settings,
+        },
+        "scenarios": {},
+    }
+    for name in names:
+        result = dict(run_scenario(SCENARIOS[name], settings), description=SCENARIOS[name].description)
+        results["scenarios"][name] = result
+        print_result(name, result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed by more than {args.threshold:g}%")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,400 @@
+"""Benchmark scenarios, one per code path.
+
+A scenario's setup function receives a Context and returns call(i), which runs iteration i once and
+returns the handler's response. Cold scenarios instead measure one fresh process and return a dict
+of millisecond timings. This module only describes scenarios; the AWS stand-in is installed by
+run.py in the process that runs them, after importing boto3, so cold scenarios time what comes on
+top of the SDK import (reported as sdkImportMs).
+"""
+import importlib
+import importlib.util
+import os
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Deploy directory and module of each application; every scenario runs in its own process,
+# so the flat module names of the directories never collide
+APPS = {
+    'handler': ('infer-models', 'handler'),
+    'docker': (os.path.join('docker', 'app'), 'lambda_function'),
+    'agent': ('streamlit_app', 'invoke_agent'),
+}
+
+TITAN_TEXT = 'amazon.titan-text-express-v1'
+CLAUDE_3_HAIKU = 'anthropic.claude-3-haiku-20240307-v1:0'
+TITAN_IMAGE = 'amazon.titan-image-generator-v1'
+TITAN_IMAGE_V2 = 'amazon.titan-image-generator-v2:0'
+FANOUT_MODELS = [TITAN_TEXT, 'meta.llama3-8b-instruct-v1:0', 'mistral.mistral-7b-instruct-v0:2',
+                 'cohere.command-r-v1:0', 'anthropic.claude-instant-v1']
+
+
+class Skip(Exception):
+    """Raised when a scenario cannot run here, usually because an optional dependency is missing."""
+
+
+class Scenario:
+    def __init__(self, name, description, setup, cold=False, iterations=None, config=None):
+        self.name = name
+        self.description = description
+        self.setup = setup
+        self.cold = cold
+        self.iterations = iterations
+        self.config = config or {}
+
+
+SCENARIOS = {}
+
+
+def scenario(name, description, cold=False, iterations=None, **config):
+    """Registers a scenario; keyword arguments override the stand-in configuration for it."""
+    def register(setup):
+        SCENARIOS[name] = Scenario(name, description, setup, cold, iterations, config)
+        return setup
+    return register
+
+
+def require(*modules):
+    """Skips the scenario unless every module can be imported."""
+    for module in modules:
+        if importlib.util.find_spec(module.split('.')[0]) is None or importlib.util.find_spec(module) is None:
+            raise Skip(f"{module} is not installed")
+
+
+class Context:
+    """What a scenario gets to work with: the stand-in, the run settings and a place for extra numbers."""
+
+    def __init__(self, standin, settings):
+        self.standin = standin
+        self.settings = settings
+        self.bytes_per_call = None
+        self.notes = {}
+
+    def load(self, app):
+        """Imports an application module from its deploy directory, with the shared modules behind it."""
+        directory, module = APPS[app]
+        sys.path[:0] = [os.path.join(REPO, directory), os.path.join(REPO, 'shared')]
+        return importlib.import_module(module)
+
+    def put_reference_image(self):
+        """Uploads the_image.png, the reference image of the multimodal and image-conditioned paths."""
+        from standin import make_png
+
+        self.standin.s3.objects[(os.environ['S3_IMAGE_BUCKET'], 'the_image.png')] = (
+            make_png(*self.standin.config.image_size, seed=2), '"reference"'
+        )
+
+    def note(self, **values):
+        """Records per-call values reported alongside the timings (their mean is kept)."""
+        for name, value in values.items():
+            self.notes.setdefault(name, []).append(value)
+
+
+def agent_event(api_path, **parameters):
+    """Builds a Bedrock agent action group event."""
+    return {
+        "messageVersion": "1.0",
+        "actionGroup": "bench",
+        "apiPath": api_path,
+        "httpMethod": "POST",
+        "parameters": [{"name": name, "type": "string", "value": value} for name, value in parameters.items()],
+    }
+
+
+def response_body(response):
+    return response['response']['responseBody']['application/json']['body']
+
+
+def is_error(response):
+    """True when a handler response reports a failure."""
+    if not isinstance(response, dict) or 'response' not in response:
+        return False
+    if response['response'].get('httpStatusCode', 200) >= 400:
+        return True
+    body = response_body(response)
+    if isinstance(body, dict):
+        return 'error' in body or bool(body.get('failed')) or str(body.get('message', '')).startswith('Failed')
+    return isinstance(body, str) and body.startswith('An error occurred')
+
+
+# --- infer-models/handler.py ---
+
+@scenario('handler.cold_start', "infer-models: module import and first /callModel text response in a fresh process", cold=True)
+def handler_cold_start(ctx):
+    start = time.perf_counter()
+    handler = ctx.load('handler')
+    imported = time.perf_counter()
+    handler.lambda_handler(agent_event('/callModel', modelId=TITAN_TEXT, prompt="What is Amazon Bedrock?"), None)
+    return {"importMs": (imported - start) * 1000, "firstResponseMs": (time.perf_counter() - imported) * 1000}
+
+
+@scenario('handler.text', "infer-models /callModel, Titan Text through Converse")
+def handler_text(ctx):
+    handler = ctx.load('handler')
+    return lambda i: handler.lambda_handler(agent_event('/callModel', modelId=TITAN_TEXT, prompt=f"Question {i}: what is Amazon Bedrock?"), None)
+
+
+@scenario('handler.multimodal', "infer-models /callModel, Claude 3 Haiku with the S3 reference image")
+def handler_multimodal(ctx):
+    handler = ctx.load('handler')
+    ctx.put_reference_image()
+    return lambda i: handler.lambda_handler(agent_event('/callModel', modelId=CLAUDE_3_HAIKU, prompt=f"Describe image {i}"), None)
+
+
+@scenario('handler.image', "infer-models /callModel, Titan Image text-to-image (new prompt every call)")
+def handler_image(ctx):
+    handler = ctx.load('handler')
+    return lambda i: handler.lambda_handler(agent_event('/callModel', modelId=TITAN_IMAGE, prompt=f"A lighthouse at dusk, variation {i}"), None)
+
+
+@scenario('handler.image.multi', "infer-models /callModel, four Titan Image images from one request, uploaded concurrently")
+def handler_image_multi(ctx):
+    handler = ctx.load('handler')
+    return lambda i: handler.lambda_handler(agent_event(
+        '/callModel', modelId=TITAN_IMAGE, prompt=f"A lighthouse at dusk, variation {i}", numberOfImages='4'
+    ), None)
+
+
+@scenario('handler.image.cached', "infer-models /callModel, Titan Image request served from the image store")
+def handler_image_cached(ctx):
+    handler = ctx.load('handler')
+    return lambda i: handler.lambda_handler(agent_event('/callModel', modelId=TITAN_IMAGE, prompt="A lighthouse at dusk"), None)
+
+
+@scenario('handler.inpainting', "infer-models /callModel, Titan Image inpainting of the reference image")
+def handler_inpainting(ctx):
+    require('numpy', 'PIL')
+    handler = ctx.load('handler')
+    ctx.put_reference_image()
+    return lambda i: handler.lambda_handler(agent_event('/callModel', modelId=TITAN_IMAGE, prompt=f"Change the sky to sunset, variation {i}"), None)
+
+
+# --- docker/app/lambda_function.py ---
+
+@scenario('docker.cold_start', "docker: module import and first /callBedrockModel text response in a fresh process", cold=True)
+def docker_cold_start(ctx):
+    start = time.perf_counter()
+    app = ctx.load('docker')
+    imported = time.perf_counter()
+    app.lambda_handler(agent_event('/callBedrockModel', modelId=TITAN_TEXT, prompt="What is Amazon Bedrock?"), None)
+    return {"importMs": (imported - start) * 1000, "firstResponseMs": (time.perf_counter() - imported) * 1000}
+
+
+@scenario('docker.text', "docker /callBedrockModel, Titan Text through Converse (new prompt every call)")
+def docker_text(ctx):
+    app = ctx.load('docker')
+    return lambda i: app.lambda_handler(agent_event('/callBedrockModel', modelId=TITAN_TEXT, prompt=f"Question {i}: what is Amazon Bedrock?"), None)
+
+
+@scenario('docker.text.cached', "docker /callBedrockModel, Titan Text answered from the response cache")
+def docker_text_cached(ctx):
+    app = ctx.load('docker')
+    return lambda i: app.lambda_handler(agent_event('/callBedrockModel', modelId=TITAN_TEXT, prompt="What is Amazon Bedrock?"), None)
+
+
+@scenario('docker.text.stream', "docker /callBedrockModel, Titan Text through ConverseStream")
+def docker_text_stream(ctx):
+    app = ctx.load('docker')
+    return lambda i: app.lambda_handler(agent_event(
+        '/callBedrockModel', modelId=TITAN_TEXT, prompt=f"Question {i}: what is Amazon Bedrock?", stream='true'
+    ), None)
+
+
+@scenario('docker.text.profiled', "docker /callBedrockModel, Titan Text with the 'spans' profile session attribute set")
+def docker_text_profiled(ctx):
+    import tempfile
+
+    os.environ['PROFILE_OUTPUT'] = tempfile.mkdtemp(prefix='bench-profiles-')
+    app = ctx.load('docker')
+
+    def call(i):
+        event = agent_event('/callBedrockModel', modelId=TITAN_TEXT, prompt=f"Question {i}: what is Amazon Bedrock?")
+        event['sessionAttributes'] = {'profile': 'spans'}
+        return app.lambda_handler(event, None)
+    return call
+
+
+@scenario('docker.image', "docker /callBedrockModel, Titan Image text-to-image (new prompt every call)")
+def docker_image(ctx):
+    app = ctx.load('docker')
+    return lambda i: app.lambda_handler(agent_event('/callBedrockModel', modelId=TITAN_IMAGE, prompt=f"A lighthouse at dusk, variation {i}"), None)
+
+
+@scenario('docker.image.multi', "docker /callBedrockModel, four Titan Image images from one request, uploaded concurrently")
+def docker_image_multi(ctx):
+    app = ctx.load('docker')
+    return lambda i: app.lambda_handler(agent_event(
+        '/callBedrockModel', modelId=TITAN_IMAGE, prompt=f"A lighthouse at dusk, variation {i}", numberOfImages='4'
+    ), None)
+
+
+@scenario('docker.image.seeds', "docker /callBedrockModel, Titan Image with four seeds (four concurrent model requests)")
+def docker_image_seeds(ctx):
+    app = ctx.load('docker')
+    return lambda i: app.lambda_handler(agent_event(
+        '/callBedrockModel', modelId=TITAN_IMAGE, prompt=f"A lighthouse at dusk, variation {i}", seeds='[1, 2, 3, 4]'
+    ), None)
+
+
+@scenario('docker.image.v2', "docker /callBedrockModel, Titan Image v2 text-to-image (no reference image fetch)")
+def docker_image_v2(ctx):
+    app = ctx.load('docker')
+    return lambda i: app.lambda_handler(agent_event('/callBedrockModel', modelId=TITAN_IMAGE_V2, prompt=f"A lighthouse at dusk, variation {i}"), None)
+
+
+@scenario('docker.image.reference', "docker /callBedrockModel, Titan Image v2 IMAGE_VARIATION of the S3 reference image, scaled to fit the output")
+def docker_image_reference(ctx):
+    require('PIL')
+    app = ctx.load('docker')
+    ctx.put_reference_image()
+    return lambda i: app.lambda_handler(agent_event(
+        '/callBedrockModel', modelId=TITAN_IMAGE_V2, prompt=f"A lighthouse at dusk, variation {i}", conditioning='variation:0.7'
+    ), None)
+
+
+@scenario('docker.falcon', "docker /callFalconModel against the SageMaker endpoint")
+def docker_falcon(ctx):
+    app = ctx.load('docker')
+    return lambda i: app.lambda_handler(agent_event('/callFalconModel', prompt=f"Question {i}: what is Amazon SageMaker?"), None)
+
+
+@scenario('docker.fanout', f"docker /callMultipleModels across {len(FANOUT_MODELS)} text models")
+def docker_fanout(ctx):
+    app = ctx.load('docker')
+    model_ids = ','.join(FANOUT_MODELS)
+    return lambda i: app.lambda_handler(agent_event('/callMultipleModels', modelIds=model_ids, prompt=f"Question {i}: what is Amazon Bedrock?"), None)
+
+
+@scenario('docker.batch.throttled', "docker /callModelBatch of 50 prompts against a model that throttles above 4 concurrent calls",
+          iterations=5, model_concurrency=4, throttle_rate=0.01)
+def docker_batch_throttled(ctx):
+    import json
+
+    app = ctx.load('docker')
+
+    def call(i):
+        prompts = json.dumps([f"Batch {i} question {n}: what is Amazon Bedrock?" for n in range(50)])
+        response = app.lambda_handler(agent_event('/callModelBatch', modelId=TITAN_TEXT, prompts=prompts), None)
+        body = response_body(response)
+        if isinstance(body, dict) and 'throttles' in body:
+            ctx.note(throttles=body['throttles'], finalConcurrency=body['finalConcurrency'], failed=body['failed'])
+        return response
+    return call
+
+
+# --- streamlit_app/invoke_agent.py ---
+
+class RecordedResponse:
+    """The iter_content() side of a streamed requests.Response, replaying bytes in chunk_size pieces."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def iter_content(self, chunk_size=1):
+        view = memoryview(self.data)
+        for offset in range(0, len(view), chunk_size):
+            yield bytes(view[offset:offset + chunk_size])
+
+
+@scenario('agent.eventstream', "streamlit_app: decode a multi-MB agent event stream with traces (see --stream-mb and --stream-file)")
+def agent_eventstream(ctx):
+    require('requests')
+    from standin import agent_event_stream
+
+    invoke_agent = ctx.load('agent')
+    if ctx.settings.get('stream_file'):
+        with open(ctx.settings['stream_file'], 'rb') as f:
+            data = f.read()
+    else:
+        data = agent_event_stream(int(ctx.settings['stream_mb'] * 1024 * 1024))
+    ctx.bytes_per_call = len(data)
+    return lambda i: invoke_agent.decode_response(RecordedResponse(data))
+
+
+# --- Image handling ---
+
+@scenario('image.store.bytes', "ImageStore.put of the model's PNG bytes as returned (no decode)", s3_latency='const:0')
+def image_store_bytes(ctx):
+    from standin import make_png
+
+    image_store = ctx.load('docker').image_store
+    image_bytes = make_png(*ctx.standin.config.image_size)
+    return lambda i: image_store.put(image_bytes, f"request-{i}", {"modelId": TITAN_IMAGE, "seed": i})
+
+
+@scenario('image.store.pil_reencode', "PIL decode and PNG re-encode before ImageStore.put (the pre-zero-copy path)", s3_latency='const:0')
+def image_store_pil_reencode(ctx):
+    require('PIL')
+    import io
+
+    from PIL import Image
+    from standin import make_png
+
+    image_store = ctx.load('docker').image_store
+    image_bytes = make_png(*ctx.standin.config.image_size)
+
+    def call(i):
+        buffer = io.BytesIO()
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image.save(buffer, format='PNG')
+        return image_store.put(buffer.getvalue(), f"request-{i}", {"modelId": TITAN_IMAGE, "seed": i})
+    return call
+
+
+@scenario('image.store.multipart', "ImageStore.put of the model's PNG bytes as a multipart upload (threshold lowered below the image size)")
+def image_store_multipart(ctx):
+    require('boto3.s3.transfer')
+    from standin import make_png
+
+    image_store = ctx.load('docker').image_store
+    image_bytes = make_png(*ctx.standin.config.image_size)
+    image_store.multipart_threshold = len(image_bytes) // 2
+
+    def call(i):
+        before = ctx.standin.s3.multipart_uploads
+        image_key = image_store.put(image_bytes, f"request-{i}", {"modelId": TITAN_IMAGE, "seed": i})
+        ctx.note(multipartUploads=ctx.standin.s3.multipart_uploads - before)
+        return image_key
+    return call
+
+
+# --- LangChain Bedrock LLM against Converse (the text path before and after the switch) ---
+
+@scenario('text.converse.import', "Import of what the Converse text path adds to boto3 (the model registry)", cold=True)
+def converse_import(ctx):
+    start = time.perf_counter()
+    directory, _ = APPS['handler']
+    sys.path.insert(0, os.path.join(REPO, directory))
+    importlib.import_module('model_registry')
+    return {"importMs": (time.perf_counter() - start) * 1000}
+
+
+@scenario('text.langchain.import', "Import of what the former LangChain text path added to boto3 (langchain_community's Bedrock LLM)", cold=True)
+def langchain_import(ctx):
+    require('langchain_community')
+    start = time.perf_counter()
+    importlib.import_module('langchain_community.llms.bedrock')
+    return {"importMs": (time.perf_counter() - start) * 1000}
+
+
+@scenario('text.converse.call', "Per-call overhead of converse_text() with a zero-latency model", text_latency='const:0')
+def converse_call(ctx):
+    handler = ctx.load('handler')
+    client = ctx.standin.bedrock
+    spec = handler.get_model(TITAN_TEXT)
+    return lambda i: handler.converse_text(client, spec, f"Question {i}: what is Amazon Bedrock?")
+
+
+@scenario('text.langchain.call', "Per-call overhead of a LangChain Bedrock LLM built per request, with a zero-latency model", text_latency='const:0')
+def langchain_call(ctx):
+    require('langchain_community')
+    from langchain_community.llms.bedrock import Bedrock
+
+    client = ctx.standin.bedrock
+
+    def call(i):
+        # The former handler built the LLM object on every request
+        llm = Bedrock(client=client, model_id=TITAN_TEXT, model_kwargs={"maxTokenCount": 512, "temperature": 0, "topP": 0.9})
+        return llm.invoke(f"Question {i}: what is Amazon Bedrock?")
+    return call
@@ -0,0 +1,394 @@
+"""In-process stand-ins for Bedrock Runtime, S3, SageMaker Runtime and STS.
+
+The stand-in clients answer the calls the handlers make with canned responses. Latency,
+throttling and payload sizes are configurable. install() points boto3.client at them, so the
+handlers run unmodified and never reach AWS.
+"""
+import base64
+import io
+import json
+import random
+import struct
+import threading
+import time
+import zlib
+
+import boto3
+from botocore.exceptions import ClientError
+
+
+class Latency:
+    """A latency distribution, parsed from a spec in milliseconds.
+
+    'const:20' is always 20 ms, 'uniform:10:50' is 10-50 ms and 'lognormal:20:0.5' has a median of
+    20 ms with sigma 0.5 (a long right tail, like real model latencies).
+    """
+
+    def __init__(self, kind='const', a=0.0, b=0.0):
+        self.kind = kind
+        self.a = a
+        self.b = b
+
+    @classmethod
+    def parse(cls, spec):
+        kind, *args = str(spec).split(':')
+        if kind not in ('const', 'uniform', 'lognormal'):
+            raise ValueError(f"Unknown latency distribution {spec!r}")
+        values = [float(arg) for arg in args] + [0.0, 0.0]
+        return cls(kind, values[0], values[1])
+
+    def sample(self, rng):
+        """Returns one latency in seconds."""
+        if self.kind == 'uniform':
+            ms = rng.uniform(self.a, self.b)
+        elif self.kind == 'lognormal':
+            ms = rng.lognormvariate(0, self.b) * self.a if self.a else 0.0
+        else:
+            ms = self.a
+        return ms / 1000
+
+    def __str__(self):
+        return ':'.join([self.kind, f"{self.a:g}"] + ([f"{self.b:g}"] if self.kind != 'const' else []))
+
+
+class StandInConfig:
+    """Behaviour of the stand-in services.
+
+    throttle_rate is the probability that a Bedrock call is throttled, and model_concurrency caps
+    the calls one model serves at once (further calls are throttled, like a provisioned quota).
+    retry_after (seconds) is sent on throttles as a Retry-After header when set.
+    """
+
+    def __init__(self, text_latency='lognormal:20:0.5', image_latency='lognormal:60:0.4', s3_latency='const:2',
+                 sagemaker_latency='lognormal:15:0.3', throttle_rate=0.0, model_concurrency=None, retry_after=None,
+                 text_chars=1200, image_size=(1024, 1024), seed=1):
+        self.text_latency = Latency.parse(text_latency)
+        self.image_latency = Latency.parse(image_latency)
+        self.s3_latency = Latency.parse(s3_latency)
+        self.sagemaker_latency = Latency.parse(sagemaker_latency)
+        self.throttle_rate = throttle_rate
+        self.model_concurrency = model_concurrency
+        self.retry_after = retry_after
+        self.text_chars = text_chars
+        self.image_size = tuple(image_size)
+        self.seed = seed
+
+    def to_dict(self):
+        return {
+            "textLatency": str(self.text_latency),
+            "imageLatency": str(self.image_latency),
+            "s3Latency": str(self.s3_latency),
+            "sagemakerLatency": str(self.sagemaker_latency),
+            "throttleRate": self.throttle_rate,
+            "modelConcurrency": self.model_concurrency,
+            "retryAfter": self.retry_after,
+            "textChars": self.text_chars,
+            "imageSize": list(self.image_size),
+        }
+
+
+def make_png(width, height, seed=1):
+    """Returns a valid RGB PNG of the given size of random pixels.
+
+    Noise does not compress, so a 1024x1024 image is about 3 MB, the upper end of what the image
+    models return.
+    """
+    rng = random.Random(seed)
+    raw = b''.join(b'\x00' + rng.randbytes(width * 3) for _ in range(height))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(raw, 1)) + chunk(b'IEND', b'')
+
+
+def encode_event_frame(headers, payload):
+    """Encodes one application/vnd.amazon.eventstream frame with string headers and both CRCs."""
+    encoded_headers = b''
+    for name, value in headers.items():
+        name, value = name.encode('utf-8'), value.encode('utf-8')
+        encoded_headers += bytes([len(name)]) + name + b'\x07' + struct.pack('>H', len(value)) + value
+    prelude = struct.pack('>II', 16 + len(encoded_headers) + len(payload), len(encoded_headers))
+    message = prelude + struct.pack('>I', zlib.crc32(prelude)) + encoded_headers + payload
+    return message + struct.pack('>I', zlib.crc32(message))
+
+
+def agent_event_stream(target_bytes, answer_chars=4000, seed=1):
+    """Builds a recorded-style Bedrock agent response of about target_bytes.
+
+    The stream holds orchestration trace events with large prompts, rationales and action group
+    calls, followed by the answer in chunk events whose multi-byte UTF-8 characters are split
+    across events.
+    """
+    rng = random.Random(seed)
+    event_headers = {':event-type': 'trace', ':message-type': 'event', ':content-type': 'application/json'}
+    frames = []
+    size = 0
+    step = 0
+    while size < target_bytes:
+        step += 1
+        traces = [
+            {"modelInvocationInput": {"type": "ORCHESTRATION", "traceId": f"t{step}", "text": "x" * rng.randint(8000, 20000)}},
+            {"rationale": {"traceId": f"t{step}", "text": f"Step {step}: call the model to answer the question."}},
+            {"invocationInput": {"traceId": f"t{step}", "invocationType": "ACTION_GROUP", "actionGroupInvocationInput": {
+                "actionGroupName": "infer-models", "apiPath": "/callBedrockModel", "verb": "post"}}},
+            {"observation": {"traceId": f"t{step}", "type": "ACTION_GROUP", "actionGroupInvocationOutput": {
+                "text": "é" * rng.randint(500, 3000)}}},
+        ]
+        for trace in traces:
+            payload = json.dumps({"agentId": "BENCH", "trace": {"orchestrationTrace": trace}}).encode('utf-8')
+            frame = encode_event_frame(event_headers, payload)
+            frames.append(frame)
+            size += len(frame)
+
+    answer = ("Résumé — naïve café 東京 " * (answer_chars // 24 + 1))[:answer_chars].encode('utf-8')
+    chunk_headers = dict(event_headers, **{':event-type': 'chunk'})
+    for start in range(0, len(answer), 301):  # an odd size splits multi-byte characters between events
+        payload = json.dumps({"bytes": base64.b64encode(answer[start:start + 301]).decode('ascii')}).encode('utf-8')
+        frames.append(encode_event_frame(chunk_headers, payload))
+    return b''.join(frames)
+
+
+class StreamingBody:
+    """The read() side of botocore's StreamingBody."""
+
+    def __init__(self, data):
+        self._stream = io.BytesIO(data)
+
+    def read(self, amt=None):
+        return self._stream.read(amt)
+
+
+def _client_error(code, message, operation, headers=None):
+    return ClientError({
+        'Error': {'Code': code, 'Message': message},
+        'ResponseMetadata': {'HTTPStatusCode': 400, 'HTTPHeaders': headers or {}},
+    }, operation)
+
+
+class StandInService:
+    def __init__(self, config, rng, sleep=time.sleep):
+        self.config = config
+        self.rng = rng
+        self.sleep = sleep
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _wait(self, latency):
+        with self._lock:
+            self.calls += 1
+            seconds = latency.sample(self.rng)
+        if seconds:
+            self.sleep(seconds)
+
+
+class BedrockRuntime(StandInService):
+    """Canned Converse, ConverseStream and InvokeModel responses for text and image models."""
+
+    def __init__(self, config, rng, sleep=time.sleep):
+        super().__init__(config, rng, sleep)
+        self.throttles = 0
+        self.in_flight = {}
+        self.text = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * (config.text_chars // 57 + 1))[:config.text_chars]
+        self._png = None
+        self._variants = {}
+
+    @property
+    def png(self):
+        if self._png is None:
+            self._png = base64.b64encode(make_png(*self.config.image_size, seed=self.config.seed)).decode('ascii')
+        return self._png
+
+    def image(self, index):
+        """The base64 PNG returned as image index of a response. Every index differs by a text chunk, so
+        images of one response get distinct content-addressed keys without generating new pixels."""
+        if index == 0:
+            return self.png
+        if index not in self._variants:
+            data = base64.b64decode(self.png)
+            text = b'Comment\x00variant ' + str(index).encode('ascii')
+            chunk = struct.pack('>I', len(text)) + b'tEXt' + text + struct.pack('>I', zlib.crc32(b'tEXt' + text))
+            # The tEXt chunk goes before the 12-byte IEND chunk
+            self._variants[index] = base64.b64encode(data[:-12] + chunk + data[-12:]).decode('ascii')
+        return self._variants[index]
+
+    def _enter(self, model_id, operation, latency):
+        with self._lock:
+            in_flight = self.in_flight.get(model_id, 0)
+            limit = self.config.model_concurrency
+            if self.rng.random() < self.config.throttle_rate or (limit and in_flight >= limit):
+                self.throttles += 1
+                headers = {'retry-after': str(self.config.retry_after)} if self.config.retry_after else None
+                raise _client_error('ThrottlingException', 'Too many requests, please wait before trying again.', operation, headers)
+            self.in_flight[model_id] = in_flight + 1
+        try:
+            self._wait(latency)
+        except BaseException:
+            self._exit(model_id)
+            raise
+
+    def _exit(self, model_id):
+        with self._lock:
+            self.in_flight[model_id] -= 1
+
+    def _usage(self, messages):
+        prompt_chars = sum(len(block.get('text', '')) for message in messages for block in message['content'])
+        return {"inputTokens": prompt_chars // 4 + 1, "outputTokens": len(self.text) // 4,
+                "totalTokens": prompt_chars // 4 + 1 + len(self.text) // 4}
+
+    def converse(self, modelId, messages, **kwargs):
+        start = time.perf_counter()
+        self._enter(modelId, 'Converse', self.config.text_latency)
+        self._exit(modelId)
+        return {
+            "output": {"message": {"role": "assistant", "content": [{"text": self.text}]}},
+            "stopReason": "end_turn",
+            "usage": self._usage(messages),
+            "metrics": {"latencyMs": int((time.perf_counter() - start) * 1000)},
+        }
+
+    def converse_stream(self, modelId, messages, **kwargs):
+        start = time.perf_counter()
+        self._enter(modelId, 'ConverseStream', self.config.text_latency)
+        usage = self._usage(messages)
+
+        def events():
+            try:
+                yield {"messageStart": {"role": "assistant"}}
+                for offset in range(0, len(self.text), 32):
+                    yield {"contentBlockDelta": {"contentBlockIndex": 0, "delta": {"text": self.text[offset:offset + 32]}}}
+                yield {"contentBlockStop": {"contentBlockIndex": 0}}
+                yield {"messageStop": {"stopReason": "end_turn"}}
+                yield {"metadata": {"usage": usage, "metrics": {"latencyMs": int((time.perf_counter() - start) * 1000)}}}
+            finally:
+                self._exit(modelId)
+
+        return {"stream": events()}
+
+    def invoke_model(self, body, modelId, **kwargs):
+        request = json.loads(body)
+        image_model = modelId.startswith(('amazon.titan-image', 'stability.'))
+        self._enter(modelId, 'InvokeModel', self.config.image_latency if image_model else self.config.text_latency)
+        self._exit(modelId)
+
+        if 'taskType' in request:
+            count = request.get('imageGenerationConfig', {}).get('numberOfImages', 1)
+            response = {"images": [self.image(index) for index in range(count)], "error": None}
+        elif 'text_prompts' in request:
+            response = {"result": "success", "artifacts": [{"seed": 1, "base64": self.png, "finishReason": "SUCCESS"}]}
+        elif modelId.startswith('stability.'):
+            response = {"seeds": [1], "finish_reasons": [None], "images": [self.png]}
+        elif 'anthropic_version' in request:
+            response = {
+                "content": [{"type": "text", "text": self.text}],
+                "usage": {"input_tokens": len(body) // 4, "output_tokens": len(self.text) // 4},
+            }
+        elif 'inputText' in request:  # Titan text native body (LangChain path)
+            response = {"inputTextTokenCount": len(request['inputText']) // 4, "results": [
+                {"tokenCount": len(self.text) // 4, "outputText": self.text, "completionReason": "FINISH"}]}
+        else:
+            response = {"completion": self.text, "generation": self.text, "outputs": [{"text": self.text}]}
+        return {"body": StreamingBody(json.dumps(response).encode('utf-8')), "contentType": "application/json"}
+
+
+class S3(StandInService):
+    """In-memory S3 with ETags, conditional GETs, multipart uploads and presigned URLs."""
+
+    def __init__(self, config, rng, sleep=time.sleep):
+        super().__init__(config, rng, sleep)
+        self.objects = {}
+        self.version = 0
+        self.multipart_uploads = 0
+
+    def _store(self, bucket, key, data):
+        # A version number rather than an MD5, so hashing in the stand-in is not counted as handler time
+        with self._lock:
+            self.version += 1
+            etag = f'"{self.version}"'
+        self.objects[(bucket, key)] = (data, etag)
+        return etag
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._wait(self.config.s3_latency)
+        data = Body.read() if hasattr(Body, 'read') else Body
+        data = data.encode('utf-8') if isinstance(data, str) else bytes(data)
+        return {"ETag": self._store(Bucket, Key, data)}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Config=None, **kwargs):
+        """A multipart upload the way s3transfer runs it: create, the parts max_concurrency at a time, then complete."""
+        data = Fileobj.read()
+        chunksize = getattr(Config, 'multipart_chunksize', 8 * 1024 * 1024)
+        concurrency = getattr(Config, 'max_concurrency', 10)
+        parts = -(-len(data) // chunksize)
+        for _ in range(2 + -(-parts // concurrency)):
+            self._wait(self.config.s3_latency)
+        with self._lock:
+            self.multipart_uploads += 1
+        self._store(Bucket, Key, data)
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **kwargs):
+        self._wait(self.config.s3_latency)
+        if (Bucket, Key) not in self.objects:
+            raise _client_error('NoSuchKey', 'The specified key does not exist.', 'GetObject')
+        data, etag = self.objects[(Bucket, Key)]
+        if IfNoneMatch == etag:
+            raise _client_error('304', 'Not Modified', 'GetObject')
+        return {"Body": StreamingBody(data), "ETag": etag, "ContentLength": len(data)}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._wait(self.config.s3_latency)
+        if (Bucket, Key) not in self.objects:
+            raise _client_error('404', 'Not Found', 'HeadObject')
+        data, etag = self.objects[(Bucket, Key)]
+        return {"ETag": etag, "ContentLength": len(data)}
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600, **kwargs):
+        return f"https://{Params['Bucket']}.s3.amazonaws.com/{Params['Key']}?X-Amz-Expires={ExpiresIn}&X-Amz-Signature=bench"
+
+
+class SageMakerRuntime(StandInService):
+    """Canned text generation responses for the Falcon endpoint."""
+
+    def invoke_endpoint(self, EndpointName, Body, **kwargs):
+        self._wait(self.config.sagemaker_latency)
+        prompt = json.loads(Body)['inputs']
+        response = [{"generated_text": prompt + " " + "lorem ipsum " * 40}]
+        return {"Body": StreamingBody(json.dumps(response).encode('utf-8')), "ContentType": "application/json"}
+
+
+class STS(StandInService):
+    def get_caller_identity(self):
+        return {"Account": "123456789012", "Arn": "arn:aws:iam::123456789012:user/bench", "UserId": "bench"}
+
+
+class StandIn:
+    """One set of stand-in clients; install() makes boto3.client return them."""
+
+    def __init__(self, config=None):
+        self.config = config or StandInConfig()
+        rng = random.Random(self.config.seed)
+        self.bedrock = BedrockRuntime(self.config, rng)
+        self.s3 = S3(self.config, rng)
+        self.sagemaker = SageMakerRuntime(self.config, rng)
+        self.sts = STS(self.config, rng)
+        self.clients = {
+            'bedrock-runtime': self.bedrock,
+            's3': self.s3,
+            'sagemaker-runtime': self.sagemaker,
+            'sts': self.sts,
+        }
+        self._original_client = None
+
+    def client(self, service_name, *args, **kwargs):
+        return self.clients[service_name]
+
+    def install(self):
+        self._original_client = boto3.client
+        boto3.client = self.client
+        return self
+
+    def uninstall(self):
+        if self._original_client is not None:
+            boto3.client = self._original_client
+            self._original_client = None
@@ -0,0 +1,78 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class AIMDLimiter:
+    """Adaptive concurrency limit using additive increase / multiplicative decrease.
+
+    Every success raises the limit by 1/limit (about one slot per round of successful calls) and
+    every throttle multiplies it by decrease_factor, so concurrency settles just below the point
+    where the service starts throttling.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=16, decrease_factor=0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.in_flight = 0
+        self.throttles = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.throttles += 1
+                self.limit = max(self.minimum, self.limit * self.decrease_factor)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+def run_batch(items, call, is_throttled, limiter=None, max_attempts=4, base_delay=0.5, retry_after=None, sleep=time.sleep, executor=None):
+    """Runs call(item) for every item under an AIMD limiter and yields the results in input order.
+
+    A result for which is_throttled(result) is true releases its slot as a throttle and the item is
+    retried after a jittered exponential backoff, up to max_attempts times; the last result is
+    yielded either way. When retry_after(result) returns a number of seconds, such as the time
+    until an open circuit lets calls through again, the retry waits at least that long. Results
+    are yielded as soon as every earlier item has finished. The calls run on executor, which
+    should have at least limiter.maximum workers; without one a pool is created for the batch.
+    """
+    limiter = limiter or AIMDLimiter()
+
+    def run(item):
+        for attempt in range(max_attempts):
+            limiter.acquire()
+            throttled = False
+            try:
+                result = call(item)
+                throttled = is_throttled(result)
+            finally:
+                limiter.release(throttled)
+            if not throttled or attempt == max_attempts - 1:
+                return result
+            delay = random.uniform(0, base_delay * 2 ** attempt)
+            sleep(max(delay, (retry_after(result) if retry_after else None) or 0))
+        return result
+
+    if executor is None:
+        # The pool is sized to the limiter's ceiling; the limiter decides how many calls are in flight
+        with ThreadPoolExecutor(max_workers=limiter.maximum) as executor:
+            yield from run_batch(items, call, is_throttled, limiter, max_attempts, base_delay, retry_after, sleep, executor)
+        return
+    futures = [executor.submit(run, item) for item in items]
+    for future in futures:
+        yield future.result()
@@ -0,0 +1,98 @@
+import bisect
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+class LatencyHistogram:
+    """Log-bucketed latency histogram that favours recent samples.
+
+    Bucket bounds grow geometrically from min_seconds to max_seconds, so memory is fixed and a
+    percentile is accurate to within one growth factor. Once max_samples have been recorded all
+    counts are halved, which makes older samples fade out as the model's latency drifts.
+    """
+
+    def __init__(self, min_seconds=0.01, max_seconds=300, growth=1.2, max_samples=1000):
+        bounds = [min_seconds]
+        while bounds[-1] < max_seconds:
+            bounds.append(bounds[-1] * growth)
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+            self.total += 1
+            if self.total >= self.max_samples:
+                self.counts = [count // 2 for count in self.counts]
+                self.total = sum(self.counts)
+
+    def percentile(self, q):
+        """Returns the upper bound of the bucket holding the q-th percentile (0-100), or None when empty."""
+        with self._lock:
+            if not self.total:
+                return None
+            rank = self.total * q / 100
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if count and seen >= rank:
+                    return self.bounds[min(index, len(self.bounds) - 1)]
+            return self.bounds[-1]
+
+
+class LatencyTracker:
+    """Per-model latency histograms kept for the life of the warm container."""
+
+    def __init__(self, histogram_factory=LatencyHistogram):
+        self.histogram_factory = histogram_factory
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, model_id):
+        histogram = self._histograms.get(model_id)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(model_id, self.histogram_factory())
+        return histogram
+
+    def record(self, model_id, seconds):
+        self.histogram(model_id).record(seconds)
+
+    def hedge_delay(self, model_id, percentile, minimum_samples):
+        """Returns how long to wait for a model before hedging, or None until enough samples are recorded."""
+        histogram = self.histogram(model_id)
+        if histogram.total < minimum_samples:
+            return None
+        return histogram.percentile(percentile)
+
+
+def hedged_call(executor, primary, hedge, delay, is_failure=lambda result: False):
+    """Runs primary() and, if it has not finished after delay seconds, hedge() as well.
+
+    Returns (result, winner). winner is None when no hedge was sent (delay is None, or the primary
+    finished in time); otherwise it is 'primary' or 'hedge', whichever finished first without
+    raising and with a result that is not a failure. If both fail, the primary's outcome is
+    returned (or raised). The losing call is cancelled when it has not started yet and otherwise
+    left to finish in the background.
+    """
+    if delay is None:
+        return primary(), None
+    primary_future = executor.submit(primary)
+    if wait([primary_future], timeout=delay).done:
+        return primary_future.result(), None
+
+    hedge_future = executor.submit(hedge)
+    names = {primary_future: 'primary', hedge_future: 'hedge'}
+    pending = set(names)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        # Prefer the primary when both finish together
+        for future in sorted(done, key=lambda future: names[future] != 'primary'):
+            if future.exception() is None and not is_failure(future.result()):
+                for loser in pending:
+                    loser.cancel()
+                return future.result(), names[future]
+    return primary_future.result(), 'primary'
@@ -1,51 +1,154 @@
 import json
 import os
-import base64
 import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
 import boto3
-import io
-from PIL import Image
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from batch import AIMDLimiter, run_batch
+from hedging import LatencyTracker, hedged_call
+from metrics import MetricsLogger
+from model_registry import CONDITIONING, CONDITIONING_MODES, IMAGE, MULTIMODAL, STREAMING, TEXT, ModelResponseError, get_model, image_request_overrides, parse_seeds, stream_converse, titan_conditioned_request
+from profiling import Profiler, span
+from image_store import ImageStore, PresignedUrlCache, ReferenceImageCache, request_key, request_seed, sniff_image_format, transform_image
+from resilience import Resilience, ResilienceError, classify_error
+from response_cache import ResponseCache, cache_key
 
-# Initialize clients
-s3 = boto3.client('s3')
-sts_client = boto3.client('sts')
-account_id = sts_client.get_caller_identity().get('Account')
-region = boto3.Session().region_name
-bedrock = boto3.client(service_name='bedrock-runtime', region_name=region)
-sagemaker_runtime = boto3.client('sagemaker-runtime', region_name=region)
-
-# Set up environment variables
-bucket_name = f"bedrock-agent-images-{account_id}-{region}"
-os.environ['S3_IMAGE_BUCKET'] = bucket_name
+# Clients are created lazily on first use and cached for the life of the container,
+# so a cold start does not pay for clients (or an STS round trip) the request never needs.
+region = os.environ.get('AWS_REGION')
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Settings applied to every cached client; each can be overridden with an environment variable.
+# A call that times out on every attempt takes attempts x (connect + read) = 2 x 50s, plus at most
+# 8s of Resilience backoff for model calls, which stays below the 120s function timeout.
+client_config = Config(
+    max_pool_connections=int(os.environ.get('CLIENT_MAX_POOL_CONNECTIONS', 10)),
+    retries={
+        'mode': os.environ.get('CLIENT_RETRY_MODE', 'adaptive'),
+        'total_max_attempts': int(os.environ.get('CLIENT_MAX_ATTEMPTS', 2)),
+    },
+    connect_timeout=float(os.environ.get('CLIENT_CONNECT_TIMEOUT', 5)),
+    read_timeout=float(os.environ.get('CLIENT_READ_TIMEOUT', 45)),
+    tcp_keepalive=True,
+)
+# Bedrock runtime calls are retried in one place only: Resilience.call (RETRY_MAX_ATTEMPTS), or run_batch
+# for /callModelBatch. The client makes a single attempt, so every throttle reaches that layer at once.
+model_client_config = client_config.merge(Config(retries={'mode': 'standard', 'total_max_attempts': 1}))
+
+# Key of the reference image used by multimodal and image-conditioned requests
 object_name = 'the_image.png'
 logger = logging.getLogger(__name__)
 
-# Define model IDs
-TEXT_MODEL_IDS = [
-    # Add your list of text models here
-    "amazon.titan-text-premier-v1:0",
-    "amazon.titan-text-express-v1",
-    "amazon.titan-text-lite-v1",
-    "ai21.j2-ultra-v1",
-    "ai21.j2-mid-v1",
-    "anthropic.claude-3-sonnet-20240229-v1:0",
-    "anthropic.claude-3-haiku-20240307-v1:0",
-    "cohere.command-r-plus-v1:0",
-    "cohere.command-r-v1:0",
-    "meta.llama3-70b-instruct-v1:0",
-    "meta.llama3-8b-instruct-v1:0",
-    "mistral.mistral-large-2402-v1:0",
-    "mistral.mixtral-8x7b-instruct-v0:1",
-    "mistral.mistral-7b-instruct-v0:2",
-    "mistral.mistral-small-2402-v1:0"
-]
+
+def get_client(service_name, endpoint_url=None):
+    """Returns the cached boto3 client for a service (and optional endpoint), creating it on first use."""
+    key = (service_name, endpoint_url)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                config = model_client_config if service_name == 'bedrock-runtime' else client_config
+                client = boto3.client(service_name, region_name=region, endpoint_url=endpoint_url, config=config)
+                _clients[key] = client
+    return client
+
+
+def get_bucket_name():
+    """Returns the image bucket name from the S3_IMAGE_BUCKET environment variable.
+
+    Falls back to the stack's naming convention, resolved through STS once per container,
+    when the variable is not configured.
+    """
+    bucket = os.environ.get('S3_IMAGE_BUCKET')
+    if not bucket:
+        account_id = get_client('sts').get_caller_identity().get('Account')
+        bucket = f"bedrock-agent-images-{account_id}-{region or boto3.Session().region_name}"
+        os.environ['S3_IMAGE_BUCKET'] = bucket
+    return bucket
+
+
+# Generated images are stored under content-addressed keys in the image bucket
+image_store = ImageStore(lambda: get_client('s3'), get_bucket_name)
+presigned_urls = PresignedUrlCache(lambda: get_client('s3'))
+reference_images = ReferenceImageCache(lambda: get_client('s3'), get_bucket_name, object_name)
+
+# Per-model latency, token and cache metrics, flushed as CloudWatch EMF lines at the end of each invocation
+metrics = MetricsLogger.from_environment()
+
+# Per-invocation profiling, turned on by the 'profile' parameter or session attribute, or PROFILE_MODE
+profiler = Profiler.from_environment(lambda: get_client('s3'))
+
+# Per-model token buckets, circuit breakers and retries; configured through MODEL_QUOTAS, BREAKER_* and RETRY_*
+resilience = Resilience.from_environment()
+
+# Cache for temperature-0 text responses; configured through the RESPONSE_CACHE_* environment variables
+response_cache = ResponseCache.from_environment(get_client, get_bucket_name)
+
+
+# Supported models, their capabilities and request builders are registered in model_registry.py
 
 FALCON_MODEL_ENDPOINT = os.getenv('ENDPOINT')
 
+# Bounds for /callMultipleModels fan-out requests. Their model calls share one pool for the life of the
+# container, so concurrent calls are capped at FANOUT_MAX_WORKERS instead of starting threads per invocation
+FANOUT_MAX_MODELS = int(os.getenv('FANOUT_MAX_MODELS', 10))
+FANOUT_MAX_WORKERS = int(os.getenv('FANOUT_MAX_WORKERS', 10))
+FANOUT_TIMEOUT_SECONDS = float(os.getenv('FANOUT_TIMEOUT_SECONDS', 90))
+model_executor = ThreadPoolExecutor(max_workers=FANOUT_MAX_WORKERS, thread_name_prefix='model')
+
+# Most images one image request may generate, over all of its seeds
+IMAGE_MAX_IMAGES = int(os.getenv('IMAGE_MAX_IMAGES', 10))
+# The requests of a multi-seed image call run on one pool and their images are stored on another,
+# so a request waiting for its uploads never holds a thread those uploads need
+IMAGE_MAX_WORKERS = int(os.getenv('IMAGE_MAX_WORKERS', 8))
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_MAX_WORKERS, thread_name_prefix='image')
+upload_executor = ThreadPoolExecutor(max_workers=IMAGE_MAX_WORKERS, thread_name_prefix='upload')
+
+# Bounds for /callModelBatch requests; results larger than BATCH_INLINE_MAX_BYTES are written to S3 as JSONL.
+# The whole batch runs within one 120s invocation, so BATCH_MAX_PROMPTS stays at a few rounds of BATCH_MAX_CONCURRENCY
+BATCH_MAX_PROMPTS = int(os.getenv('BATCH_MAX_PROMPTS', 50))
+BATCH_INITIAL_CONCURRENCY = int(os.getenv('BATCH_INITIAL_CONCURRENCY', 4))
+BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', 16))
+# Batch calls run on one pool for the life of the container, sized to the limiter's ceiling
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_CONCURRENCY, thread_name_prefix='batch')
+BATCH_INLINE_MAX_BYTES = int(os.getenv('BATCH_INLINE_MAX_BYTES', 20000))
+# Error classes that make /callModelBatch back off. Batch throttles are left to the AIMD limiter and never
+# open the circuit breaker, but an open circuit (from timeouts or other callers) is waited out like a throttle
+THROTTLING_ERROR_CLASSES = {'throttled', 'rate_limited', 'circuit_open'}
+
+# Opt-in hedged requests for single text model calls: once a call runs past HEDGE_PERCENTILE of the model's
+# recent latency, a second request goes to the same model or to its HEDGE_FALLBACK_MODELS entry.
+# A hedge is billed like any other request, so it is off unless HEDGE_ENABLED is 'true'
+HEDGE_ENABLED = os.getenv('HEDGE_ENABLED', 'false').lower() == 'true'
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', 95))
+HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', 20))
+HEDGE_MAX_WORKERS = int(os.getenv('HEDGE_MAX_WORKERS', 16))
+HEDGE_FALLBACK_MODELS = json.loads(os.getenv('HEDGE_FALLBACK_MODELS') or '{}')
+
+# Per-model latency histograms that drive the hedge thresholds, kept for the life of the container
+latency_tracker = LatencyTracker()
+hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix='hedge')
+
+# Clean responses keep the answer text free of the latency/token footer; the numbers stay in their own fields.
+# Can also be set per request with the 'cleanResponse' parameter
+CLEAN_RESPONSES = os.getenv('CLEAN_RESPONSES', 'false').lower() == 'true'
+
+# Opt in to ConverseStream for text models; can also be set per request with the 'stream' parameter
+STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', 'false').lower() == 'true'
+
 def get_named_parameter(event, name):
     return next(item for item in event['parameters'] if item['name'] == name)['value']
 
+def get_optional_parameter(event, name, default=None):
+    """Returns the value of an optional action group parameter, or the default when it is absent."""
+    return next((item['value'] for item in event.get('parameters', []) if item['name'] == name), default)
+
 def lambda_handler(event, context):
     print(event)
     
@@ -53,179 +156,538 @@ def lambda_handler(event, context):
     # Determine the API path
     api_path = event['apiPath']
 
-    if api_path == '/callBedrockModel':
-        return call_model(event)
-    elif api_path == '/callFalconModel':
-        return call_falcon_model(event)
-    else:
-        return build_response(404, 'Invalid API path', event)
+    profile = profiler.start(event)
+    try:
+        if api_path == '/callBedrockModel':
+            response = call_model(event)
+        elif api_path == '/callFalconModel':
+            response = call_falcon_model(event)
+        elif api_path == '/callMultipleModels':
+            response = call_multiple_models(event)
+        elif api_path == '/callModelBatch':
+            response = call_model_batch(event)
+        else:
+            response = build_response(404, 'Invalid API path', event)
+    finally:
+        metrics.flush(ApiPath=api_path)
+        profiler.finish(profile)
+    return profiler.attach(profile, response, event)
 
 def call_model(event):
     """Handles requests for text/image models."""
-    model_id = get_named_parameter(event, 'modelId')
-    prompt = get_named_parameter(event, 'prompt')
+    with span('params'):
+        model_id = get_named_parameter(event, 'modelId')
+        prompt = get_named_parameter(event, 'prompt')
+        output_format = get_optional_parameter(event, 'outputFormat')
+        number_of_images = get_optional_parameter(event, 'numberOfImages', 1)
+        seeds = get_optional_parameter(event, 'seeds')
+        conditioning = get_optional_parameter(event, 'conditioning')
+        stream = str(get_optional_parameter(event, 'stream', STREAM_RESPONSES)).lower() == 'true'
+        clean = str(get_optional_parameter(event, 'cleanResponse', CLEAN_RESPONSES)).lower() == 'true'
 
     print(f"MODEL ID: {model_id}")
     print(f"PROMPT: {prompt}")
 
-    # Call appropriate function based on the model ID
-    if model_id.startswith('amazon.titan-image'):
-        result = get_image_response(model_id, prompt)
+    # Dispatch on the model's registered capabilities
+    spec = get_model(model_id)
+    if spec is not None and spec.supports(IMAGE):
+        result = get_image_response(model_id, prompt, output_format, number_of_images, seeds, conditioning)
     else:
-        result = get_text_response(model_id, prompt)
+        result = get_text_response(model_id, prompt, stream=stream, clean=clean)
 
     return build_response(200, result, event)
 
+def call_multiple_models(event):
+    """Runs one prompt against several text models concurrently and returns per-model results."""
+    with span('params'):
+        model_ids = parse_model_ids(get_named_parameter(event, 'modelIds'))
+        prompt = get_named_parameter(event, 'prompt')
+
+    print(f"MODEL IDS: {model_ids}")
+    print(f"PROMPT: {prompt}")
+
+    if not model_ids:
+        return build_response(400, {"error": "No model IDs provided"}, event)
+    if len(model_ids) > FANOUT_MAX_MODELS:
+        return build_response(400, {"error": f"At most {FANOUT_MAX_MODELS} models can be called at once"}, event)
+
+    results = fan_out(model_ids, prompt)
+    failed = sum(1 for item in results if 'error' in item)
+    return build_response(200, {"results": results, "succeeded": len(results) - failed, "failed": failed}, event)
+
+def parse_model_ids(value):
+    """Accepts a JSON array or a comma-separated string of model IDs; duplicates are dropped."""
+    try:
+        model_ids = json.loads(value)
+    except ValueError:
+        model_ids = value.strip().strip('[]').split(',')
+    if not isinstance(model_ids, list):
+        model_ids = [value]
+    model_ids = (str(model_id).strip().strip('"\'') for model_id in model_ids)
+    return list(dict.fromkeys(model_id for model_id in model_ids if model_id))
+
+def fan_out(model_ids, prompt, timeout=FANOUT_TIMEOUT_SECONDS):
+    """Invokes the models on the shared model pool; slow or failing models only affect their own entry."""
+    def timed_call(model_id):
+        start = time.perf_counter()
+        result = get_text_response(model_id, prompt)
+        return dict(result, modelId=model_id, wallTimeMs=int((time.perf_counter() - start) * 1000))
+
+    futures = [model_executor.submit(timed_call, model_id) for model_id in model_ids]
+    wait(futures, timeout=timeout)
+    # Don't block the invocation on models that are still running past the deadline; calls that
+    # have not started yet are dropped from the pool's queue
+    for future in futures:
+        future.cancel()
+
+    results = []
+    for model_id, future in zip(model_ids, futures):
+        if future.cancelled() or not future.done():
+            results.append({"modelId": model_id, "error": f"Timed out after {timeout:g}s"})
+        elif future.exception() is not None:
+            logger.error(f"Fan-out error for {model_id}: {str(future.exception())}")
+            results.append({"modelId": model_id, "error": "Model invocation error"})
+        else:
+            results.append(future.result())
+    return results
+
+def call_model_batch(event):
+    """Runs a list of prompts against one text model, adapting concurrency to throttling."""
+    with span('params'):
+        model_id = get_named_parameter(event, 'modelId')
+        prompts = parse_prompts(get_named_parameter(event, 'prompts'))
+
+    print(f"MODEL ID: {model_id}")
+    print(f"PROMPTS: {len(prompts)}")
+
+    spec = get_model(model_id)
+    if spec is None or not spec.supports(TEXT):
+        return build_response(400, {"error": "Unsupported text model ID"}, event)
+    if not prompts:
+        return build_response(400, {"error": "No prompts provided"}, event)
+    if len(prompts) > BATCH_MAX_PROMPTS:
+        return build_response(400, {"error": f"At most {BATCH_MAX_PROMPTS} prompts can be run in one batch"}, event)
+
+    client = get_client('bedrock-runtime')
+    limiter = AIMDLimiter(initial=BATCH_INITIAL_CONCURRENCY, maximum=BATCH_MAX_CONCURRENCY)
+    results = run_batch(
+        prompts,
+        # run_batch owns the retries of a batch, so the AIMD limiter sees every throttle
+        lambda prompt: invoke_bedrock_model(client, model_id, prompt, max_attempts=1, trip_on_throttle=False),
+        lambda result: result.get('errorClass') in THROTTLING_ERROR_CLASSES,
+        limiter=limiter,
+        retry_after=lambda result: result.get('retryAfterMs', 0) / 1000,
+        executor=batch_executor
+    )
+
+    lines = []
+    failed = 0
+    for index, result in enumerate(results):
+        failed += 'error' in result
+        lines.append(json.dumps(dict(result, index=index)))
+
+    summary = {
+        "modelId": model_id,
+        "succeeded": len(lines) - failed,
+        "failed": failed,
+        "throttles": limiter.throttles,
+        "finalConcurrency": int(limiter.limit)
+    }
+    if sum(len(line) for line in lines) <= BATCH_INLINE_MAX_BYTES:
+        return build_response(200, dict(summary, results=[json.loads(line) for line in lines]), event)
+
+    # Large result sets don't fit in an action group response, so hand back a JSONL object instead
+    s3 = get_client('s3')
+    bucket_name = get_bucket_name()
+    results_key = f"batch-results/{uuid.uuid4()}.jsonl"
+    with span('s3_upload'):
+        s3.put_object(Bucket=bucket_name, Key=results_key, Body='\n'.join(lines).encode('utf-8'), ContentType='application/x-ndjson')
+    with span('presign'):
+        results_url = s3.generate_presigned_url('get_object', Params={'Bucket': bucket_name, 'Key': results_key}, ExpiresIn=3600)
+    return build_response(200, dict(summary, resultsUrl=results_url), event)
+
+def parse_conditioning(value):
+    """Parses 'mode' or 'mode:strength' (for example 'variation:0.7' or 'canny:0.5') into (mode, strength or None)."""
+    mode, _, strength = str(value).strip().lower().partition(':')
+    if mode not in CONDITIONING_MODES:
+        raise ValueError(f"unknown mode {mode!r}, use one of {', '.join(CONDITIONING_MODES)}")
+    if not strength.strip():
+        return mode, None
+    strength = float(strength)
+    minimum = 0.2 if mode == 'variation' else 0.0
+    if not minimum <= strength <= 1.0:
+        raise ValueError(f"{mode} strength must be between {minimum:g} and 1")
+    return mode, strength
+
+def parse_prompts(value):
+    """Accepts a JSON array of prompts or one prompt per line."""
+    try:
+        prompts = json.loads(value)
+    except ValueError:
+        prompts = value.splitlines()
+    if not isinstance(prompts, list):
+        prompts = [value]
+    return [str(prompt).strip() for prompt in prompts if str(prompt).strip()]
+
 def call_falcon_model(event):
     """Handles inference with Falcon model deployed on SageMaker."""
-    prompt = get_named_parameter(event, 'prompt')
+    with span('params'):
+        prompt = get_named_parameter(event, 'prompt')
 
     try:
-        response = sagemaker_runtime.invoke_endpoint(
-            EndpointName=FALCON_MODEL_ENDPOINT,
-            ContentType='application/json',
-            Body=json.dumps({"inputs": prompt})  # Corrected here
-        )
-        
-        response_body = json.loads(response['Body'].read().decode())
+        with metrics.timer(FALCON_MODEL_ENDPOINT, 'LatencyMs'), span('sagemaker_call'):
+            response_body = invoke_falcon_endpoint(prompt)
+
         result = {"result": response_body}
         return build_response(200, result, event)
 
     except ClientError as e:
         logger.error(f"Error calling Falcon model: {str(e)}")
+        metrics.record(FALCON_MODEL_ENDPOINT, Errors=1)
         return build_response(500, 'Error calling Falcon model', event)
 
+def invoke_falcon_endpoint(prompt):
+    """Invokes the Falcon endpoint and reads its JSON response."""
+    response = get_client('sagemaker-runtime').invoke_endpoint(
+        EndpointName=FALCON_MODEL_ENDPOINT,
+        ContentType='application/json',
+        Body=json.dumps({"inputs": prompt})  # Corrected here
+    )
+    return json.loads(response['Body'].read().decode())
 
-def get_text_response(model_id, prompt):
-    """Handles text-based models."""
-    if model_id in TEXT_MODEL_IDS:
-        return invoke_bedrock_model(bedrock, model_id, prompt)
+
+def get_text_response(model_id, prompt, stream=False, clean=CLEAN_RESPONSES):
+    """Handles text-based models; streaming is only used for models that support ConverseStream."""
+    spec = get_model(model_id)
+    if spec is not None and spec.supports(TEXT):
+        stream = stream and spec.supports(STREAMING)
+        # Multimodal models see the reference image with the prompt whenever it exists, as in infer-models
+        image = None
+        if spec.supports(MULTIMODAL):
+            image = fetch_reference_image(model_id)
+        if HEDGE_ENABLED and not stream:
+            return invoke_hedged(get_client('bedrock-runtime'), model_id, prompt, clean=clean, image=image)
+        return invoke_bedrock_model(get_client('bedrock-runtime'), model_id, prompt, stream=stream, clean=clean, image=image)
     else:
         logger.error(f"Unsupported text model ID: {model_id}")
         return {"error": "Unsupported text model ID"}
 
-def get_image_response(model_id, prompt):
-    """Handles image generation models."""
-    if model_id == 'amazon.titan-image-generator-v1':
-        return generate_image_request_v1(model_id, prompt)
-    
-    elif model_id == 'amazon.titan-image-generator-v2:0':
-        return generate_image_request_v2(model_id, prompt)
-    
-    elif model_id == 'stability.stable-diffusion-xl-v1':
-          request_body = json.dumps({
-                "text_prompts":[
-                    {
-                        "text": prompt
-                    }],
-                "cfg_scale":10,
-                "seed": 4294967295,
-                "steps":50
-        })        
-
-    elif model_id == 'stability.sd3-large-v1:0' or model_id == 'stability.stable-image-core-v1:0' or model_id == 'stability.stable-image-ultra-v1:0':
-        request_body = json.dumps({
-                "prompt": prompt
-        })  
-        return request_body
-    
-    else:
+def invoke_hedged(client, model_id, prompt, clean=CLEAN_RESPONSES, image=None):
+    """Invokes a text model and hedges the call when it runs long.
+
+    Once the model has HEDGE_MIN_SAMPLES recorded latencies, a call still running after the model's
+    HEDGE_PERCENTILE latency gets a second request to the fallback model (or the same model). The
+    first successful answer is returned, with a 'hedge' entry saying which request won.
+    """
+    fallback_id = HEDGE_FALLBACK_MODELS.get(model_id, model_id)
+    fallback = get_model(fallback_id)
+    if fallback is None or not fallback.supports(TEXT):
+        fallback_id = model_id
+    delay = latency_tracker.hedge_delay(model_id, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+
+    def timed_call(target_id):
+        def call():
+            start = time.perf_counter()
+            result = invoke_bedrock_model(client, target_id, prompt, clean=clean, image=image)
+            # Latencies of losing requests are recorded too, so the histogram keeps seeing the tail
+            if 'error' not in result and not result.get('cache', {}).get('hit'):
+                latency_tracker.record(target_id, time.perf_counter() - start)
+            return result
+        return call
+
+    result, winner = hedged_call(
+        hedge_executor, timed_call(model_id), timed_call(fallback_id), delay, lambda result: 'error' in result
+    )
+    if winner is None:
+        return result
+    metrics.record(model_id, Hedged=1)
+    return dict(result, hedge={
+        "winner": winner,
+        "modelId": model_id if winner == 'primary' else fallback_id,
+        "delayMs": int(delay * 1000)
+    })
+
+def get_image_response(model_id, prompt, output_format=None, number_of_images=1, seeds=None, conditioning=None):
+    """Handles image generation models: numberOfImages images per seed, returned as a manifest of presigned URLs.
+
+    conditioning ('variation', 'canny' or 'segmentation', optionally with ':strength') generates
+    from the S3 reference image; without it the reference image is never fetched.
+    """
+    spec = get_model(model_id)
+    if spec is None or not spec.supports(IMAGE):
         logger.error(f"Unsupported image model ID: {model_id}")
         return {"error": "Unsupported image model ID"}
 
-def generate_image_request_v1(model_id, prompt):
-    """Handles requests for amazon.titan-image-generator-v1."""
-    request_body = json.dumps({
-        "taskType": "TEXT_IMAGE",
-        "textToImageParams": {
-            "text": prompt
-        },
-        "imageGenerationConfig": {
-            "numberOfImages": 1,
-            "quality": "standard",
-            "height": 1024,
-            "width": 1024,
-            "cfgScale": 7.5,
-            "seed": 42
-        }
-    })
-    return generate_image(model_id, request_body)
+    try:
+        count = int(number_of_images)
+        seeds = parse_seeds(seeds)
+        overrides = image_request_overrides(spec, count, seeds)
+    except ValueError as e:
+        return {"error": f"Invalid image parameters: {str(e)}"}
+    if count * len(seeds or [None]) > IMAGE_MAX_IMAGES:
+        return {"error": f"At most {IMAGE_MAX_IMAGES} images can be generated at once"}
+
+    if conditioning:
+        if not spec.supports(CONDITIONING):
+            return {"error": f"{spec.label} does not support reference image conditioning"}
+        # The reference image is fetched while the conditioning is parsed and the request bodies are prepared
+        reference = image_executor.submit(fetch_reference_image, model_id)
+        try:
+            mode, strength = parse_conditioning(conditioning)
+        except ValueError as e:
+            return {"error": f"Invalid conditioning: {str(e)}"}
+        return generate_image_request_v2(model_id, prompt, output_format, overrides, mode, strength, reference)
+    with span('request_build'):
+        request_bodies = [spec.request(prompt, **request_overrides) for request_overrides in overrides]
+    return generate_images(model_id, request_bodies, output_format)
+
+def generate_image_request_v2(model_id, prompt, output_format=None, overrides=({},), mode='variation', strength=None, reference=None):
+    """Handles amazon.titan-image-generator-v2:0 requests conditioned on the reference image.
 
-def generate_image_request_v2(model_id, prompt):
-    """Handles requests for amazon.titan-image-generator-v2:0 with reference image."""
-    reference_image_base64 = fetch_image_from_s3()
-    if not reference_image_base64:
+    reference is a future for the reference image that was started by the caller; without one the
+    image is fetched here. The reference image is scaled down to fit the output size before it is
+    encoded into the request bodies; the scaled copy is kept with the cached image until its ETag changes.
+    """
+    spec = get_model(model_id)
+    config = dict(spec.defaults, **overrides[0])
+    reference = reference.result() if reference is not None else fetch_reference_image(model_id)
+    if reference is None:
         return {"error": "Failed to fetch reference image from S3"}
-    
-    request_body = json.dumps({
-        "taskType": "TEXT_IMAGE",
-        "textToImageParams": {
-            "text": prompt
-        },
-        "imageGenerationConfig": {
-            "numberOfImages": 1,
-            "quality": "premium",
-            "height": 768,
-            "width": 1280,
-            "cfgScale": 7.5,
-            "seed": 42
-        }
-    })
-    return generate_image(model_id, request_body)
 
-def generate_image(model_id, body):
-    """Generates an image and uploads it to S3."""
+    with span('request_build'):
+        try:
+            image = reference.fit_base64(config['width'], config['height'])
+        except ValueError as e:
+            return {"error": f"Unusable reference image: {str(e)}"}
+        request_bodies = [
+            titan_conditioned_request(spec, prompt, image, mode, strength, **request_overrides)
+            for request_overrides in overrides
+        ]
+    return generate_images(model_id, request_bodies, output_format)
+
+def fetch_reference_image(model_id):
+    """Fetches the reference image for a model call, timed as the model's S3 time."""
+    with metrics.timer(model_id, 'S3Ms'), span('s3_fetch'):
+        return fetch_image_from_s3()
+
+def invoke_image_model(model_id, body):
+    """Invokes an image model under its rate limits and reads the response."""
+    response = resilience.call(model_id, lambda: get_client('bedrock-runtime').invoke_model(
+        body=body, modelId=model_id, accept="application/json", contentType="application/json"
+    ))
+    return response.get("body").read()
+
+def decode_images(model_id, payload):
+    """Parses an image model response into the bytes of its images."""
+    return get_model(model_id).parse_response(json.loads(payload))
+
+def image_manifest(urls, seed, served=False):
+    """The response for generated images: the first URL as image_url, and every URL with the seed of its request.
+
+    A Titan request returns all images of its seed, so they share requestSeed; it is None when the model picked the seed.
+    """
+    if len(urls) == 1:
+        message = "Image served from the image store" if served else "Image generated successfully"
+    else:
+        message = f"{len(urls)} images {'served from the image store' if served else 'generated successfully'}"
+    return {"message": message, "image_url": urls[0], "images": [{"url": url, "requestSeed": seed} for url in urls]}
+
+def generate_images(model_id, bodies, output_format=None):
+    """Runs the image requests concurrently and merges their manifests; failed requests are listed under errors."""
+    if len(bodies) == 1:
+        return generate_image(model_id, bodies[0], output_format)
+    results = list(image_executor.map(lambda body: generate_image(model_id, body, output_format), bodies))
+    images = [image for result in results for image in result.get('images', ())]
+    errors = [result for result in results if 'error' in result]
+    if not images:
+        return errors[0]
+    response = {"message": f"{len(images)} images ready", "image_url": images[0]['url'], "images": images}
+    if errors:
+        response["errors"] = errors
+    return response
+
+def prepare_image(image_bytes, metadata, output_format=None):
+    """Converts one generated image if asked to and returns (bytes, content-addressed key)."""
+    if output_format and output_format != sniff_image_format(image_bytes)[0]:
+        with span('image_decode'):
+            image_bytes = transform_image(image_bytes, output_format)
+    return image_bytes, image_store.image_key(image_bytes, metadata)
+
+def upload_image(image_bytes, image_key):
+    with span('s3_upload'):
+        image_store.upload(image_bytes, image_key)
+
+def generate_image(model_id, body, output_format=None):
+    """Generates the images of one request, stores them under content-addressed keys and returns their presigned URLs.
+
+    Requests with a fixed seed that were already generated are served from the image store
+    without calling Bedrock again. The model's bytes are uploaded as returned unless an
+    output_format ('png', 'jpeg' or 'webp') other than the model's own is requested. Each
+    image is converted, hashed and uploaded on the upload pool while this thread presigns the
+    keys; for a fixed seed the request index is written once all of them are stored.
+    """
     try:
-        response = bedrock.invoke_model(
-            body=body, modelId=model_id, accept="application/json", contentType="application/json"
-        )
-        response_body = json.loads(response.get("body").read())
-        base64_image = response_body.get("images")[0]
-        image_bytes = base64.b64decode(base64_image)
-
-        # Save and upload image
-        local_image_path = "/tmp/generated_image.png"
-        image = Image.open(io.BytesIO(image_bytes))
-        image.save(local_image_path)
-        s3.upload_file(local_image_path, bucket_name, object_name)
-
-        presigned_url = s3.generate_presigned_url('get_object', Params={'Bucket': bucket_name, 'Key': object_name}, ExpiresIn=3600)
-        return {"message": "Image generated successfully", "image_url": presigned_url}
+        output_format = output_format.lower().replace('jpg', 'jpeg') if output_format else None
+        if output_format not in (None, 'png', 'jpeg', 'webp'):
+            return {"error": f"Unsupported output format: {output_format}"}
+        request_id = request_key(model_id, {"request": json.loads(body), "outputFormat": output_format} if output_format else body)
+        seed = request_seed(body)
+        with metrics.timer(model_id, 'S3Ms'), span('cache_lookup'):
+            image_keys = image_store.lookup(request_id) if seed is not None else None
+        metrics.record(model_id, CacheHit=int(image_keys is not None) if seed is not None else None)
+
+        if image_keys is not None:
+            with metrics.timer(model_id, 'S3Ms'), span('presign'):
+                presigned = presigned_urls.get_urls(get_bucket_name(), image_keys, 3600)
+            return image_manifest(presigned, seed, served=True)
+
+        with metrics.timer(model_id, 'LatencyMs'), span('bedrock_call'):
+            payload = invoke_image_model(model_id, body)
+        with span('image_decode'):
+            images = decode_images(model_id, payload)
+
+        # Upload straight from memory under keys derived from each image and its request. The keys
+        # are known before the uploads finish, so the URLs are presigned while the uploads run
+        metadata = {"modelId": model_id, "seed": seed}
+        with metrics.timer(model_id, 'S3Ms'):
+            prepared = list(upload_executor.map(lambda image_bytes: prepare_image(image_bytes, metadata, output_format), images))
+            uploads = [upload_executor.submit(upload_image, image_bytes, image_key) for image_bytes, image_key in prepared]
+            image_keys = [image_key for _, image_key in prepared]
+            with span('presign'):
+                urls = presigned_urls.get_urls(get_bucket_name(), image_keys, 3600)
+            for upload in uploads:
+                upload.result()
+            # Only fixed-seed requests are ever looked up again, so only they get an index object
+            if seed is not None:
+                with span('s3_upload'):
+                    image_store.record(request_id, metadata, image_keys)
+        return image_manifest(urls, seed)
 
+    except ResilienceError as err:
+        logger.error(f"Image model error for {model_id}: {err.error_class}: {str(err)}")
+        metrics.record(model_id, Errors=1)
+        return err.to_response()
     except ClientError as err:
         logger.error(f"Client error: {str(err)}")
-        return {"error": "Client error occurred"}
+        return dict(classify_error(err).to_response(), error="Client error occurred")
+    except ModelResponseError as err:
+        logger.error(str(err))
+        return {"error": str(err)}
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
         return {"error": str(e)}
 
 def fetch_image_from_s3():
-    """Fetches an image from S3 and returns it as a base64-encoded string."""
-    image_content = io.BytesIO()
+    """Fetches the reference image from S3 and returns it as a ReferenceImage, or None.
+
+    The image is kept in the warm container and only downloaded again when its ETag changes.
+    """
     try:
-        s3.download_fileobj(bucket_name, object_name, image_content)
-        image_content.seek(0)  
-        return base64.b64encode(image_content.getvalue()).decode('utf-8')
+        reference = reference_images.get()
+        if reference is None:
+            logger.error(f"Reference image {object_name} does not exist")
+        return reference
     except Exception as e:
         logger.error(f"Error fetching image from S3: {str(e)}")
         return None
 
-def invoke_bedrock_model(client, model_id, prompt, max_tokens=2000, temperature=0, top_p=0.9):
-    """Invokes Bedrock text generation API."""
+def format_usage_footer(latency_ms, usage):
+    """Formats the latency/token footer appended to text model answers."""
+    return '\n--- Latency: ' + str(latency_ms) \
+        + 'ms - Input tokens:' + str(usage['inputTokens']) \
+        + ' - Output tokens:' + str(usage['outputTokens']) + ' ---\n'
+
+def with_usage_footer(response_body, clean):
+    """Appends the usage footer to the answer text, unless a clean response was requested."""
+    if clean:
+        return response_body
+    return dict(response_body, result=response_body['result'] + format_usage_footer(response_body['latencyMs'], response_body['usage']))
+
+def invoke_bedrock_model(client, model_id, prompt, stream=False, clean=CLEAN_RESPONSES, max_attempts=None, trip_on_throttle=True, image=None):
+    """Invokes Bedrock text generation API with the model's registered inference defaults.
+
+    With stream=True the answer is read from ConverseStream and the time to first token
+    is returned alongside the result. image (a ReferenceImage) is sent with the prompt to
+    multimodal models and ignored by the others. Deterministic (temperature 0) answers are
+    served from the response cache when possible. Calls go through the model's rate limits and
+    circuit breaker, retried up to max_attempts times (RETRY_MAX_ATTEMPTS by default);
+    trip_on_throttle=False keeps throttles from opening the breaker. A failure comes back as an
+    error entry with its errorClass (see resilience.py).
+    Unless clean is set, the latency/token footer is appended to the answer text.
+    """
+    spec = get_model(model_id)
+    image = image if spec.supports(MULTIMODAL) else None
+    with span('request_build'):
+        request = build_text_request(spec, prompt, image)
+    config = request['inferenceConfig']
+    key = None
+    if response_cache is not None and config.get('temperature') == 0:
+        with span('cache_lookup'):
+            key = cache_key(model_id, prompt, config, image.etag if image is not None else None)
+            cached = response_cache.get(key)
+        if cached is not None:
+            metrics.record(model_id, CacheHit=1)
+            return with_usage_footer(dict(cached, cache=response_cache.stats(hit=True)), clean)
+
+    def invoke():
+        if stream:
+            stream_metrics = {}
+            parts = []
+            for delta in stream_bedrock_model(client, model_id, prompt, stream_metrics, request):
+                parts.append(delta)
+            return {
+                "result": ''.join(parts),
+                "latencyMs": stream_metrics['latencyMs'],
+                "usage": stream_metrics['usage'],
+                "timeToFirstTokenMs": stream_metrics.get('timeToFirstTokenMs')
+            }
+        text, usage, latency_ms = spec.parse_response(client.converse(**request))
+        return {"result": text, "latencyMs": latency_ms, "usage": usage}
+
     try:
-        response = client.converse(
-            modelId=model_id,
-            messages=[{"role": "user", "content": [{"text": prompt}]}],
-            inferenceConfig={"temperature": temperature, "maxTokens": max_tokens, "topP": top_p}
-        )
-        result = response['output']['message']['content'][0]['text'] \
-            + '\n--- Latency: ' + str(response['metrics']['latencyMs']) \
-            + 'ms - Input tokens:' + str(response['usage']['inputTokens']) \
-            + ' - Output tokens:' + str(response['usage']['outputTokens']) + ' ---\n'
-        return {"result": result}
-    except Exception as e:
-        logger.error(f"Model invocation error: {str(e)}")
-        return {"error": "Model invocation error"}
+        # Reserve the prompt (about 4 characters per token) plus the output budget; the unused part is handed back
+        with span('bedrock_call'):
+            response_body = resilience.call(
+                model_id, invoke,
+                estimated_tokens=len(prompt) // 4 + config.get('maxTokens', 0),
+                used_tokens=lambda body: body['usage']['inputTokens'] + body['usage']['outputTokens'],
+                max_attempts=max_attempts,
+                trip_on_throttle=trip_on_throttle
+            )
+    except ResilienceError as e:
+        logger.error(f"Model invocation error for {model_id}: {e.error_class}: {str(e)}")
+        metrics.record(model_id, Errors=1)
+        return e.to_response()
+
+    metrics.record(
+        model_id,
+        LatencyMs=response_body['latencyMs'],
+        TimeToFirstTokenMs=response_body.get('timeToFirstTokenMs'),
+        InputTokens=response_body['usage']['inputTokens'],
+        OutputTokens=response_body['usage']['outputTokens'],
+        CacheHit=0 if key is not None else None
+    )
+    # The cache keeps the bare answer; the footer is added per response
+    if key is not None:
+        response_cache.put(key, response_body)
+        response_body = dict(response_body, cache=response_cache.stats(hit=False))
+    return with_usage_footer(response_body, clean)
+
+def build_text_request(spec, prompt, image=None):
+    """Builds the Converse request for a text model, with the reference image attached when one is given."""
+    if image is None:
+        return spec.request(prompt)
+    return spec.request(prompt, image=image.data, image_format=sniff_image_format(image.data)[0])
+
+def stream_bedrock_model(client, model_id, prompt, metrics=None, request=None):
+    """Yields text deltas from the Bedrock ConverseStream API as they are generated.
+
+    metrics is filled as described in model_registry.stream_converse. A request already built
+    from the model registry can be passed in to skip building it again.
+    """
+    if request is None:
+        request = build_text_request(get_model(model_id), prompt)
+    yield from stream_converse(client, request, metrics)
 
 def build_response(response_code, result, event):
     """Builds the API response in the required format."""
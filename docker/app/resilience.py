@@ -0,0 +1,290 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError, ConnectTimeoutError, ReadTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Error classes reported to the agent: (error codes, retryable, counts against the circuit breaker)
+ERROR_CLASSES = {
+    'throttled': ({'ThrottlingException', 'TooManyRequestsException', 'ServiceQuotaExceededException'}, True, True),
+    'timeout': ({'ModelTimeoutException', 'RequestTimeout', 'RequestTimeoutException'}, True, True),
+    'unavailable': ({'ServiceUnavailableException', 'InternalServerException', 'ModelNotReadyException'}, True, True),
+    'validation': ({'ValidationException'}, False, False),
+    'access_denied': ({'AccessDeniedException', 'UnrecognizedClientException'}, False, False),
+    'not_found': ({'ResourceNotFoundException'}, False, False),
+}
+_CODE_CLASSES = {code: name for name, (codes, _, _) in ERROR_CLASSES.items() for code in codes}
+
+
+class ResilienceError(Exception):
+    """A model call that failed or was refused, with the class of error the caller can act on.
+
+    error_class is one of the ERROR_CLASSES names, 'model_error' for other failures, or
+    'circuit_open' / 'rate_limited' when the call was refused without reaching the model.
+    """
+
+    def __init__(self, error_class, message, code=None, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.error_class = error_class
+        self.code = code
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+    def to_response(self):
+        response = {"error": str(self), "errorClass": self.error_class, "retryable": self.retryable}
+        if self.code:
+            response["errorCode"] = self.code
+        if self.retry_after is not None:
+            response["retryAfterMs"] = int(self.retry_after * 1000)
+        return response
+
+
+def _retry_after(error):
+    """Returns the Retry-After header of a ClientError in seconds, or None."""
+    headers = error.response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+    try:
+        return max(0.0, float(headers['retry-after']))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def classify_error(error):
+    """Returns a ResilienceError describing an exception raised by a model call."""
+    if isinstance(error, ResilienceError):
+        return error
+    if isinstance(error, (ReadTimeoutError, ConnectTimeoutError)):
+        return ResilienceError('timeout', str(error), retryable=True)
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code')
+        error_class = _CODE_CLASSES.get(code, 'model_error')
+        retryable = ERROR_CLASSES[error_class][1] if error_class in ERROR_CLASSES else False
+        message = error.response.get('Error', {}).get('Message') or str(error)
+        return ResilienceError(error_class, message, code, retryable, _retry_after(error))
+    logger.error(f"Model call failed: {str(error)}")
+    return ResilienceError('model_error', f"Model invocation error ({type(error).__name__})")
+
+
+class TokenBucket:
+    """Token bucket refilled at rate tokens per second up to capacity.
+
+    reserve() always takes the tokens and lets the balance go negative; the returned wait is how
+    long the caller has to sleep before the reservation is covered. That keeps callers in FIFO
+    order without a queue. release() hands back tokens that were reserved but not used.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, tokens):
+        with self._lock:
+            self._refill()
+            self.tokens -= tokens
+            return max(0.0, -self.tokens / self.rate)
+
+    def release(self, tokens):
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + tokens)
+
+
+class CircuitBreaker:
+    """Fails fast after failure_threshold consecutive failures.
+
+    The open circuit refuses calls for reset_seconds, then lets a single trial call through
+    (half-open). The trial's success closes the circuit; its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_seconds=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and self.clock() - self.opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def retry_after(self):
+        """Seconds until the open circuit lets a trial call through."""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_seconds - self.clock())
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = self.clock()
+
+    def record_neutral(self):
+        """Ends a call that says nothing about the model's health, such as a validation error."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class ModelGuard:
+    """Request and token buckets plus the circuit breaker of one model."""
+
+    def __init__(self, rpm, tpm, breaker, clock):
+        self.requests = TokenBucket(rpm / 60, rpm, clock) if rpm else None
+        self.tokens = TokenBucket(tpm / 60, tpm, clock) if tpm else None
+        self.breaker = breaker
+
+    def reserve(self, tokens):
+        """Takes one request and the estimated tokens; returns how long to wait before calling."""
+        wait = self.requests.reserve(1) if self.requests else 0.0
+        if self.tokens and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        return wait
+
+    def release(self, tokens, request=True):
+        if self.requests and request:
+            self.requests.release(1)
+        # A negative count takes tokens that were used beyond the reservation
+        if self.tokens and tokens:
+            self.tokens.release(tokens)
+
+
+class Resilience:
+    """Per-model rate limiting, circuit breaking and retries for model calls.
+
+    quotas maps model IDs to {"rpm": ..., "tpm": ...}; models without an entry use default_rpm and
+    default_tpm, and 0 means unlimited. Quotas are per warm container, so size them as the account
+    quota divided by the expected number of concurrent containers. clock and sleep can be replaced
+    to test the behaviour without waiting.
+    """
+
+    def __init__(self, quotas=None, default_rpm=0, default_tpm=0, failure_threshold=5, reset_seconds=30,
+                 max_attempts=2, base_delay=0.5, max_delay=8, max_wait=5, clock=time.monotonic, sleep=time.sleep):
+        self.quotas = quotas or {}
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self.clock = clock
+        self.sleep = sleep
+        self._guards = {}
+        self._lock = threading.Lock()
+
+    def guard(self, model_id):
+        guard = self._guards.get(model_id)
+        if guard is None:
+            with self._lock:
+                guard = self._guards.get(model_id)
+                if guard is None:
+                    quota = self.quotas.get(model_id, {})
+                    guard = ModelGuard(
+                        quota.get('rpm', self.default_rpm),
+                        quota.get('tpm', self.default_tpm),
+                        CircuitBreaker(self.failure_threshold, self.reset_seconds, self.clock),
+                        self.clock
+                    )
+                    self._guards[model_id] = guard
+        return guard
+
+    def backoff(self, attempt, retry_after=None):
+        """Full-jitter exponential backoff that never retries sooner than the server's Retry-After."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, retry_after or 0.0)
+
+    def call(self, model_id, fn, estimated_tokens=0, used_tokens=None, max_attempts=None, trip_on_throttle=True):
+        """Calls fn() for a model under its rate limits and circuit breaker, retrying transient errors.
+
+        estimated_tokens are reserved from the model's token bucket before the call; when
+        used_tokens(result) returns the actual count, the unused part is handed back. max_attempts
+        overrides the configured attempts, e.g. 1 when the caller retries on its own. With
+        trip_on_throttle=False throttles do not count against the circuit breaker, for callers
+        that adapt to throttling themselves. Raises ResilienceError when the call is refused or fails.
+        """
+        guard = self.guard(model_id)
+        max_attempts = max_attempts or self.max_attempts
+        for attempt in range(max_attempts):
+            if not guard.breaker.allow():
+                raise ResilienceError(
+                    'circuit_open', f"Circuit open for {model_id} after repeated failures",
+                    retryable=True, retry_after=guard.breaker.retry_after()
+                )
+            wait = guard.reserve(estimated_tokens)
+            if wait > self.max_wait:
+                guard.release(estimated_tokens)
+                guard.breaker.record_neutral()
+                raise ResilienceError(
+                    'rate_limited', f"Rate limit for {model_id} reached", retryable=True, retry_after=wait
+                )
+            if wait:
+                self.sleep(wait)
+
+            try:
+                result = fn()
+            except Exception as e:
+                # The failed call used no tokens; the request slot stays spent because it did reach the model
+                guard.release(estimated_tokens, request=False)
+                error = classify_error(e)
+                trips = error.error_class in ERROR_CLASSES and ERROR_CLASSES[error.error_class][2]
+                if trips and (trip_on_throttle or error.error_class != 'throttled'):
+                    guard.breaker.record_failure()
+                else:
+                    guard.breaker.record_neutral()
+                delay = self.backoff(attempt, error.retry_after) if error.retryable else None
+                if delay is None or attempt == max_attempts - 1 or delay > self.max_delay:
+                    raise error from e
+                logger.warning(f"Retrying {model_id} after {error.error_class} in {delay:.2f}s")
+                self.sleep(delay)
+                continue
+
+            guard.breaker.record_success()
+            actual = used_tokens(result) if used_tokens else None
+            if actual is not None:
+                guard.release(estimated_tokens - actual, request=False)
+            return result
+
+    @classmethod
+    def from_environment(cls):
+        """Builds the subsystem from MODEL_QUOTAS (JSON), MODEL_DEFAULT_RPM/TPM, BREAKER_* and RETRY_* variables."""
+        return cls(
+            quotas=json.loads(os.environ.get('MODEL_QUOTAS') or '{}'),
+            default_rpm=float(os.environ.get('MODEL_DEFAULT_RPM', 0)),
+            default_tpm=float(os.environ.get('MODEL_DEFAULT_TPM', 0)),
+            failure_threshold=int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 5)),
+            reset_seconds=float(os.environ.get('BREAKER_RESET_SECONDS', 30)),
+            max_attempts=int(os.environ.get('RETRY_MAX_ATTEMPTS', 2)),
+            max_wait=float(os.environ.get('RATE_LIMIT_MAX_WAIT_SECONDS', 5)),
+        )
@@ -0,0 +1,133 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import sys
+
+import pytest
+from botocore.exceptions import ClientError
+
+# The container image puts docker/app and shared/ side by side in the task root; mirror that here
+APP = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [APP, os.path.join(APP, '..', '..', 'shared')]
+os.environ.setdefault('AWS_REGION', 'us-east-1')
+os.environ.setdefault('S3_IMAGE_BUCKET', 'test-bucket')
+
+
+def client_error(code, operation='Converse'):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+
+def png_bytes(size=(64, 32), color=(200, 30, 30), mode='RGB'):
+    """Encodes a solid-color PNG of the given size."""
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new(mode, size, color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class FakeBedrockRuntime:
+    """Answers Converse calls, or raises the ClientError codes queued in errors first."""
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.calls = []
+        self.requests = []
+
+    def converse(self, **request):
+        self.calls.append(request['modelId'])
+        self.requests.append(request)
+        if self.errors:
+            raise client_error(self.errors.pop(0))
+        return {
+            'output': {'message': {'role': 'assistant', 'content': [{'text': 'An answer.'}]}},
+            'usage': {'inputTokens': 7, 'outputTokens': 3, 'totalTokens': 10},
+            'metrics': {'latencyMs': 25},
+        }
+
+    def invoke_model(self, modelId, body, **kwargs):
+        """Answers Titan requests with numberOfImages images and Stability requests with one."""
+        self.calls.append(modelId)
+        if self.errors:
+            raise client_error(self.errors.pop(0), 'InvokeModel')
+        request = json.loads(body)
+        count = request.get('imageGenerationConfig', {}).get('numberOfImages', 1)
+        images = [base64.b64encode(png_bytes(color=(len(self.calls), index, 0))).decode() for index in range(count)]
+        return {'body': io.BytesIO(json.dumps({'images': images}).encode())}
+
+
+class FakeS3:
+    """In-memory stand-in for the S3 calls the handler makes."""
+
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+        self.puts = []
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not Found'}}, 'GetObject')
+        etag = '"%s"' % hashlib.md5(self.objects[Key]).hexdigest()
+        if IfNoneMatch == etag:
+            raise ClientError({'Error': {'Code': '304', 'Message': 'Not Modified'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key]), 'ETag': etag}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        self.puts.append(Key)
+        self.objects[Key] = Body.encode('utf-8') if isinstance(Body, str) else bytes(Body)
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        return f"https://{Params['Bucket']}.s3.amazonaws.com/{Params['Key']}?X-Amz-Expires={ExpiresIn}"
+
+
+class ManualClock:
+    """A clock for the rate limiter and breaker tests; sleep() advances it instead of waiting."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return ManualClock()
+
+
+@pytest.fixture
+def app(monkeypatch):
+    """The lambda_function module with fresh resilience state and no response cache."""
+    import lambda_function
+    from resilience import Resilience
+
+    monkeypatch.setattr(lambda_function, 'resilience', Resilience(sleep=lambda seconds: None))
+    monkeypatch.setattr(lambda_function, 'response_cache', None)
+    return lambda_function
+
+
+@pytest.fixture
+def bedrock(app, monkeypatch):
+    client = FakeBedrockRuntime()
+    monkeypatch.setitem(app._clients, ('bedrock-runtime', None), client)
+    return client
+
+
+@pytest.fixture
+def reference_png():
+    return png_bytes((640, 480))
+
+
+@pytest.fixture
+def s3(app, monkeypatch):
+    client = FakeS3()
+    monkeypatch.setitem(app._clients, ('s3', None), client)
+    monkeypatch.setattr(app.reference_images, '_current', None)
+    monkeypatch.setattr(app, 'presigned_urls', app.PresignedUrlCache(lambda: client))
+    return client
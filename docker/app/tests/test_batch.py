@@ -0,0 +1,129 @@
+import json
+
+import pytest
+
+from batch import AIMDLimiter, run_batch
+
+TEXT_MODEL = 'meta.llama3-8b-instruct-v1:0'
+
+
+def test_limiter_increases_additively_and_decreases_multiplicatively():
+    limiter = AIMDLimiter(initial=4, maximum=16)
+
+    limiter.acquire()
+    limiter.release()
+    assert limiter.limit == pytest.approx(4.25)
+
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter.limit == pytest.approx(2.125)
+    assert limiter.throttles == 1
+    assert limiter.in_flight == 0
+
+
+def test_limiter_stays_within_its_bounds():
+    limiter = AIMDLimiter(initial=2, minimum=1, maximum=3)
+    for _ in range(5):
+        limiter.acquire()
+        limiter.release(throttled=True)
+    assert limiter.limit == 1
+
+    for _ in range(50):
+        limiter.acquire()
+        limiter.release()
+    assert limiter.limit == 3
+
+
+def test_run_batch_keeps_input_order():
+    results = list(run_batch(range(20), lambda item: {'item': item}, lambda result: False, AIMDLimiter(initial=4)))
+
+    assert [result['item'] for result in results] == list(range(20))
+
+
+def test_run_batch_retries_throttled_items_with_backoff():
+    attempts = {}
+    sleeps = []
+
+    def call(item):
+        attempts[item] = attempts.get(item, 0) + 1
+        return {'throttled': item == 'b' and attempts[item] < 3}
+
+    limiter = AIMDLimiter(initial=2)
+    results = list(run_batch(['a', 'b'], call, lambda result: result['throttled'], limiter, sleep=sleeps.append))
+
+    assert results == [{'throttled': False}, {'throttled': False}]
+    assert attempts == {'a': 1, 'b': 3}
+    assert limiter.throttles == 2
+    assert len(sleeps) == 2 and sleeps[0] <= 0.5 and sleeps[1] <= 1.0
+
+
+def test_run_batch_returns_the_last_result_after_max_attempts():
+    results = list(run_batch(['a'], lambda item: {'error': 'throttled'}, lambda result: True, max_attempts=3, sleep=lambda seconds: None))
+
+    assert results == [{'error': 'throttled'}]
+
+
+def test_run_batch_waits_for_retry_after_before_retrying():
+    sleeps = []
+    results = iter([{'errorClass': 'circuit_open', 'retryAfterMs': 30000}, {'result': 'ok'}])
+    limiter = AIMDLimiter(initial=4)
+
+    batch = run_batch(['a'], lambda item: next(results), lambda result: 'errorClass' in result, limiter,
+                      retry_after=lambda result: result.get('retryAfterMs', 0) / 1000, sleep=sleeps.append)
+
+    assert list(batch) == [{'result': 'ok'}]
+    assert sleeps == [30.0]
+    assert limiter.throttles == 1
+
+
+def test_model_client_makes_a_single_attempt(app):
+    assert app.model_client_config.retries['total_max_attempts'] == 1
+
+
+def test_batch_prompt_reaches_the_model_once_per_batch_attempt(app, bedrock, monkeypatch):
+    monkeypatch.setattr(app, 'run_batch', lambda *args, **kwargs: run_batch(*args, sleep=lambda seconds: None, **kwargs))
+    bedrock.errors = ['ThrottlingException'] * 4
+    event = {
+        'actionGroup': 'infer-models', 'apiPath': '/callModelBatch', 'httpMethod': 'POST',
+        'parameters': [
+            {'name': 'modelId', 'value': TEXT_MODEL},
+            {'name': 'prompts', 'value': json.dumps(['Hello'])},
+        ],
+    }
+
+    response = app.lambda_handler(event, None)
+
+    body = response['response']['responseBody']['application/json']['body']
+    # run_batch's four attempts, with no retries stacked underneath by Resilience or botocore
+    assert len(bedrock.calls) == 4
+    assert body['failed'] == 1 and body['throttles'] == 4
+    assert body['results'][0]['errorClass'] == 'throttled'
+
+
+def test_throttle_burst_does_not_open_the_circuit_for_the_batch(app, bedrock, monkeypatch):
+    threshold = app.resilience.failure_threshold
+    bedrock.errors = ['ThrottlingException'] * (threshold + 2)
+    # Enough attempts that the burst cannot exhaust one prompt's retries, whichever prompts it hits
+    monkeypatch.setattr(app, 'run_batch', lambda *args, **kwargs: run_batch(
+        *args, max_attempts=threshold + 3, sleep=lambda seconds: None, **kwargs))
+    event = {
+        'actionGroup': 'infer-models', 'apiPath': '/callModelBatch', 'httpMethod': 'POST',
+        'parameters': [
+            {'name': 'modelId', 'value': TEXT_MODEL},
+            {'name': 'prompts', 'value': json.dumps([f'Prompt {index}' for index in range(20)])},
+        ],
+    }
+
+    response = app.lambda_handler(event, None)
+
+    body = response['response']['responseBody']['application/json']['body']
+    assert body['succeeded'] == 20 and body['failed'] == 0
+    assert body['throttles'] == threshold + 2
+    assert app.resilience.guard(TEXT_MODEL).breaker.state == 'closed'
+
+
+def test_parse_prompts_accepts_json_or_lines(app):
+    assert app.parse_prompts('["a", " b ", ""]') == ['a', 'b']
+    assert app.parse_prompts('first\n\nsecond\n') == ['first', 'second']
+    assert app.parse_prompts('just one') == ['just one']
+
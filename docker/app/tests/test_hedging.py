@@ -0,0 +1,87 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from hedging import LatencyHistogram, LatencyTracker, hedged_call
+
+
+def test_empty_histogram_has_no_percentile():
+    assert LatencyHistogram().percentile(95) is None
+
+
+def test_percentile_is_within_one_bucket():
+    histogram = LatencyHistogram(growth=1.2)
+    for index in range(1, 101):
+        histogram.record(index / 100)
+
+    assert 0.5 <= histogram.percentile(50) <= 0.5 * 1.2
+    assert 0.95 <= histogram.percentile(95) <= 0.95 * 1.2
+
+
+def test_samples_outside_the_range_land_in_the_edge_buckets():
+    histogram = LatencyHistogram(min_seconds=0.01, max_seconds=10)
+    histogram.record(0.001)
+    assert histogram.percentile(100) == 0.01
+
+    histogram.record(1000)
+    assert histogram.percentile(100) == histogram.bounds[-1]
+
+
+def test_old_samples_fade_out():
+    histogram = LatencyHistogram(max_samples=100)
+    for _ in range(99):
+        histogram.record(0.1)
+    for _ in range(150):
+        histogram.record(5)
+
+    assert histogram.total < 100
+    assert histogram.percentile(50) >= 5
+
+
+def test_hedge_delay_waits_for_enough_samples():
+    tracker = LatencyTracker()
+    for _ in range(19):
+        tracker.record('model', 1.0)
+    assert tracker.hedge_delay('model', 95, 20) is None
+
+    tracker.record('model', 1.0)
+    assert tracker.hedge_delay('model', 95, 20) == pytest.approx(tracker.histogram('model').percentile(95))
+
+
+def test_hedged_call_without_delay_only_runs_the_primary():
+    calls = []
+
+    result = hedged_call(None, lambda: calls.append('primary') or 'a', lambda: calls.append('hedge') or 'b', None)
+
+    assert result == ('a', None)
+    assert calls == ['primary']
+
+
+def test_slow_primary_is_hedged():
+    release = threading.Event()
+
+    def primary():
+        release.wait(5)
+        return 'primary'
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        result = hedged_call(executor, primary, lambda: 'hedge', 0.01)
+        release.set()
+
+    assert result == ('hedge', 'hedge')
+
+
+def test_failed_hedge_falls_back_to_the_primary():
+    def primary():
+        threading.Event().wait(0.05)
+        return {'result': 'primary'}
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        result = hedged_call(executor, primary, lambda: {'error': 'throttled'}, 0.01, lambda result: 'error' in result)
+
+    assert result == ({'result': 'primary'}, 'primary')
+
+
+def test_hedging_is_opt_in(app):
+    assert app.HEDGE_ENABLED is False
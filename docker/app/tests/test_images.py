@@ -0,0 +1,90 @@
+import json
+import threading
+
+TITAN_MODEL = 'amazon.titan-image-generator-v1'
+TITAN_V2_MODEL = 'amazon.titan-image-generator-v2:0'
+STABILITY_MODEL = 'stability.sd3-large-v1:0'
+
+
+def agent_event(api_path, **parameters):
+    return {
+        'actionGroup': 'infer-models', 'apiPath': api_path, 'httpMethod': 'POST',
+        'parameters': [{'name': name, 'value': value} for name, value in parameters.items()],
+    }
+
+
+def body_of(response):
+    return response['response']['responseBody']['application/json']['body']
+
+
+def index_keys(s3):
+    return [key for key in s3.puts if key.startswith('image-requests/')]
+
+
+def test_fixed_seed_images_are_indexed_and_served_from_the_store(app, bedrock, s3):
+    event = agent_event('/callBedrockModel', modelId=TITAN_MODEL, prompt='A red square', numberOfImages='2')
+
+    first = body_of(app.lambda_handler(event, None))
+    second = body_of(app.lambda_handler(event, None))
+
+    assert len(bedrock.calls) == 1
+    assert len(index_keys(s3)) == 1
+    assert [image['url'] for image in second['images']] == [image['url'] for image in first['images']]
+
+
+def test_random_seed_images_write_no_index(app, bedrock, s3):
+    event = agent_event('/callBedrockModel', modelId=STABILITY_MODEL, prompt='A red square', numberOfImages='3')
+
+    body = body_of(app.lambda_handler(event, None))
+
+    assert len(bedrock.calls) == 3
+    assert len(body['images']) == 3
+    assert [image['requestSeed'] for image in body['images']] == [None] * 3
+    assert index_keys(s3) == []
+
+
+def test_urls_are_presigned_while_the_uploads_run(app, bedrock, s3, monkeypatch):
+    presigned = threading.Event()
+    upload_saw_presign = []
+    put_object, sign = s3.put_object, s3.generate_presigned_url
+
+    def slow_put_object(**params):
+        if params['Key'].startswith('generated-images/'):
+            # Finishes only once the URL is signed; a presign that waits for the upload would time out here
+            upload_saw_presign.append(presigned.wait(2))
+        put_object(**params)
+
+    def signing(*args, **kwargs):
+        presigned.set()
+        return sign(*args, **kwargs)
+    monkeypatch.setattr(s3, 'put_object', slow_put_object)
+    monkeypatch.setattr(s3, 'generate_presigned_url', signing)
+
+    body = body_of(app.lambda_handler(agent_event('/callBedrockModel', modelId=TITAN_MODEL, prompt='A red square'), None))
+
+    assert upload_saw_presign == [True]
+    assert body['image_url'].startswith('https://')
+
+
+def test_conditioned_request_uses_the_prefetched_reference_image(app, bedrock, s3, reference_png, monkeypatch):
+    s3.objects[app.object_name] = reference_png
+    invoked = []
+    invoke_model = bedrock.invoke_model
+    monkeypatch.setattr(bedrock, 'invoke_model', lambda **params: invoked.append(json.loads(params['body'])) or invoke_model(**params))
+    event = agent_event('/callBedrockModel', modelId=TITAN_V2_MODEL, prompt='A red square', conditioning='variation:0.7')
+
+    body = body_of(app.lambda_handler(event, None))
+
+    assert len(body['images']) == 1
+    assert invoked[0]['taskType'] == 'IMAGE_VARIATION'
+    assert invoked[0]['imageVariationParams']['similarityStrength'] == 0.7
+
+
+def test_invalid_conditioning_is_reported(app, bedrock, s3, reference_png):
+    s3.objects[app.object_name] = reference_png
+    event = agent_event('/callBedrockModel', modelId=TITAN_V2_MODEL, prompt='A red square', conditioning='sketch')
+
+    body = body_of(app.lambda_handler(event, None))
+
+    assert body['error'].startswith('Invalid conditioning')
+    assert bedrock.calls == []
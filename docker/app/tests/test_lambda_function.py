@@ -0,0 +1,153 @@
+import threading
+
+import pytest
+from resilience import Resilience
+
+
+def test_model_call_timeouts_fit_the_function_timeout(app):
+    config = app.model_client_config
+    resilience = Resilience.from_environment()
+    per_attempt = config.retries['total_max_attempts'] * (config.connect_timeout + config.read_timeout)
+    worst_case = resilience.max_attempts * per_attempt + (resilience.max_attempts - 1) * resilience.max_delay
+
+    assert worst_case < 120
+
+
+TEXT_MODEL = 'meta.llama3-8b-instruct-v1:0'
+OTHER_TEXT_MODEL = 'mistral.mistral-7b-instruct-v0:2'
+MULTIMODAL_MODEL = 'anthropic.claude-3-haiku-20240307-v1:0'
+
+
+def agent_event(api_path, **parameters):
+    return {
+        'actionGroup': 'infer-models', 'apiPath': api_path, 'httpMethod': 'POST',
+        'parameters': [{'name': name, 'value': value} for name, value in parameters.items()],
+    }
+
+
+def body_of(response):
+    return response['response']['responseBody']['application/json']['body']
+
+
+def test_parse_model_ids_accepts_json_or_comma_separated_ids(app):
+    assert app.parse_model_ids('["a", "b", "a"]') == ['a', 'b']
+    assert app.parse_model_ids('[a, "b" ,, c]') == ['a', 'b', 'c']
+    assert app.parse_model_ids('a') == ['a']
+
+
+def test_fan_out_isolates_failing_models(app, bedrock):
+    bedrock.errors = ['ValidationException']
+    event = agent_event('/callMultipleModels', modelIds=f'{TEXT_MODEL},{OTHER_TEXT_MODEL}', prompt='Hello')
+
+    body = body_of(app.lambda_handler(event, None))
+
+    assert [result['modelId'] for result in body['results']] == [TEXT_MODEL, OTHER_TEXT_MODEL]
+    assert body['succeeded'] == 1 and body['failed'] == 1
+    assert sorted(bedrock.calls) == sorted([TEXT_MODEL, OTHER_TEXT_MODEL])
+
+
+def test_fan_out_runs_on_the_shared_model_pool(app, bedrock, monkeypatch):
+    def no_new_pools(*args, **kwargs):
+        raise AssertionError("fan_out must not create a thread pool per invocation")
+    monkeypatch.setattr(app, 'ThreadPoolExecutor', no_new_pools)
+    event = agent_event('/callMultipleModels', modelIds=f'{TEXT_MODEL},{OTHER_TEXT_MODEL}', prompt='Hello')
+
+    body = body_of(app.lambda_handler(event, None))
+
+    assert body['succeeded'] == 2
+
+
+def test_fan_out_reports_models_past_the_deadline(app, bedrock, monkeypatch):
+    release = threading.Event()
+    converse = bedrock.converse
+
+    def slow_converse(**request):
+        if request['modelId'] == OTHER_TEXT_MODEL:
+            release.wait(5)
+        return converse(**request)
+    monkeypatch.setattr(bedrock, 'converse', slow_converse)
+
+    try:
+        results = app.fan_out([TEXT_MODEL, OTHER_TEXT_MODEL], 'Hello', timeout=0.2)
+    finally:
+        release.set()
+
+    assert 'error' not in results[0]
+    assert results[1] == {'modelId': OTHER_TEXT_MODEL, 'error': 'Timed out after 0.2s'}
+
+
+def test_fan_out_rejects_too_many_models(app, monkeypatch):
+    monkeypatch.setattr(app, 'FANOUT_MAX_MODELS', 1)
+    event = agent_event('/callMultipleModels', modelIds=f'{TEXT_MODEL},{OTHER_TEXT_MODEL}', prompt='Hello')
+
+    response = app.lambda_handler(event, None)
+
+    assert response['response']['httpStatusCode'] == 400
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('variation', ('variation', None)),
+    (' Canny:0.5 ', ('canny', 0.5)),
+    ('segmentation:0', ('segmentation', 0.0)),
+    ('variation:', ('variation', None)),
+])
+def test_parse_conditioning(app, value, expected):
+    assert app.parse_conditioning(value) == expected
+
+
+@pytest.mark.parametrize('value', ['sketch', 'variation:0.1', 'canny:1.5', 'canny:strong'])
+def test_parse_conditioning_rejects_invalid_values(app, value):
+    with pytest.raises(ValueError):
+        app.parse_conditioning(value)
+
+
+def test_multimodal_model_gets_the_reference_image_through_converse(app, bedrock, s3, reference_png):
+    s3.objects[app.object_name] = reference_png
+
+    body = body_of(app.lambda_handler(agent_event('/callBedrockModel', modelId=MULTIMODAL_MODEL, prompt='Describe it'), None))
+
+    assert body['result'].startswith('An answer.')
+    request = bedrock.requests[0]
+    assert request['messages'][0]['content'][1] == {'image': {'format': 'png', 'source': {'bytes': reference_png}}}
+    assert request['inferenceConfig'] == app.get_model(MULTIMODAL_MODEL).defaults
+
+
+def test_text_model_does_not_fetch_the_reference_image(app, bedrock, s3, monkeypatch):
+    fetched = []
+    monkeypatch.setattr(s3, 'get_object', lambda **params: fetched.append(params['Key']))
+
+    app.lambda_handler(agent_event('/callBedrockModel', modelId=TEXT_MODEL, prompt='Hello'), None)
+
+    assert fetched == []
+
+    assert bedrock.requests[0]['messages'][0]['content'] == [{'text': 'Hello'}]
+    assert bedrock.requests[0]['inferenceConfig'] == app.get_model(TEXT_MODEL).defaults
+
+
+def test_temperature_zero_answers_are_served_from_the_cache(app, bedrock, monkeypatch):
+    from response_cache import LRUCache, ResponseCache
+
+    monkeypatch.setattr(app, 'response_cache', ResponseCache(LRUCache(1024 * 1024, 3600)))
+    event = agent_event('/callBedrockModel', modelId=TEXT_MODEL, prompt='Hello', cleanResponse='true')
+
+    first = body_of(app.lambda_handler(event, None))
+    second = body_of(app.lambda_handler(event, None))
+
+    assert bedrock.calls == [TEXT_MODEL]
+    assert first['cache']['hit'] is False and second['cache']['hit'] is True
+    assert second['result'] == first['result'] == 'An answer.'
+
+
+def test_sampled_answers_are_not_cached(app, bedrock, monkeypatch):
+    from response_cache import LRUCache, ResponseCache
+
+    spec = app.get_model(TEXT_MODEL)
+    monkeypatch.setattr(spec, 'defaults', dict(spec.defaults, temperature=0.5))
+    monkeypatch.setattr(app, 'response_cache', ResponseCache(LRUCache(1024 * 1024, 3600)))
+    event = agent_event('/callBedrockModel', modelId=TEXT_MODEL, prompt='Hello')
+
+    body = body_of(app.lambda_handler(event, None))
+    app.lambda_handler(event, None)
+
+    assert bedrock.calls == [TEXT_MODEL, TEXT_MODEL]
+    assert 'cache' not in body
@@ -0,0 +1,178 @@
+import pytest
+from botocore.exceptions import ClientError, ReadTimeoutError
+
+from resilience import CircuitBreaker, Resilience, ResilienceError, TokenBucket, classify_error
+
+
+def client_error(code, retry_after=None):
+    response = {'Error': {'Code': code, 'Message': code}}
+    if retry_after is not None:
+        response['ResponseMetadata'] = {'HTTPHeaders': {'retry-after': str(retry_after)}}
+    return ClientError(response, 'Converse')
+
+
+def failing(*errors, result='ok'):
+    """A model call that raises the given errors in turn, then returns result."""
+    errors = list(errors)
+    calls = []
+
+    def call():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+        return result
+    call.calls = calls
+    return call
+
+
+def test_bucket_refills_at_its_rate_up_to_capacity(clock):
+    bucket = TokenBucket(rate=10, capacity=20, clock=clock)
+
+    assert bucket.reserve(20) == 0
+    assert bucket.reserve(5) == pytest.approx(0.5)
+
+    clock.now += 1
+    assert bucket.reserve(0) == 0
+    assert bucket.tokens == pytest.approx(5)
+
+    clock.now += 100
+    bucket.reserve(0)
+    assert bucket.tokens == 20
+
+
+def test_bucket_release_hands_tokens_back(clock):
+    bucket = TokenBucket(rate=1, capacity=10, clock=clock)
+    bucket.reserve(8)
+    bucket.release(6)
+
+    assert bucket.tokens == pytest.approx(8)
+
+
+def test_breaker_opens_half_opens_and_closes(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30, clock=clock)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open' and not breaker.allow()
+    assert breaker.retry_after() == 30
+
+    clock.now += 30
+    assert breaker.allow()
+    assert breaker.state == 'half_open'
+    # Only one trial call at a time
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.allow()
+
+
+def test_failed_trial_opens_the_breaker_again(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30, clock=clock)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == 'open' and breaker.opened_at == clock.now
+
+
+def test_classify_error():
+    assert classify_error(client_error('ThrottlingException')).error_class == 'throttled'
+    assert classify_error(client_error('ValidationException')).retryable is False
+    assert classify_error(client_error('ThrottlingException', retry_after=2)).retry_after == 2
+    assert classify_error(ReadTimeoutError(endpoint_url='https://bedrock')).error_class == 'timeout'
+    assert classify_error(KeyError('x')).error_class == 'model_error'
+
+
+def test_transient_errors_are_retried_after_backoff(clock):
+    resilience = Resilience(max_attempts=3, clock=clock, sleep=clock.sleep)
+    call = failing(client_error('ThrottlingException'), client_error('ServiceUnavailableException'))
+
+    assert resilience.call('model', call) == 'ok'
+    assert len(call.calls) == 3
+    assert len(clock.sleeps) == 2
+    assert clock.sleeps[0] <= 0.5 and clock.sleeps[1] <= 1.0
+
+
+def test_backoff_respects_retry_after(clock):
+    resilience = Resilience(max_attempts=2, clock=clock, sleep=clock.sleep)
+
+    resilience.call('model', failing(client_error('ThrottlingException', retry_after=3)))
+
+    assert clock.sleeps == [3]
+
+
+def test_non_retryable_errors_raise_at_once(clock):
+    resilience = Resilience(max_attempts=3, clock=clock, sleep=clock.sleep)
+    call = failing(client_error('ValidationException'))
+
+    with pytest.raises(ResilienceError) as raised:
+        resilience.call('model', call)
+    assert raised.value.error_class == 'validation'
+    assert len(call.calls) == 1 and clock.sleeps == []
+    # Validation errors say nothing about the model's health
+    assert resilience.guard('model').breaker.failures == 0
+
+
+def test_max_attempts_override(clock):
+    resilience = Resilience(max_attempts=3, clock=clock, sleep=clock.sleep)
+    call = failing(client_error('ThrottlingException'))
+
+    with pytest.raises(ResilienceError):
+        resilience.call('model', call, max_attempts=1)
+    assert len(call.calls) == 1
+
+
+def test_open_circuit_refuses_calls(clock):
+    resilience = Resilience(failure_threshold=1, max_attempts=1, clock=clock, sleep=clock.sleep)
+    with pytest.raises(ResilienceError):
+        resilience.call('model', failing(client_error('ThrottlingException')))
+
+    call = failing()
+    with pytest.raises(ResilienceError) as raised:
+        resilience.call('model', call)
+    assert raised.value.error_class == 'circuit_open'
+    assert call.calls == []
+
+
+def test_failed_attempts_hand_their_tokens_back(clock):
+    resilience = Resilience(quotas={'model': {'tpm': 6000}}, max_attempts=2, clock=clock, sleep=lambda seconds: None)
+    tokens = resilience.guard('model').tokens
+
+    with pytest.raises(ResilienceError):
+        resilience.call('model', failing(client_error('ThrottlingException'), client_error('ThrottlingException')), estimated_tokens=1000)
+
+    assert tokens.tokens == 6000
+
+
+def test_unused_tokens_are_handed_back(clock):
+    resilience = Resilience(quotas={'model': {'tpm': 6000}}, clock=clock, sleep=clock.sleep)
+    tokens = resilience.guard('model').tokens
+
+    resilience.call('model', failing(result={'used': 300}), estimated_tokens=1000, used_tokens=lambda result: result['used'])
+
+    assert tokens.tokens == 5700
+
+
+def test_calls_over_the_rate_limit_are_refused(clock):
+    resilience = Resilience(quotas={'model': {'rpm': 1}}, max_wait=5, clock=clock, sleep=clock.sleep)
+    resilience.call('model', failing())
+
+    with pytest.raises(ResilienceError) as raised:
+        resilience.call('model', failing())
+    assert raised.value.error_class == 'rate_limited'
+    assert raised.value.retry_after == pytest.approx(60)
+
+
+def test_throttles_can_be_kept_out_of_the_breaker():
+    resilience = Resilience(failure_threshold=2, sleep=lambda seconds: None)
+    for _ in range(3):
+        with pytest.raises(ResilienceError):
+            resilience.call('model', failing(client_error('ThrottlingException')), max_attempts=1, trip_on_throttle=False)
+
+    assert resilience.guard('model').breaker.state == 'closed'
+
+    for _ in range(2):
+        with pytest.raises(ResilienceError):
+            resilience.call('model', failing(client_error('ModelTimeoutException')), max_attempts=1, trip_on_throttle=False)
+    assert resilience.guard('model').breaker.state == 'open'
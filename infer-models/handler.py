@@ -2,579 +2,388 @@ import json
 import os
 import base64
 import logging
+import threading
+import time
 import boto3
 import io
-from PIL import Image, ImageOps
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from botocore.config import Config
 from botocore.exceptions import ClientError
-from langchain_community.llms.bedrock import Bedrock
-#from langchain_community.chat_models import BedrockChat
+from metrics import MetricsLogger
+from model_registry import IMAGE, INPAINTING, MULTIMODAL, ModelResponseError, custom_text_model, get_model, image_request_overrides, parse_seeds
+from profiling import Profiler, span
+from response_cache import ResponseCache, cache_key
+from image_store import ImageStore, PresignedUrlCache, ReferenceImageCache, request_key, request_seed, sniff_image_format
+
+# Clients are created lazily on first use and cached for the life of the container.
+# PIL and NumPy are imported inside the image branches that need them, so text
+# requests never pay for those import graphs on a cold start.
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Shared client settings. Clients keep their connection pool across warm invocations,
+# so TLS handshakes and credential resolution are paid once per container.
+# A call that times out on every attempt takes attempts x (connect + read) = 2 x 28s, which
+# leaves the 60s function timeout a few seconds for S3 and the response.
+client_config = Config(
+    max_pool_connections=int(os.environ.get('CLIENT_MAX_POOL_CONNECTIONS', 10)),
+    retries={
+        'mode': os.environ.get('CLIENT_RETRY_MODE', 'adaptive'),
+        'total_max_attempts': int(os.environ.get('CLIENT_MAX_ATTEMPTS', 2)),
+    },
+    connect_timeout=float(os.environ.get('CLIENT_CONNECT_TIMEOUT', 3)),
+    read_timeout=float(os.environ.get('CLIENT_READ_TIMEOUT', 25)),
+    tcp_keepalive=True,
+)
+
+# The S3 bucket name is configured through the S3_IMAGE_BUCKET environment variable (see serverless.yml)
+bucket_name = os.environ['S3_IMAGE_BUCKET']
+object_name = 'the_image.png' # reference image for multimodal and inpainting requests
+
+# Generated images are stored under content-addressed keys, so concurrent requests never overwrite each other
+image_store = ImageStore(lambda: get_client('s3'), lambda: bucket_name)
+presigned_urls = PresignedUrlCache(lambda: get_client('s3'))
+reference_images = ReferenceImageCache(lambda: get_client('s3'), lambda: bucket_name, object_name)
+
+# Image requests generate up to IMAGE_MAX_IMAGES images; their model calls and uploads run on a shared pool
+IMAGE_MAX_IMAGES = int(os.environ.get('IMAGE_MAX_IMAGES', 10))
+image_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('IMAGE_MAX_WORKERS', 8)), thread_name_prefix='image')
+
+# Per-model latency, token and S3 metrics, flushed as CloudWatch EMF lines at the end of each invocation
+metrics = MetricsLogger.from_environment()
+
+# Cache for temperature-0 text responses; configured through the RESPONSE_CACHE_* environment variables
+response_cache = ResponseCache.from_environment(lambda service_name, endpoint_url=None: get_client(service_name, endpoint_url), lambda: bucket_name)
+
+# Per-invocation profiling, turned on by the 'profile' parameter or session attribute, or PROFILE_MODE
+profiler = Profiler.from_environment(lambda: get_client('s3'))
 
-s3 = boto3.client('s3')
+logger = logging.getLogger(__name__)
 
-sts_client = boto3.client('sts')
-account_id = sts_client.get_caller_identity().get('Account')
-region = boto3.Session().region_name
 
-# Construct the S3 bucket name
-bucket_name = f"{BUCKET NAME HERE}"
-os.environ['S3_IMAGE_BUCKET'] = bucket_name
-object_name = 'the_image.png' 
+def get_client(service_name, endpoint_url=None):
+    """Returns the cached boto3 client for a service (and optional endpoint), creating it on first use."""
+    key = (service_name, endpoint_url)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = boto3.client(
+                    service_name, region_name=os.environ.get("BWB_REGION_NAME"), endpoint_url=endpoint_url, config=client_config
+                )
+                _clients[key] = client
+    return client
 
-logger = logging.getLogger(__name__)
+
+def converse_text(client, spec, prompt, image=None):
+    """Runs a text model through the Converse API with the model's registered inference defaults.
+
+    image (a ReferenceImage) is attached for multimodal models. Deterministic (temperature 0)
+    answers are served from the response cache when possible. Returns the answer with its token
+    usage, the model latency reported by Bedrock and the wall time of the call.
+    """
+    start = time.perf_counter()
+    with span('request_build'):
+        if image is None:
+            request = spec.request(prompt)
+        else:
+            request = spec.request(prompt, image=image.data, image_format=sniff_image_format(image.data)[0])
+    config = request['inferenceConfig']
+    key = None
+    if response_cache is not None and config.get('temperature') == 0:
+        with span('cache_lookup'):
+            key = cache_key(spec.model_id, prompt, config, image.etag if image is not None else None)
+            cached = response_cache.get(key)
+        if cached is not None:
+            metrics.record(spec.model_id, CacheHit=1)
+            return dict(cached, cache=response_cache.stats(hit=True), wallTimeMs=int((time.perf_counter() - start) * 1000))
+
+    with span('bedrock_call'):
+        text, usage, latency_ms = spec.parse_response(client.converse(**request))
+    metrics.record(
+        spec.model_id, LatencyMs=latency_ms, InputTokens=usage['inputTokens'], OutputTokens=usage['outputTokens'],
+        CacheHit=0 if key is not None else None
+    )
+    answer = {"result": text, "usage": usage, "latencyMs": latency_ms}
+    if key is not None:
+        response_cache.put(key, answer)
+        answer = dict(answer, cache=response_cache.stats(hit=False))
+    return dict(answer, wallTimeMs=int((time.perf_counter() - start) * 1000))
+
+
+def default_mask_box(image_size):
+    """The bottom-center 300x100 box repainted when a request does not specify mask regions."""
+    width, height = image_size
+    return ((width - 300) // 2, height - 300, (width + 300) // 2, height - 200)
+
+
+def parse_mask_regions(value, image_size):
+    """Parses mask regions (one [left, top, right, bottom] box or a list of them) and clips them to the image."""
+    regions = json.loads(value) if isinstance(value, str) else value
+    if not isinstance(regions, (list, tuple)):
+        raise ValueError(f"Mask regions must be a [left, top, right, bottom] box or a list of boxes, not {regions!r}")
+    if regions and not isinstance(regions[0], (list, tuple)):
+        regions = [regions]
+    width, height = image_size
+    boxes = set()
+    for region in regions:
+        if not isinstance(region, (list, tuple)) or len(region) != 4:
+            raise ValueError(f"Mask region {region} must be [left, top, right, bottom]")
+        left, top, right, bottom = (int(coordinate) for coordinate in region)
+        left, top, right, bottom = max(0, left), max(0, top), min(width, right), min(height, bottom)
+        if left >= right or top >= bottom:
+            raise ValueError(f"Mask region {region} is empty or outside the {width}x{height} image")
+        boxes.add((left, top, right, bottom))
+    if not boxes:
+        raise ValueError("No mask regions given")
+    return tuple(sorted(boxes))
+
+
+@lru_cache(maxsize=64)
+def inpaint_mask_base64(image_size, regions):
+    """Returns a base64 PNG inpainting mask: one channel, 0 (black) inside the regions and 255 (white) elsewhere.
+
+    The mask depends only on the image size and the regions, so each encoded mask is built once per container.
+    """
+    import numpy as np
+    from PIL import Image
+
+    width, height = image_size
+    mask = np.full((height, width), 255, dtype=np.uint8)
+    for left, top, right, bottom in regions:
+        mask[top:bottom, left:right] = 0
+
+    buffer = io.BytesIO()
+    # A 2-D uint8 array becomes a one-channel ('L') image
+    Image.fromarray(mask).save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
 
 
 def lambda_handler(event, context):
     print(event)
+
+    api_path = event['apiPath']
+    profile = profiler.start(event)
+    # Metrics and the profile are written however the invocation ends
+    try:
+        api_response = handle_event(event)
+    finally:
+        metrics.flush(ApiPath=api_path)
+        profiler.finish(profile)
+    return profiler.attach(profile, api_response, event)
+
+
+def handle_event(event):
+    # Resolve the API path before doing any work so the model is only ever invoked once per event
+    action_group = event['actionGroup']
+    api_path = event['apiPath']
     
     def get_named_parameter(event, name):
         return next(item for item in event['parameters'] if item['name'] == name)['value']
 
-    model_id = get_named_parameter(event, 'modelId')
-    prompt = get_named_parameter(event, 'prompt')
+    def get_optional_parameter(event, name, default=None):
+        return next((item['value'] for item in event['parameters'] if item['name'] == name), default)
+
+    with span('params'):
+        model_id = get_named_parameter(event, 'modelId')
+        prompt = get_named_parameter(event, 'prompt')
+        # Optional inpainting regions: [left, top, right, bottom] or a list of such boxes
+        mask_regions = get_optional_parameter(event, 'maskRegions')
+        # Optional image count (per seed) and list of seeds for image models
+        number_of_images = get_optional_parameter(event, 'numberOfImages', 1)
+        seeds = get_optional_parameter(event, 'seeds')
     #encoded_image = get_named_parameter(event, 'image')
     print("MODE ID: " + model_id)
     print("PROMPT: " + prompt)
 
     def fetch_image_from_s3():
-        """Fetches an image from an S3 bucket and returns it as a BytesIO object."""
-        image_content = io.BytesIO()
-        
+        """Returns the reference image from S3 as a ReferenceImage (reused while its ETag is unchanged), or None."""
         try:
-            s3.download_fileobj(bucket_name, object_name, image_content)
-            print("Image successfully fetched from S3.")
-            return image_content
+            with metrics.timer(model_id, 'S3Ms'), span('s3_fetch'):
+                reference = reference_images.get()
+            if reference is None:
+                print("Reference image does not exist in the bucket.")
+            return reference
         except Exception as e:
             print(f"Error fetching image from S3: {e}")
             return None
 
-    def get_image_response(client, prompt_content): #text-to-text client function
+    def get_image_response(client, prompt_content): #text-to-image client function
+        """Builds the image requests for the model, then returns (store key, seed) of every image (or None)."""
         
-        if(model_id.startswith('stability')):
-            request_body = json.dumps({"text_prompts": 
-                                    [ {"text": prompt_content} ], #prompts to use
-                                    "cfg_scale": 9, #how closely the model tries to match the prompt
-                                    "steps": 50, }) #number of diffusion steps to perform
+        spec = get_model(model_id)
+        try:
+            count = int(number_of_images)
+            seed_list = parse_seeds(seeds)
+            overrides = image_request_overrides(spec, count, seed_list)
+        except ValueError as e:
+            print(f"Invalid image parameters: {e}")
+            return None
+        if count * len(seed_list or [None]) > IMAGE_MAX_IMAGES:
+            print(f"At most {IMAGE_MAX_IMAGES} images can be generated at once")
+            return None
+
+        if spec.supports(INPAINTING) and "change" in prompt.lower():   #IMAGE MODIFICATION DETECTOR
+            # Fetch the reference image; its decoded PIL and base64 forms are memoized per ETag
+            reference = fetch_image_from_s3()
+            if reference is None:
+                return None
+
+            # The size comes from the PNG header, so the source image is never decoded
+            image_size = reference.size
+            print(f"Image size: {image_size}")
+
+            # Regions to repaint come from the request's maskRegions, defaulting to a bottom-center box
             try:
-                response = client.invoke_model(body=request_body, modelId=model_id) #call the Bedrock endpoint
-                payload = json.loads(response.get('body').read()) #load the response body into a json object 
-                images = payload.get('artifacts') #extract the image artifacts
-                
-                # Check if images is None or empty
-                if not images or 'base64' not in images[0]:
-                    logging.error("No images found or 'base64' key is missing.")
-                    return "No image data found in the response."
-                
-                image_data = base64.b64decode(images[0].get('base64')) #decode image
-                image = io.BytesIO(image_data) #return a BytesIO object for client app consumption
-                                
-                return image
-
-            except Exception as e:
-                logging.error(f"An error occurred: {str(e)}")
-                return (f"An error occurred processing the image response:  {str(e)}")
-        
-        elif(model_id == 'amazon.titan-image-generator-v1'):    
-            if "change" in prompt.lower():   #IMAGE MODIFICATION DETECTOR
-                # Fetch the image from S3 and get a BytesIO object
-                image_bytes_io = fetch_image_from_s3()
-
-                # Convert BytesIO to a PIL.Image object
-                s3_image = Image.open(image_bytes_io)
-
-                # Now you can safely use .size or any other Image methods
-                # Example: getting the size of the image
-                image_size = s3_image.size
-                print(f"Image size: {image_size}")
-
-                # If you need to manipulate the image (e.g., inpainting_mask), do so here
-                # For example, creating a mask based on the image size
-                # box = (left, top, right, bottom)
-                box = ((image_size[0] - 300) // 2, image_size[1] - 300, (image_size[0] + 300) // 2, image_size[1] - 200)
-                mask = inpaint_mask(s3_image, box)
-                # Debug
-                print("THE MASK ON IMAGE MOD: ", mask)
-
-                request_body = json.dumps({
+                regions = parse_mask_regions(mask_regions or [default_mask_box(image_size)], image_size)
+            except (ValueError, TypeError) as e:
+                print(f"Invalid mask regions: {e}")
+                return None
+
+            with span('request_build'):
+                mask_image = inpaint_mask_base64(image_size, regions)
+                request_bodies = [json.dumps({
                     "taskType": "INPAINTING",
                     "inPaintingParams": {
                         "text": prompt_content,              # Optional
                         #"negativeText": negative_prompts,   # Optional
-                        "image": image_to_base64(s3_image),               # One image is required
+                        "image": reference.base64,               # One image is required
                         #"maskPrompt": "sky",               # One of "maskImage" or "maskPrompt" is required
-                        "maskImage": image_to_base64(mask)  # Input maskImage based on the values 0 (black) or 255 (white) only
-                    },
-                    "imageGenerationConfig": {
-                        "numberOfImages": 1,
-                        "quality": "premium",
-                        "height": 1024,
-                        "width": 1024,
-                        "cfgScale": 7.5,
-                        "seed": 42
-                    }
-                })
-
-            else:    
-                request_body = json.dumps({
-                    "taskType": "TEXT_IMAGE",
-                    "textToImageParams": {
-                        "text": prompt_content
+                        "maskImage": mask_image  # Input maskImage based on the values 0 (black) or 255 (white) only
                     },
-                    "imageGenerationConfig": {
-                        "numberOfImages": 1,
-                        "height": 1024,
-                        "width": 1024,
-                        "cfgScale": 8.0,
-                        "seed": 0
-                    }
-                })
-            
+                    "imageGenerationConfig": dict(spec.defaults, quality="premium", **request_overrides)
+                }) for request_overrides in overrides]
+
+        else:
+            # Text-to-image bodies built from the model's registry entry, one per seed
+            with span('request_build'):
+                request_bodies = [spec.request(prompt_content, **request_overrides) for request_overrides in overrides]
 
         def generate_image(model_id, body):
-            """
-            Generate an image using Amazon Titan Image Generator G1 model on demand.
-            Args:
-                model_id (str): The model ID to use.
-                body (str) : The request body to use.
-            Returns:
-                image_bytes (bytes): The image generated by the model.
-            """
-
-            logger.info("Generating image with Amazon Titan Image Generator G1 model %s", model_id)
-            bedrock = boto3.client(service_name='bedrock-runtime')
-            accept = "application/json"
-            content_type = "application/json"
-
-            response = bedrock.invoke_model(
-                body=body, modelId=model_id, accept=accept, contentType=content_type
-            )
-            response_body = json.loads(response.get("body").read())
-            base64_image = response_body.get("images")[0]
-            base64_bytes = base64_image.encode('ascii')
-            image_bytes = base64.b64decode(base64_bytes)
-            finish_reason = response_body.get("error")
-
-            if finish_reason is not None:
-                raise ImageError(f"Image generation error. Error is {finish_reason}")
-
-            logger.info(
-                "Successfully generated image with Amazon Titan Image Generator G1 model %s", model_id)
-
-            return image_bytes
+            """Invokes the image model and returns the bytes of every generated image."""
+            logger.info("Generating image with %s", model_id)
+            with span('bedrock_call'):
+                response = client.invoke_model(
+                    body=body, modelId=model_id, accept="application/json", contentType="application/json"
+                )
+                payload = response.get("body").read()
+            with span('image_decode'):
+                images = spec.parse_response(json.loads(payload))
+            logger.info("Successfully generated %d image(s) with %s", len(images), model_id)
+            return images
+
+        def generate_request(body):
+            """Returns (request ID, metadata, stored image keys, new image bytes) for one image request."""
+            request_id = request_key(model_id, body)
+            seed = request_seed(body)
+            metadata = {"modelId": model_id, "prompt": prompt_content, "seed": seed}
+            # Identical requests with a fixed seed are served from the content-addressed image store
+            if seed is not None:
+                with metrics.timer(model_id, 'S3Ms'), span('cache_lookup'):
+                    image_keys = image_store.lookup(request_id)
+                metrics.record(model_id, CacheHit=int(bool(image_keys)))
+                if image_keys:
+                    print(f"Image served from the image store: {image_keys}")
+                    return request_id, metadata, image_keys, []
+
+            with metrics.timer(model_id, 'LatencyMs'):
+                return request_id, metadata, [], generate_image(model_id=model_id, body=body)
+
+        def store_image(image_bytes, metadata):
+            """Hashes and uploads one image; returns its key."""
+            image_key = image_store.image_key(image_bytes, metadata)
+            with span('s3_upload'):
+                image_store.upload(image_bytes, image_key)
+            return image_key
 
         try:
-            image_bytes = generate_image(model_id=model_id, body=request_body)
-            image = Image.open(io.BytesIO(image_bytes))
-            image.show()
-
-            return image
+            # The requests of several seeds run concurrently, then every new image is hashed and
+            # uploaded concurrently, and each fixed-seed request's index is written once its images are stored
+            results = list(image_executor.map(generate_request, request_bodies))
+            new_images = [(image_bytes, metadata) for _, metadata, _, images in results for image_bytes in images]
+            if not new_images:
+                return [(image_key, metadata["seed"]) for _, metadata, image_keys, _ in results for image_key in image_keys]
+
+            with metrics.timer(model_id, 'S3Ms'):
+                stored = image_executor.map(store_image, *zip(*new_images))
+                images = []
+                for request_id, metadata, image_keys, new in results:
+                    if new:
+                        image_keys = [next(stored) for _ in new]
+                        # Only fixed-seed requests are ever looked up again, so only they get an index object
+                        if metadata["seed"] is not None:
+                            image_store.record(request_id, metadata, image_keys)
+                    images.extend((image_key, metadata["seed"]) for image_key in image_keys)
+            return images
 
         except ClientError as err:
             message = err.response["Error"]["Message"]
             logger.error("A client error occurred: %s", message)
             print("A client error occured: " +
                 format(message))
-        except ImageError as err:
-            logger.error(err.message)
-            print(err.message)
-
-
-    def inpaint_mask(img, box):
-        """Generates a segmentation mask for inpainting"""  
-        img_size = img.size
-        assert len(box) == 4  # (left, top, right, bottom)
-        assert box[0] < box[2]
-        assert box[1] < box[3]
-        return ImageOps.expand(
-            Image.new(
-                mode = "RGB",
-                size = (
-                    box[2] - box[0],
-                    box[3] - box[1]
-                ),
-                color = 'black'
-            ),
-            border=(
-                box[0],
-                box[1],
-                img_size[0] - box[2],
-                img_size[1] - box[3]
-            ),
-            fill='white'
-        )
-
-
-    def image_to_base64(img):
-        """Converts a PIL Image, local image file path, or BytesIO object to a base64 string"""
-        if isinstance(img, str):
-            # Handling file path
-            if os.path.isfile(img):
-                print(f"Reading image from file: {img}")
-                with open(img, "rb") as f:
-                    return base64.b64encode(f.read()).decode("utf-8")
-            else:
-                raise FileNotFoundError(f"File {img} does not exist")
-        elif isinstance(img, Image.Image):
-            # Handling PIL Image
-            buffer = io.BytesIO()
-            img.save(buffer, format="PNG")
-            return base64.b64encode(buffer.getvalue()).decode("utf-8")
-        elif isinstance(img, io.BytesIO):
-            # Handling BytesIO object
-            return base64.b64encode(img.getvalue()).decode("utf-8")
-        else:
-            raise ValueError(f"Expected str (filename), PIL Image, or BytesIO object. Got {type(img)}")
-
-
-
-
-    class Claude3Wrapper:
-        """Encapsulates Claude 3 model invocations using the Amazon Bedrock Runtime client."""
-        def __init__(self, client=None):
-            self.client = client or boto3.client(
-                service_name="bedrock-runtime", region_name=os.environ.get("BWB_REGION_NAME")
-            )
-
-        def invoke_claude_3_with_text(self, prompt):
-            """
-            Invokes Anthropic Claude 3 Sonnet to run an inference using the input provided in the request body.
-            """
-            try:
-                response = self.client.invoke_model(
-                    modelId=model_id,
-                    body=json.dumps(
-                        {
-                            "anthropic_version": "bedrock-2023-05-31",
-                            "max_tokens": 1024,
-                            "messages": [
-                                {
-                                    "role": "user",
-                                    "content": [{"type": "text", "text": prompt}],
-                                }
-                            ],
-                        }
-                    ),
-                )
-
-                result = json.loads(response.get("body").read())
-                input_tokens = result["usage"]["input_tokens"]
-                output_tokens = result["usage"]["output_tokens"]
-                output_list = result.get("content", [])
-                
-
-                print("Invocation details:")
-                print(f"- The input length is {input_tokens} tokens.")
-                print(f"- The output length is {output_tokens} tokens.")
-                
-                return output_list
-
-            except ClientError as err:
-                logger.error("Couldn't invoke Claude 3 with text. Error: %s", err)
-                raise
-
-        def invoke_claude_3_multimodal(self, prompt, base64_image_data):
-            """
-            Invokes Anthropic Claude 3 Haiku to run a multimodal inference using the input provided in the request body.
-            """
-
-            try:
-                request_body = {
-                    "anthropic_version": "bedrock-2023-05-31",
-                    "max_tokens": 2048,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": prompt},
-                                {
-                                    "type": "image",
-                                    "source": {
-                                        "type": "base64",
-                                        "media_type": "image/png",
-                                        "data": base64_image_data,
-                                    },
-                                },
-                            ],
-                        }
-                    ],
-                }
-
-                response = self.client.invoke_model(
-                    modelId=model_id,
-                    body=json.dumps(request_body),
-                )
-
-                result = json.loads(response.get("body").read())
-                input_tokens = result["usage"]["input_tokens"]
-                output_tokens = result["usage"]["output_tokens"]
-                output_list = result.get("content", [])
-                
+        except ModelResponseError as err:
+            logger.error(str(err))
+            print(str(err))
+        except Exception as err:
+            logger.error(f"An error occurred processing the image response: {str(err)}")
 
-                print("Invocation details:")
-                print(f"- The input length is {input_tokens} tokens.")
-                print(f"- The output length is {output_tokens} tokens.")
-                
-                return output_list
-
-            except ClientError as err:
-                logger.error("Couldn't invoke Claude 3 multimodally. Error: %s", err)
-                raise
-
-    class ImageError(Exception):
-        "Custom exception for errors returned by Amazon Titan Image Generator G1"
-
-        def __init__(self, message):
-            self.message = message
-
-    def get_inference_parameters(model): #return a default set of parameters based on the model's provider
-        bedrock_model_provider = model.split('.')[0] #grab the model provider from the first part of the model id
-        
-        if (bedrock_model_provider == 'mistral'):
-            #example modelID: mistral.gpt-3.5-turbo
-            #example modelID: mistral.mistral-large-2402-v1:0
-            return {
-                "max_tokens": 200,
-                "temperature": 0.5,
-                "top_k": 50,
-                "top_p": 0.9,
-            }
-        elif (bedrock_model_provider == 'ai21'): #AI21
-            #example modelID: ai21.j2-ultra-v1
-            return { #AI21
-                "maxTokens": 512, 
-                "temperature": 0, 
-                "topP": 0.5, 
-                "stopSequences": [], 
-                "countPenalty": {"scale": 0 }, 
-                "presencePenalty": {"scale": 0 }, 
-                "frequencyPenalty": {"scale": 0 } 
-            }    
-        elif (bedrock_model_provider == 'cohere'): #COHERE
-            #example modelID: cohere.command-text-v14
-            return {
-                "max_tokens": 512,
-                "temperature": 0,
-                "p": 0.01,
-                "k": 0,
-                "stop_sequences": [],
-                "return_likelihoods": "NONE"
-            }   
-        elif (bedrock_model_provider == 'meta'): #META
-            #example modelID: meta.llama2-70b-chat-v1
-            return {
-                "temperature": 0,
-                "top_p": 0.9,
-                "max_gen_len": 512
-            }  
-        elif (bedrock_model_provider == 'stability'): 
-            #example modelID: stability.stable-diffusion-xl-v0
-            return {
-                "weight": 1,
-                "cfg_scale": 10,
-                "seed": 0,
-                "steps": 50,
-                "width": 512,
-                "height": 512
-            }         
-        elif(bedrock_model_provider == 'anthropic'): #Anthropic
-            #example modelID: openai.gpt-3.5-turbo
-            return { 
-                "max_tokens_to_sample": 300,
-                "temperature": 0.5, 
-                "top_k": 250, 
-                "top_p": 1, 
-                "stop_sequences": ["\n\nHuman:"],
-                "anthropic_version": "bedrock-2023-05-31" 
-            }
-        elif(model_id == 'amazon.titan-image-generator-v1'):
-            # Check if the word "change" is in the prompt (case-insensitive). If so, this setup will be needed for IMAGE MODIFICATION (inpainting)
-            if "change" in prompt.lower():
-                return {
-                    "taskType": "TEXT_IMAGE",
-                    "textToImageParams": {
-                        "text": "string"
-                    },
-                    "imageGenerationConfig": {
-                        "numberOfImages": 1,
-                        "height": 1024,
-                        "width": 1024,
-                        "cfgScale": 8,
-                        "seed": 0,
-                        "quality": "standard"
-                    }
-                }
-            else:
-                return {
-                    "taskType": "TEXT_IMAGE",
-                    "textToImageParams": {
-                        "text": "string",      
-                        "negativeText": "string"
-                    },
-                    "imageGenerationConfig": {
-                        "numberOfImages": int,
-                        "height": int,
-                        "width": int,
-                        "cfgScale": float,
-                        "seed": int
-                    }
-                }
-        else: #Amazon
-            #For the LangChain Bedrock implementation, these parameters will be added to the 
-            #textGenerationConfig item that LangChain creates for us
-            return { 
-                "maxTokenCount": 512, 
-                "stopSequences": [], 
-                "temperature": 0, 
-                "topP": 0.9 
-            }
-  
-    def get_text_response(model_id, prompt):
-        client = boto3.client(service_name="bedrock-runtime", region_name=os.environ.get("BWB_REGION_NAME"))
-        encoded_image = None
 
+    def get_presigned_urls(keys, expires_in):
+        """Returns presigned GET URLs for objects in the image bucket, or None if signing fails."""
         try:
-            # Check if the file exists in S3
-            s3.head_object(Bucket=bucket_name, Key=object_name)
-            file_exists = True
+            with metrics.timer(model_id, 'S3Ms'), span('presign'):
+                return presigned_urls.get_urls(bucket_name, keys, expires_in)
         except ClientError as e:
-            # If a ClientError is thrown, check if it was a 404 error
-            # which means the object does not exist.
-            if e.response['Error']['Code'] == '404':
-                file_exists = False
-            else:
-                # Reraise the exception if it was a different error
-                raise
-
-        if file_exists:
-            # Create a BytesIO object to store image data from S3
-            file_stream = io.BytesIO()
-            s3.download_fileobj(bucket_name, object_name, file_stream)
-
-            # Reset the file pointer to the beginning after download
-            file_stream.seek(0)
-
-            # Directly encode the downloaded image data to base64
-            encoded_image = base64.b64encode(file_stream.getvalue()).decode('utf-8')
-            # Here you can use encoded_image as needed
-            print("File exists and has been encoded.")
-        else:
-            print("File does not exist in the bucket.")
-
-            # Load the image file into a variable
-            #fetched_image = Image.open(file_stream)   
-
-        if model_id == "anthropic.claude-3-opus-20240229-v1:0" or model_id == 'anthropic.claude-3-haiku-20240307-v1:0' or model_id == 'anthropic.claude-3-sonnet-20240229-v1:0':
-            # Invoke Claude 3 with text to text
-            wrapper = Claude3Wrapper(client)
-            if not encoded_image:
-                return wrapper.invoke_claude_3_with_text(prompt)
-            else:
-                # Invoke Claude 3 with image to text
-                return wrapper.invoke_claude_3_multimodal(prompt, encoded_image)
-            
-        # Conditional check for model_id starting with 'stability'
-        elif model_id.startswith('stability'):
-            def save_image_to_s3(image_bytes_io, bucket, object_name):
-                """
-                Saves an image (provided as a BytesIO object) to an S3 bucket for 'stability' models
-                and returns a presigned URL for the object.
-                """
-                try:
-                    image = Image.open(image_bytes_io)
-                    output_image_bytes = io.BytesIO()
-                    image.save(output_image_bytes, format='PNG')
-                    output_image_bytes.seek(0)
-                    s3.put_object(Bucket=bucket, Key=object_name, Body=output_image_bytes.getvalue())
-                    print(f"Image successfully saved to s3://{bucket}/{object_name}")
-                    
-                    # Generate a presigned URL for the saved image
-                    presigned_url = s3.generate_presigned_url('get_object',
-                                                            Params={'Bucket': bucket, 'Key': object_name},
-                                                            ExpiresIn=3600)  # URL expires in 1 hour
-                    return presigned_url
-                except ClientError as e:
-                    print(e)
-                    return None
-
-            image_response = get_image_response(client, prompt)
-            #generated_object_name = 'generated_images/image_{}.png'.format(int(time.time()))
-            generated_object_name = object_name       
-            presigned_url = save_image_to_s3(image_response, bucket_name, generated_object_name)
-            if presigned_url:
-                return {"message": "Stability image created and saved successfully", "url": presigned_url}
-            else:
-                return {"message": "Failed to create or save the image."}
+            print(e)
+            return None
 
-        # Conditional check for model_id equal to 'amazon.titan-image-generator-v1'
-        elif model_id == 'amazon.titan-image-generator-v1':
-
-            #Modify image object_name to create a new image, and store it as modified_image.png
-
-
-
-            def save_image_to_s3(image, bucket, object_name):
-                """
-                Saves an image (provided as a PIL Image object) to an S3 bucket for 'amazon.titan-image-generator-v1' models
-                and returns a presigned URL for the object.
-                """
-                
-                try:
-                    image_bytes = io.BytesIO()
-                    image.save(image_bytes, format='PNG')
-                    image_bytes.seek(0)
-
-                    if "change" in prompt.lower():
-                        object_name = "modified_image.png"
-                    
-
-                    s3.put_object(Bucket=bucket, Key=object_name, Body=image_bytes.getvalue())
-                    print(f"Image successfully saved to s3://{bucket}/{object_name}")
-                    
-                    # Generate a presigned URL for the saved image
-                    presigned_url = s3.generate_presigned_url('get_object',
-                                                            Params={'Bucket': bucket, 'Key': object_name},
-                                                            ExpiresIn=604800)  # URL expires in 7 days
-                    return presigned_url
-                except Exception as e:
-                    print(e)
-                    return None
-
-            image_response = get_image_response(client, prompt)
-            generated_object_name = object_name
-            presigned_url = save_image_to_s3(image_response, bucket_name, generated_object_name)
-            if presigned_url:
-                return {"message": "Amazon image created and saved successfully", "url": presigned_url}
+    def get_text_response(model_id, prompt):
+        client = get_client('bedrock-runtime')
+        # One registry lookup decides the path; unregistered IDs (custom models) are treated as text models
+        spec = get_model(model_id) or custom_text_model(model_id)
+
+        if spec.supports(MULTIMODAL):
+            # Only the multimodal models look at the reference image; it is revalidated by ETag
+            # and sent with the prompt through Converse, or left out when it does not exist
+            with metrics.timer(model_id, 'S3Ms'), span('s3_fetch'):
+                reference = reference_images.get()
+            if reference is None:
+                print("File does not exist in the bucket.")
+            return converse_text(client, spec, prompt, reference)
+
+        elif spec.supports(IMAGE):
+            # Amazon image URLs expire in 7 days, the others in 1 hour
+            expires_in = 604800 if spec.provider == 'amazon' else 3600
+            images = get_image_response(client, prompt)
+            presigned = get_presigned_urls([image_key for image_key, _ in images], expires_in) if images else None
+            if presigned:
+                return {
+                    "message": f"{spec.provider.capitalize()} {'images' if len(presigned) > 1 else 'image'} created and saved successfully",
+                    "url": presigned[0],
+                    # Titan returns all images of a seed from one request, so the seed is the request's, not the image's
+                    "images": [{"url": url, "requestSeed": seed} for url, (_, seed) in zip(presigned, images)]
+                }
             else:
                 return {"message": "Failed to create or save the image."}
 
         else:
-            model_kwargs = get_inference_parameters(model_id)
-            llm = Bedrock(
-                credentials_profile_name=os.environ.get("BWB_PROFILE_NAME"),
-                region_name=os.environ.get("BWB_REGION_NAME"),
-                endpoint_url=os.environ.get("BWB_ENDPOINT_URL"),
-                model_id=model_id,
-                model_kwargs=model_kwargs
-            )
-            return llm.predict(prompt)
-
-    try:
-        # Main execution
-        response = get_text_response(model_id, prompt)
-        print(response)
-    except ClientError as e:
-        response = (f"An error occurred processing the text response:  {str(e)}")
-        # Prepare a response indicating a request error
-
-
+            # Every other text model goes through the provider-neutral Converse API on the cached client
+            return converse_text(client, spec, prompt)
 
     #----------Below code is for the action group response----------#
 
     response_code = 200
-    action_group = event['actionGroup']
-    api_path = event['apiPath']
 
     if api_path == '/callModel':
-        result = get_text_response(model_id, prompt)
+        try:
+            # Main execution: the single model invocation for this event, reused for logging and the response
+            result = get_text_response(model_id, prompt)
+            print(result)
+        except ClientError as e:
+            metrics.record(model_id, Errors=1)
+            result = (f"An error occurred processing the text response:  {str(e)}")
     else:
         response_code = 404
         result = f"Unrecognized api path: {action_group}::{api_path}"
@@ -586,12 +395,11 @@ def lambda_handler(event, context):
      }
 
     action_response = {
-        'actionGroup': event['actionGroup'],
-        'apiPath': event['apiPath'],
+        'actionGroup': action_group,
+        'apiPath': api_path,
         'httpMethod': event['httpMethod'],
         'httpStatusCode': response_code,
         'responseBody': response_body
     }
 
-    api_response = {'messageVersion': '1.0', 'response': action_response}
-    return api_response
+    return {'messageVersion': '1.0', 'response': action_response}
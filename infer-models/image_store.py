@@ -0,0 +1 @@
+../shared/image_store.py
\ No newline at end of file
@@ -0,0 +1 @@
+../shared/model_registry.py
\ No newline at end of file
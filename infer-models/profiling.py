@@ -0,0 +1 @@
+../shared/profiling.py
\ No newline at end of file
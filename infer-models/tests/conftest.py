@@ -0,0 +1,106 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import sys
+
+import pytest
+from botocore.exceptions import ClientError
+
+# The handler imports its modules as top-level names, as it does in the Lambda package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('S3_IMAGE_BUCKET', 'test-bucket')
+
+
+def png_bytes(size=(64, 32), color=(200, 30, 30), mode='RGB'):
+    """Encodes a solid-color PNG of the given size."""
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new(mode, size, color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class FakeS3:
+    """In-memory stand-in for the S3 calls the handler makes."""
+
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not Found'}}, 'GetObject')
+        etag = '"%s"' % hashlib.md5(self.objects[Key]).hexdigest()
+        if IfNoneMatch == etag:
+            raise ClientError({'Error': {'Code': '304', 'Message': 'Not Modified'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key]), 'ETag': etag}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        self.objects[Key] = Body.encode('utf-8') if isinstance(Body, str) else bytes(Body)
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        return f"https://{Params['Bucket']}.s3.amazonaws.com/{Params['Key']}?X-Amz-Expires={ExpiresIn}"
+
+
+class FakeBedrockRuntime:
+    """Counts model calls and answers them like Bedrock: Converse text, Claude 3 messages, Titan or Stable Image images."""
+
+    def __init__(self):
+        self.calls = []
+        self.requests = []
+
+    def converse(self, **request):
+        self.calls.append(('converse', request['modelId']))
+        self.requests.append(request)
+        return {
+            'output': {'message': {'role': 'assistant', 'content': [{'text': 'An answer.'}]}},
+            'usage': {'inputTokens': 7, 'outputTokens': 3, 'totalTokens': 10},
+            'metrics': {'latencyMs': 25},
+        }
+
+    def invoke_model(self, modelId, body, **kwargs):
+        self.calls.append(('invoke_model', modelId))
+        request = json.loads(body)
+        if 'imageGenerationConfig' in request:
+            count = request['imageGenerationConfig'].get('numberOfImages', 1)
+            payload = {'images': [base64.b64encode(png_bytes(color=(index, 0, 0))).decode() for index in range(count)]}
+        elif 'prompt' in request:
+            # Stable Image models return one image per request
+            payload = {'images': [base64.b64encode(png_bytes(color=(0, len(self.calls), 0))).decode()], 'finish_reasons': [None]}
+        else:
+            payload = {
+                'content': [{'type': 'text', 'text': 'A red rectangle.'}],
+                'usage': {'input_tokens': 12, 'output_tokens': 4},
+            }
+        return {'body': io.BytesIO(json.dumps(payload).encode())}
+
+    def count(self, operation):
+        return sum(1 for called, _ in self.calls if called == operation)
+
+
+@pytest.fixture
+def s3():
+    return FakeS3()
+
+
+@pytest.fixture
+def bedrock():
+    return FakeBedrockRuntime()
+
+
+@pytest.fixture
+def reference_png():
+    return png_bytes((640, 480))
+
+
+@pytest.fixture
+def handler(monkeypatch, s3, bedrock):
+    """The handler module wired to fresh in-memory Bedrock and S3 clients, with no response cache."""
+    import handler
+
+    monkeypatch.setitem(handler._clients, ('bedrock-runtime', None), bedrock)
+    monkeypatch.setitem(handler._clients, ('s3', None), s3)
+    monkeypatch.setattr(handler.reference_images, '_current', None)
+    monkeypatch.setattr(handler, 'response_cache', None)
+    return handler
@@ -0,0 +1,163 @@
+import pytest
+
+import profiling
+
+TEXT_MODEL = 'meta.llama3-8b-instruct-v1:0'
+MULTIMODAL_MODEL = 'anthropic.claude-3-haiku-20240307-v1:0'
+IMAGE_MODEL = 'amazon.titan-image-generator-v1'
+STABILITY_MODEL = 'stability.sd3-large-v1:0'
+
+
+def agent_event(api_path, **parameters):
+    return {
+        'messageVersion': '1.0',
+        'actionGroup': 'infer-models',
+        'apiPath': api_path,
+        'httpMethod': 'POST',
+        'parameters': [{'name': name, 'type': 'string', 'value': value} for name, value in parameters.items()],
+    }
+
+
+def body_of(response):
+    return response['response']['responseBody']['application/json']['body']
+
+
+def test_text_model_is_called_once(handler, bedrock):
+    response = handler.lambda_handler(agent_event('/callModel', modelId=TEXT_MODEL, prompt='Hello'), None)
+
+    assert response['response']['httpStatusCode'] == 200
+    assert body_of(response)['result'] == 'An answer.'
+    assert bedrock.calls == [('converse', TEXT_MODEL)]
+
+
+def test_image_model_is_invoked_once(handler, bedrock, s3):
+    response = handler.lambda_handler(agent_event('/callModel', modelId=IMAGE_MODEL, prompt='A red square'), None)
+
+    body = body_of(response)
+    assert bedrock.calls == [('invoke_model', IMAGE_MODEL)]
+    assert len(body['images']) == 1
+    assert body['url'] == body['images'][0]['url']
+    assert any(key.startswith('generated-images/') for key in s3.objects)
+
+
+def test_image_with_fixed_seed_is_served_from_the_store(handler, bedrock):
+    event = agent_event('/callModel', modelId=IMAGE_MODEL, prompt='A red square')
+    first = body_of(handler.lambda_handler(event, None))
+    second = body_of(handler.lambda_handler(event, None))
+
+    assert bedrock.count('invoke_model') == 1
+    assert second['url'] == first['url']
+
+
+def test_multimodal_model_is_invoked_once_with_the_reference_image(handler, bedrock, s3, reference_png):
+    s3.objects[handler.object_name] = reference_png
+
+    response = handler.lambda_handler(agent_event('/callModel', modelId=MULTIMODAL_MODEL, prompt='Describe it'), None)
+
+    assert bedrock.calls == [('converse', MULTIMODAL_MODEL)]
+    content = bedrock.requests[0]['messages'][0]['content']
+    assert content[1] == {'image': {'format': 'png', 'source': {'bytes': reference_png}}}
+    assert body_of(response)['result'] == 'An answer.'
+
+
+def test_multimodal_model_answers_without_a_reference_image(handler, bedrock):
+    handler.lambda_handler(agent_event('/callModel', modelId=MULTIMODAL_MODEL, prompt='Hello'), None)
+
+    assert bedrock.calls == [('converse', MULTIMODAL_MODEL)]
+    assert bedrock.requests[0]['messages'][0]['content'] == [{'text': 'Hello'}]
+
+
+def test_text_models_use_their_registered_defaults(handler, bedrock):
+    from model_registry import get_model
+
+    handler.lambda_handler(agent_event('/callModel', modelId=MULTIMODAL_MODEL, prompt='Hello'), None)
+
+    assert bedrock.requests[0]['inferenceConfig'] == get_model(MULTIMODAL_MODEL).defaults
+
+
+def test_unknown_path_does_not_call_a_model(handler, bedrock):
+    response = handler.lambda_handler(agent_event('/unknown', modelId=TEXT_MODEL, prompt='Hello'), None)
+
+    assert response['response']['httpStatusCode'] == 404
+    assert bedrock.calls == []
+
+
+def test_client_timeouts_fit_the_function_timeout(handler):
+    config = handler.client_config
+    worst_case = config.retries['total_max_attempts'] * (config.connect_timeout + config.read_timeout)
+
+    assert worst_case < 60
+
+
+def test_metrics_and_profile_are_written_when_parameters_are_missing(handler, monkeypatch, tmp_path):
+    lines = []
+    monkeypatch.setattr(handler.metrics, 'emit', lines.append)
+    monkeypatch.setattr(handler.profiler, 'output', str(tmp_path))
+    handler.metrics.record(TEXT_MODEL, Errors=1)
+    event = agent_event('/callModel', prompt='Hello', profile='spans')
+
+    with pytest.raises(StopIteration):
+        handler.lambda_handler(event, None)
+
+    assert len(lines) == 1
+    assert len(list(tmp_path.iterdir())) == 1
+    assert profiling._active is None
+
+
+def test_titan_images_are_tagged_with_their_request_seed(handler, bedrock):
+    event = agent_event('/callModel', modelId=IMAGE_MODEL, prompt='A red square', numberOfImages='2', seeds='[7, 11]')
+
+    body = body_of(handler.lambda_handler(event, None))
+
+    assert bedrock.count('invoke_model') == 2
+    assert [image['requestSeed'] for image in body['images']] == [7, 7, 11, 11]
+    assert len({image['url'] for image in body['images']}) == 4
+
+
+def test_titan_image_counts_above_five_are_split_across_requests(handler, bedrock):
+    event = agent_event('/callModel', modelId=IMAGE_MODEL, prompt='A red square', numberOfImages='8')
+
+    body = body_of(handler.lambda_handler(event, None))
+
+    assert bedrock.count('invoke_model') == 2
+    assert [image['requestSeed'] for image in body['images']] == [42] * 5 + [43] * 3
+
+
+def test_random_seed_images_write_no_request_index(handler, bedrock, s3):
+    event = agent_event('/callModel', modelId=STABILITY_MODEL, prompt='A red square', numberOfImages='2')
+
+    body = body_of(handler.lambda_handler(event, None))
+
+    assert bedrock.count('invoke_model') == 2
+    assert len({image['url'] for image in body['images']}) == 2
+    assert not any(key.startswith('image-requests/') for key in s3.objects)
+
+
+def test_temperature_zero_answers_are_served_from_the_cache(handler, bedrock, monkeypatch):
+    from response_cache import LRUCache, ResponseCache
+
+    monkeypatch.setattr(handler, 'response_cache', ResponseCache(LRUCache(1024 * 1024, 3600)))
+    event = agent_event('/callModel', modelId=TEXT_MODEL, prompt='Hello')
+
+    first = body_of(handler.lambda_handler(event, None))
+    second = body_of(handler.lambda_handler(event, None))
+
+    assert bedrock.calls == [('converse', TEXT_MODEL)]
+    assert first['cache']['hit'] is False and second['cache']['hit'] is True
+    assert second['result'] == first['result']
+
+
+def test_cached_multimodal_answers_depend_on_the_reference_image(handler, bedrock, s3, reference_png, monkeypatch):
+    from response_cache import LRUCache, ResponseCache
+
+    monkeypatch.setattr(handler, 'response_cache', ResponseCache(LRUCache(1024 * 1024, 3600)))
+    event = agent_event('/callModel', modelId=MULTIMODAL_MODEL, prompt='Describe it')
+    s3.objects[handler.object_name] = reference_png
+    handler.lambda_handler(event, None)
+    handler.lambda_handler(event, None)
+
+    # A new upload of the reference image has a new ETag
+    s3.objects[handler.object_name] = reference_png + b'\0'
+    handler.lambda_handler(event, None)
+
+    assert bedrock.count('converse') == 2
@@ -0,0 +1,35 @@
+import base64
+import io
+
+import pytest
+
+from handler import default_mask_box, inpaint_mask_base64, parse_mask_regions
+
+
+def test_single_box_and_list_of_boxes():
+    assert parse_mask_regions('[10, 20, 30, 40]', (100, 100)) == ((10, 20, 30, 40),)
+    assert parse_mask_regions([[50, 0, 60, 10], [10, 20, 30, 40]], (100, 100)) == ((10, 20, 30, 40), (50, 0, 60, 10))
+
+
+def test_boxes_are_clipped_and_deduplicated():
+    assert parse_mask_regions([[-5, -5, 150, 50], [0, 0, 100, 50]], (100, 80)) == ((0, 0, 100, 50),)
+
+
+@pytest.mark.parametrize('value', ['{"a": 1}', '5', '"box"', '[[1, 2, 3, 4], 5]', '[1, 2, 3]', '[]', '[90, 90, 95, 95]', 'not json'])
+def test_invalid_regions_raise_value_error(value):
+    with pytest.raises(ValueError):
+        parse_mask_regions(value, (50, 50))
+
+
+def test_default_box_is_bottom_center():
+    assert default_mask_box((1024, 1024)) == (362, 724, 662, 824)
+
+
+def test_mask_is_black_inside_the_regions():
+    from PIL import Image
+
+    mask = Image.open(io.BytesIO(base64.b64decode(inpaint_mask_base64((8, 4), ((2, 1, 4, 3),)))))
+
+    assert mask.mode == 'L' and mask.size == (8, 4)
+    assert mask.getpixel((2, 1)) == 0 and mask.getpixel((3, 2)) == 0
+    assert mask.getpixel((0, 0)) == 255 and mask.getpixel((4, 3)) == 255
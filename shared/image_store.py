@@ -0,0 +1,308 @@
+import base64
+import hashlib
+import io
+import json
+import logging
+import struct
+import threading
+import time
+from collections import OrderedDict
+from functools import cached_property
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+
+# Leading bytes of the image formats Bedrock models return: (signature, extension, content type)
+_IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png', 'image/png'),
+    (b'\xff\xd8\xff', 'jpeg', 'image/jpeg'),
+)
+
+
+def sniff_image_format(data):
+    """Returns (extension, content type) from an image's leading bytes without decoding it."""
+    header = bytes(memoryview(data)[:12])
+    for signature, extension, content_type in _IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return extension, content_type
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp', 'image/webp'
+    raise ValueError("Model output is not a PNG, JPEG or WebP image")
+
+
+def transform_image(data, output_format):
+    """Re-encodes an image in another format. This is the only step that decodes pixels with PIL."""
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    with Image.open(io.BytesIO(data)) as image:
+        if output_format == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(buffer, format=output_format.upper())
+    return buffer.getvalue()
+
+
+def _canonical(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def request_key(model_id, request_body):
+    """Returns the SHA-256 of an image generation request (model ID plus the canonical request body)."""
+    body = json.loads(request_body) if isinstance(request_body, (str, bytes)) else request_body
+    return hashlib.sha256(_canonical({"modelId": model_id, "body": body})).hexdigest()
+
+
+def request_seed(request_body):
+    """Returns the fixed seed of a Titan or Stability request body, or None when the model picks one at random."""
+    body = json.loads(request_body) if isinstance(request_body, (str, bytes)) else request_body
+    seed = body.get('imageGenerationConfig', {}).get('seed', body.get('seed'))
+    # Stability models treat a missing seed or seed 0 as "random"
+    if seed is None or ('imageGenerationConfig' not in body and seed == 0):
+        return None
+    return seed
+
+
+class ImageStore:
+    """Content-addressed store for generated images in S3.
+
+    Images are written under <image_prefix><sha256 of the request metadata and image bytes>.png, so
+    concurrent requests never overwrite each other. For every request an index object under
+    <index_prefix><request key>.json records the keys of the images the request returned, which lets
+    an identical re-generation (same model, prompt, settings and fixed seed) be served from the store
+    without calling Bedrock.
+    """
+
+    def __init__(self, client_factory, bucket_factory, image_prefix='generated-images/', index_prefix='image-requests/',
+                 multipart_threshold=8 * 1024 * 1024, multipart_chunksize=5 * 1024 * 1024, multipart_concurrency=4):
+        self.client_factory = client_factory
+        self.bucket_factory = bucket_factory
+        self.image_prefix = image_prefix
+        self.index_prefix = index_prefix
+        self.multipart_threshold = multipart_threshold
+        self.multipart_chunksize = multipart_chunksize
+        self.multipart_concurrency = multipart_concurrency
+
+    def lookup(self, request_id):
+        """Returns the image keys previously stored for a request, in the model's order, or None."""
+        try:
+            response = self.client_factory().get_object(
+                Bucket=self.bucket_factory(), Key=f"{self.index_prefix}{request_id}.json"
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+        entry = json.loads(response['Body'].read())
+        # Entries written before multi-image requests only have imageKey
+        return entry.get('imageKeys') or [entry['imageKey']]
+
+    def image_key(self, image_bytes, metadata):
+        """Returns the key put() stores the image under, so it can be presigned before the upload completes."""
+        extension, _ = sniff_image_format(image_bytes)
+        digest = hashlib.sha256(_canonical(metadata))
+        digest.update(memoryview(image_bytes))
+        return f"{self.image_prefix}{digest.hexdigest()}.{extension}"
+
+    def upload(self, image_bytes, image_key):
+        """Uploads one image straight from memory under its key.
+
+        Images of multipart_threshold bytes or more go up as a multipart upload, whose parts are
+        sent concurrently instead of as one large PUT.
+        """
+        _, content_type = sniff_image_format(image_bytes)
+        s3 = self.client_factory()
+        bucket = self.bucket_factory()
+        if len(image_bytes) < self.multipart_threshold:
+            s3.put_object(Bucket=bucket, Key=image_key, Body=image_bytes, ContentType=content_type)
+        else:
+            s3.upload_fileobj(
+                io.BytesIO(image_bytes), bucket, image_key,
+                ExtraArgs={'ContentType': content_type}, Config=self._transfer_config
+            )
+
+    def record(self, request_id, metadata, image_keys):
+        """Writes the request index that lets lookup() serve the request's images again."""
+        self.client_factory().put_object(
+            Bucket=self.bucket_factory(),
+            Key=f"{self.index_prefix}{request_id}.json",
+            Body=json.dumps(dict(metadata, imageKey=image_keys[0], imageKeys=image_keys, requestId=request_id)),
+            ContentType='application/json'
+        )
+        logger.info(f"Stored {len(image_keys)} image(s) for request {request_id}")
+
+    def put(self, image_bytes, request_id, metadata, image_key=None):
+        """Uploads image bytes straight from memory, records the request index and returns the image key.
+
+        The format is validated by sniffing the header, so the bytes are never decoded here. A key
+        already computed with image_key() can be passed in to skip hashing the image again.
+        """
+        image_key = image_key or self.image_key(image_bytes, metadata)
+        self.upload(image_bytes, image_key)
+        self.record(request_id, metadata, [image_key])
+        return image_key
+
+    @cached_property
+    def _transfer_config(self):
+        # s3transfer is only needed once an image crosses the multipart threshold
+        from boto3.s3.transfer import TransferConfig
+
+        return TransferConfig(
+            multipart_threshold=self.multipart_threshold,
+            multipart_chunksize=self.multipart_chunksize,
+            max_concurrency=self.multipart_concurrency
+        )
+
+
+class PresignedUrlCache:
+    """Reuses presigned GET URLs across warm invocations instead of re-signing them on every response.
+
+    URLs are cached per (bucket, key, expiry tier) and handed out again only while at least
+    min_remaining_fraction of their lifetime (and never less than margin_seconds) remains, so a
+    caller asking for a one-hour URL always gets one that is valid for at least half an hour. Reuse
+    is also capped at max_age_seconds after signing, because a URL signed with the function's
+    temporary credentials stops working when those credentials expire.
+    """
+
+    def __init__(self, client_factory, margin_seconds=300, min_remaining_fraction=0.5, max_age_seconds=3600,
+                 max_entries=1024, clock=time.time):
+        self.client_factory = client_factory
+        self.margin_seconds = margin_seconds
+        self.min_remaining_fraction = min_remaining_fraction
+        self.max_age_seconds = max_age_seconds
+        self.max_entries = max_entries
+        self.clock = clock
+        self._urls = OrderedDict()  # (bucket, key, expires_in) -> (reuse_until, url)
+        self._lock = threading.Lock()
+
+    def get_url(self, bucket, key, expires_in):
+        cache_key = (bucket, key, expires_in)
+        now = self.clock()
+        with self._lock:
+            entry = self._urls.get(cache_key)
+            if entry is not None and entry[0] > now:
+                self._urls.move_to_end(cache_key)
+                return entry[1]
+
+        url = self.client_factory().generate_presigned_url(
+            'get_object', Params={'Bucket': bucket, 'Key': key}, ExpiresIn=expires_in
+        )
+        remaining = min(max(self.margin_seconds, expires_in * self.min_remaining_fraction), expires_in)
+        reuse_until = now + min(expires_in - remaining, self.max_age_seconds)
+        with self._lock:
+            self._urls[cache_key] = (reuse_until, url)
+            self._urls.move_to_end(cache_key)
+            while len(self._urls) > self.max_entries:
+                self._urls.popitem(last=False)
+        return url
+
+    def get_urls(self, bucket, keys, expires_in):
+        """Batch form of get_url for multi-image responses; returns the URLs in the order of keys."""
+        return [self.get_url(bucket, key, expires_in) for key in keys]
+
+
+class ReferenceImage:
+    """An in-memory copy of the reference image whose base64, PIL and downscaled forms are computed once."""
+
+    def __init__(self, data, etag):
+        self.data = data
+        self.etag = etag
+        self._fitted = {}  # (max width, max height) -> base64
+
+    @cached_property
+    def base64(self):
+        return base64.b64encode(self.data).decode('utf-8')
+
+    @cached_property
+    def size(self):
+        """(width, height), read from the PNG header when possible instead of decoding the pixels."""
+        if self.data[:8] == b'\x89PNG\r\n\x1a\n' and self.data[12:16] == b'IHDR':
+            return struct.unpack('>II', self.data[16:24])
+        return self.image.size
+
+    @cached_property
+    def image(self):
+        from PIL import Image
+
+        image = Image.open(io.BytesIO(self.data))
+        image.load()
+        return image
+
+    @cached_property
+    def is_rgb(self):
+        """Whether the image is plain RGB or grayscale (no alpha, no palette), read from the PNG header when possible."""
+        if self.data[:8] == b'\x89PNG\r\n\x1a\n' and self.data[12:16] == b'IHDR':
+            return self.data[25] in (0, 2)  # PNG color types: grayscale, truecolor
+        return self.image.mode in ('RGB', 'L')
+
+    def fit_base64(self, width, height, min_side=320):
+        """Returns the image as base64, scaled down (keeping its aspect ratio) to fit width x height.
+
+        Neither side is scaled below min_side, Titan Image Generator v2's smallest input, so the
+        long side of a narrow image may stay larger than the box. Images with alpha or a palette
+        are converted to RGB. An RGB image that already fits is returned as stored, without
+        decoding it. Raises ValueError when the image is smaller than min_side to begin with.
+        """
+        fitted = self._fitted.get((width, height))
+        if fitted is not None:
+            return fitted
+        image_width, image_height = self.size
+        if min(image_width, image_height) < min_side:
+            raise ValueError(
+                f"The reference image is {image_width}x{image_height}; both sides must be at least {min_side} pixels"
+            )
+        scale = max(min(1, width / image_width, height / image_height), min_side / min(image_width, image_height))
+        if scale >= 1 and self.is_rgb:
+            fitted = self.base64
+        else:
+            from PIL import Image
+
+            image = self.image
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            if scale < 1:
+                size = (max(min_side, round(image_width * scale)), max(min_side, round(image_height * scale)))
+                image = image.resize(size, Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, format='PNG')
+            fitted = base64.b64encode(buffer.getvalue()).decode('utf-8')
+        self._fitted[(width, height)] = fitted
+        return fitted
+
+
+class ReferenceImageCache:
+    """Keeps the reference image in the warm container and revalidates it by ETag.
+
+    get() sends a conditional GET (IfNoneMatch) for the cached ETag, so an unchanged object costs
+    one bodiless 304 round trip and reuses the memoized decoded forms.
+    """
+
+    def __init__(self, client_factory, bucket_factory, key):
+        self.client_factory = client_factory
+        self.bucket_factory = bucket_factory
+        self.key = key
+        self._current = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Returns the current ReferenceImage, or None when the object does not exist."""
+        current = self._current
+        params = {'Bucket': self.bucket_factory(), 'Key': self.key}
+        if current is not None:
+            params['IfNoneMatch'] = current.etag
+        try:
+            response = self.client_factory().get_object(**params)
+        except ClientError as e:
+            code = e.response['Error']['Code']
+            if code in ('304', 'NotModified'):
+                return current
+            if code in ('NoSuchKey', '404'):
+                self._current = None
+                return None
+            raise
+
+        reference = ReferenceImage(response['Body'].read(), response['ETag'])
+        with self._lock:
+            self._current = reference
+        return reference
@@ -0,0 +1,84 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# CloudWatch unit of every metric the handlers record
+METRIC_UNITS = {
+    'LatencyMs': 'Milliseconds',
+    'TimeToFirstTokenMs': 'Milliseconds',
+    'S3Ms': 'Milliseconds',
+    'InputTokens': 'Count',
+    'OutputTokens': 'Count',
+    'CacheHit': 'Count',
+    'Errors': 'Count',
+    'Hedged': 'Count',
+}
+
+# EMF allows at most 100 values per metric in one log line
+_MAX_VALUES = 100
+
+
+class MetricsLogger:
+    """Collects per-model metrics during an invocation and flushes them as CloudWatch Embedded Metric
+    Format (EMF) log lines.
+
+    Values are grouped by model, so one flush writes a single line per model with an array of values
+    per metric, instead of a line per call. Each line is published under the ModelId dimension and
+    without dimensions (the function-wide aggregate). emit receives each JSON line; the default prints
+    it to stdout, which Lambda forwards to CloudWatch Logs.
+    """
+
+    def __init__(self, namespace, enabled=True, emit=print, clock=time.time):
+        self.namespace = namespace
+        self.enabled = enabled
+        self.emit = emit
+        self.clock = clock
+        self._values = {}  # model_id -> {metric name -> [values]}
+        self._lock = threading.Lock()
+
+    def record(self, model_id, **values):
+        """Records metric values for one call, e.g. record(model_id, LatencyMs=120, InputTokens=12)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            metrics = self._values.setdefault(model_id, {})
+            for name, value in values.items():
+                if value is not None:
+                    metrics.setdefault(name, []).append(value)
+
+    @contextmanager
+    def timer(self, model_id, name):
+        """Records the wall time of the with-block in milliseconds under a metric name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(model_id, **{name: int((time.perf_counter() - start) * 1000)})
+
+    def flush(self, **properties):
+        """Writes the collected metrics as EMF lines, with extra properties (not metrics) attached."""
+        with self._lock:
+            values, self._values = self._values, {}
+        timestamp = int(self.clock() * 1000)
+        for model_id, metrics in values.items():
+            for offset in range(0, max(len(series) for series in metrics.values()), _MAX_VALUES):
+                chunk = {name: series[offset:offset + _MAX_VALUES] for name, series in metrics.items()}
+                chunk = {name: series for name, series in chunk.items() if series}
+                self.emit(json.dumps(dict(properties, ModelId=model_id, **chunk, _aws={
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [{
+                        "Namespace": self.namespace,
+                        "Dimensions": [["ModelId"], []],
+                        "Metrics": [{"Name": name, "Unit": METRIC_UNITS.get(name, 'None')} for name in chunk],
+                    }],
+                })))
+
+    @classmethod
+    def from_environment(cls):
+        """Builds the logger from METRICS_ENABLED and METRICS_NAMESPACE."""
+        return cls(
+            os.environ.get('METRICS_NAMESPACE', 'BedrockAgentInferModels'),
+            enabled=os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+        )
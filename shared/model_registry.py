@@ -0,0 +1,286 @@
+import base64
+import json
+import time
+
+# Model capabilities
+TEXT = 'text'
+IMAGE = 'image'
+MULTIMODAL = 'multimodal'
+STREAMING = 'streaming'
+INPAINTING = 'inpainting'
+MULTI_IMAGE = 'multi_image'  # returns several images from one request (numberOfImages)
+CONDITIONING = 'conditioning'  # generates from a reference image (see titan_conditioned_request)
+
+# Titan Image Generator returns at most 5 images per request and takes seeds from 0 to 2147483646
+MAX_IMAGES_PER_REQUEST = 5
+TITAN_SEED_LIMIT = 2147483647
+
+# Reference image conditioning modes of Titan Image Generator v2: an IMAGE_VARIATION of the image, or
+# a TEXT_IMAGE whose layout follows the image's edges or segmentation map (the controlMode)
+CONDITIONING_MODES = {'variation': None, 'canny': 'CANNY_EDGE', 'segmentation': 'SEGMENTATION'}
+
+
+class ModelSpec:
+    """Registry entry for one Bedrock model.
+
+    build_request(spec, prompt, **overrides) returns the request for the model: Converse keyword
+    arguments for text models, an InvokeModel JSON body for image models. parse_response(payload)
+    turns the model's response into a result (text models) or a list of image bytes (image models).
+    Overrides are merged over the entry's default parameters.
+    """
+
+    __slots__ = ('model_id', 'label', 'provider', 'capabilities', 'defaults', 'build_request', 'parse_response')
+
+    def __init__(self, model_id, label, capabilities, defaults, build_request, parse_response):
+        self.model_id = model_id
+        self.label = label
+        self.provider = model_id.split('.', 1)[0]
+        self.capabilities = frozenset(capabilities)
+        self.defaults = defaults
+        self.build_request = build_request
+        self.parse_response = parse_response
+
+    def supports(self, capability):
+        return capability in self.capabilities
+
+    def request(self, prompt, **overrides):
+        return self.build_request(self, prompt, **overrides)
+
+    def __repr__(self):
+        return f"ModelSpec({self.model_id!r})"
+
+
+class ModelResponseError(Exception):
+    """Raised when a model response carries an error or no usable output."""
+
+
+def converse_request(spec, prompt, image=None, image_format='png', **overrides):
+    """Builds Converse keyword arguments; image (raw bytes) is attached for multimodal models.
+
+    image_format is the Converse format of the image: png, jpeg, gif or webp.
+    """
+    content = [{"text": prompt}]
+    if image is not None:
+        content.append({"image": {"format": image_format, "source": {"bytes": image}}})
+    return {
+        "modelId": spec.model_id,
+        "messages": [{"role": "user", "content": content}],
+        "inferenceConfig": dict(spec.defaults, **overrides),
+    }
+
+
+def parse_converse(response):
+    """Returns (text, usage, latency in ms) from a Converse response."""
+    text = ''.join(block.get('text', '') for block in response['output']['message']['content'])
+    return text, response['usage'], response['metrics']['latencyMs']
+
+
+def stream_converse(client, request, metrics=None):
+    """Yields text deltas from ConverseStream for Converse keyword arguments built by a text spec.
+
+    If a metrics dict is given it is filled with timeToFirstTokenMs as soon as the first delta
+    arrives, and with latencyMs and usage from the stream's closing metadata event.
+    """
+    metrics = {} if metrics is None else metrics
+    start = time.perf_counter()
+    response = client.converse_stream(**request)
+    for event in response['stream']:
+        if 'contentBlockDelta' in event:
+            text = event['contentBlockDelta']['delta'].get('text')
+            if text:
+                if 'timeToFirstTokenMs' not in metrics:
+                    metrics['timeToFirstTokenMs'] = int((time.perf_counter() - start) * 1000)
+                yield text
+        elif 'metadata' in event:
+            metrics['latencyMs'] = event['metadata']['metrics']['latencyMs']
+            metrics['usage'] = event['metadata']['usage']
+
+
+def titan_image_request(spec, prompt, **overrides):
+    """Builds a Titan Image Generator TEXT_IMAGE body."""
+    return json.dumps({
+        "taskType": "TEXT_IMAGE",
+        "textToImageParams": {"text": prompt},
+        "imageGenerationConfig": dict(spec.defaults, **overrides),
+    })
+
+
+def titan_conditioned_request(spec, prompt, image, mode='variation', strength=None, **overrides):
+    """Builds a Titan Image Generator v2 body conditioned on a reference image (base64).
+
+    strength is the similarityStrength of a variation (0.2 to 1.0) or the controlStrength of
+    the canny and segmentation modes (0 to 1.0); the model's default applies when it is None.
+    """
+    config = dict(spec.defaults, **overrides)
+    if mode == 'variation':
+        params = {"text": prompt, "images": [image]}
+        if strength is not None:
+            params["similarityStrength"] = strength
+        return json.dumps({"taskType": "IMAGE_VARIATION", "imageVariationParams": params, "imageGenerationConfig": config})
+    params = {"text": prompt, "conditionImage": image, "controlMode": CONDITIONING_MODES[mode]}
+    if strength is not None:
+        params["controlStrength"] = strength
+    return json.dumps({"taskType": "TEXT_IMAGE", "textToImageParams": params, "imageGenerationConfig": config})
+
+
+def parse_titan_images(payload):
+    if payload.get('error'):
+        raise ModelResponseError(f"Image generation error. Error is {payload['error']}")
+    images = payload.get('images')
+    if not images:
+        raise ModelResponseError("No image data found in the response.")
+    return [base64.b64decode(image) for image in images]
+
+
+def stability_sdxl_request(spec, prompt, **overrides):
+    """Builds a Stable Diffusion XL body."""
+    return json.dumps(dict(spec.defaults, text_prompts=[{"text": prompt}], **overrides))
+
+
+def parse_stability_artifacts(payload):
+    artifacts = [artifact for artifact in payload.get('artifacts') or () if 'base64' in artifact]
+    if not artifacts:
+        raise ModelResponseError("No image data found in the response.")
+    return [base64.b64decode(artifact['base64']) for artifact in artifacts]
+
+
+def stability_image_request(spec, prompt, **overrides):
+    """Builds a body for the Stable Image models (SD3 Large, Stable Image Core and Ultra)."""
+    return json.dumps(dict(spec.defaults, prompt=prompt, **overrides))
+
+
+def parse_stability_images(payload):
+    reasons = [reason for reason in payload.get('finish_reasons') or () if reason]
+    if reasons:
+        raise ModelResponseError(f"Image generation error. Error is {reasons[0]}")
+    if not payload.get('images'):
+        raise ModelResponseError("No image data found in the response.")
+    return [base64.b64decode(image) for image in payload['images']]
+
+
+# Converse inference defaults of the text model families. Both handlers send them as they are, so a
+# model behaves the same everywhere; temperature 0 keeps answers deterministic (and cacheable).
+TEXT_DEFAULTS = {"maxTokens": 2000, "temperature": 0, "topP": 0.9}
+AI21_DEFAULTS = dict(TEXT_DEFAULTS, topP=0.5)
+COHERE_DEFAULTS = dict(TEXT_DEFAULTS, topP=0.01)
+ANTHROPIC_DEFAULTS = dict(TEXT_DEFAULTS, topP=1)
+
+
+def _text(model_id, label, *capabilities, defaults=TEXT_DEFAULTS):
+    return ModelSpec(model_id, label, (TEXT,) + capabilities, defaults, converse_request, parse_converse)
+
+
+def _titan_image(model_id, label, defaults, *capabilities):
+    return ModelSpec(model_id, label, (IMAGE, INPAINTING, MULTI_IMAGE) + capabilities, defaults, titan_image_request, parse_titan_images)
+
+
+def _stability_image(model_id, label):
+    return ModelSpec(model_id, label, (IMAGE,), {}, stability_image_request, parse_stability_images)
+
+
+# The model registry, keyed by Bedrock model ID. Adding a model is one entry here.
+MODELS = {spec.model_id: spec for spec in (
+    _text("amazon.titan-text-premier-v1:0", "Amazon Titan Text Premier", STREAMING),
+    _text("amazon.titan-text-express-v1", "Amazon Titan Text Express", STREAMING),
+    _text("amazon.titan-text-lite-v1", "Amazon Titan Text Lite", STREAMING),
+    _text("ai21.j2-ultra-v1", "AI21 Jurassic-2 Ultra", defaults=AI21_DEFAULTS),
+    _text("ai21.j2-mid-v1", "AI21 Jurassic-2 Mid", defaults=AI21_DEFAULTS),
+    _text("anthropic.claude-3-opus-20240229-v1:0", "Anthropic Claude 3 Opus", STREAMING, MULTIMODAL, defaults=ANTHROPIC_DEFAULTS),
+    _text("anthropic.claude-3-sonnet-20240229-v1:0", "Anthropic Claude 3 Sonnet", STREAMING, MULTIMODAL, defaults=ANTHROPIC_DEFAULTS),
+    _text("anthropic.claude-3-haiku-20240307-v1:0", "Anthropic Claude 3 Haiku", STREAMING, MULTIMODAL, defaults=ANTHROPIC_DEFAULTS),
+    _text("anthropic.claude-v2:1", "Anthropic Claude 2.1", STREAMING, defaults=ANTHROPIC_DEFAULTS),
+    _text("anthropic.claude-v2", "Anthropic Claude 2", STREAMING, defaults=ANTHROPIC_DEFAULTS),
+    _text("anthropic.claude-instant-v1", "Anthropic Claude Instant", STREAMING, defaults=ANTHROPIC_DEFAULTS),
+    _text("cohere.command-r-plus-v1:0", "Cohere Command R+", STREAMING, defaults=COHERE_DEFAULTS),
+    _text("cohere.command-r-v1:0", "Cohere Command R", STREAMING, defaults=COHERE_DEFAULTS),
+    _text("cohere.command-text-v14", "Cohere Command", STREAMING, defaults=COHERE_DEFAULTS),
+    _text("cohere.command-light-text-v14", "Cohere Command Light", STREAMING, defaults=COHERE_DEFAULTS),
+    _text("meta.llama3-70b-instruct-v1:0", "Meta Llama 3 70B Instruct", STREAMING),
+    _text("meta.llama3-8b-instruct-v1:0", "Meta Llama 3 8B Instruct", STREAMING),
+    _text("meta.llama2-70b-chat-v1", "Meta Llama 2 Chat 70B", STREAMING),
+    _text("meta.llama2-13b-chat-v1", "Meta Llama 2 Chat 13B", STREAMING),
+    _text("mistral.mistral-large-2402-v1:0", "Mistral Large", STREAMING),
+    _text("mistral.mixtral-8x7b-instruct-v0:1", "Mixtral 8x7B Instruct", STREAMING),
+    _text("mistral.mistral-7b-instruct-v0:2", "Mistral 7B Instruct", STREAMING),
+    _text("mistral.mistral-small-2402-v1:0", "Mistral Small", STREAMING),
+    _titan_image("amazon.titan-image-generator-v1", "Amazon Titan Image Generator G1", {
+        "numberOfImages": 1, "quality": "standard", "height": 1024, "width": 1024, "cfgScale": 7.5, "seed": 42
+    }),
+    _titan_image("amazon.titan-image-generator-v2:0", "Amazon Titan Image Generator G1 v2", {
+        "numberOfImages": 1, "quality": "premium", "height": 768, "width": 1280, "cfgScale": 7.5, "seed": 42
+    }, CONDITIONING),
+    ModelSpec("stability.stable-diffusion-xl-v1", "Stability Stable Diffusion XL", (IMAGE,),
+              {"cfg_scale": 10, "seed": 0, "steps": 50}, stability_sdxl_request, parse_stability_artifacts),
+    _stability_image("stability.sd3-large-v1:0", "Stability SD3 Large"),
+    _stability_image("stability.stable-image-core-v1:0", "Stability Stable Image Core"),
+    _stability_image("stability.stable-image-ultra-v1:0", "Stability Stable Image Ultra"),
+)}
+
+
+def get_model(model_id):
+    """Returns the registry entry for a model ID, or None when the model is not registered."""
+    return MODELS.get(model_id)
+
+
+def custom_text_model(model_id):
+    """Returns a generic text entry for a model that is not registered, such as a custom or newer model."""
+    return _text(model_id, model_id)
+
+
+def parse_seeds(value):
+    """Accepts a list, a JSON array or a comma-separated string of integer seeds; duplicates are dropped."""
+    if value is None or not str(value).strip():
+        return None
+    seeds = value
+    if isinstance(value, str):
+        try:
+            seeds = json.loads(value)
+        except ValueError:
+            seeds = value.strip().strip('[]').split(',')
+    if not isinstance(seeds, list):
+        seeds = [seeds]
+    return list(dict.fromkeys(int(seed) for seed in seeds if str(seed).strip())) or None
+
+
+def image_request_overrides(spec, count=1, seeds=None):
+    """Splits a request for count images (per seed, when seeds are given) into the overrides of each model request.
+
+    A MULTI_IMAGE model returns up to MAX_IMAGES_PER_REQUEST images of a seed from one request; larger
+    counts take several requests, each after the first with the next seed not used elsewhere, so
+    they return different images. Other image models return one image per request, so they are
+    called once per seed, or count times with their random seed.
+    """
+    if count < 1:
+        raise ValueError("numberOfImages must be at least 1")
+    if spec.supports(MULTI_IMAGE):
+        used = set(seeds or [spec.defaults.get('seed')])
+        overrides = []
+        for seed in seeds or [None]:
+            request_seed = seed
+            for start in range(0, count, MAX_IMAGES_PER_REQUEST):
+                if start:
+                    request_seed = _next_seed(spec.defaults.get('seed') if request_seed is None else request_seed, used)
+                request = {"numberOfImages": min(count - start, MAX_IMAGES_PER_REQUEST)}
+                if request_seed is not None:
+                    request["seed"] = request_seed
+                overrides.append(request)
+        return overrides
+    if seeds and count > 1:
+        raise ValueError(f"{spec.label} returns one image per request; give one seed per image instead of numberOfImages")
+    return [{"seed": seed} for seed in seeds] if seeds else [{}] * count
+
+
+def _next_seed(seed, used):
+    """Returns the first seed after seed that is not in used (wrapping within Titan's seed range) and marks it used."""
+    if seed is None:
+        return None
+    while True:
+        seed = (seed + 1) % TITAN_SEED_LIMIT
+        if seed not in used:
+            used.add(seed)
+            return seed
+
+
+def model_ids(capability):
+    """Returns the registered model IDs with a capability, in registry order."""
+    return [model_id for model_id, spec in MODELS.items() if capability in spec.capabilities]
@@ -0,0 +1,282 @@
+import cProfile
+import io
+import json
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+# Profiling modes: 'spans' only times the handler's phases; 'sampling' also samples every thread's
+# stack (collapsed-stack output); 'cprofile' also runs cProfile on the handler thread (pstats output)
+MODES = ('spans', 'sampling', 'cprofile')
+_MODE_ALIASES = {'true': 'sampling', 'on': 'sampling', '1': 'sampling'}
+
+# The profile of the running invocation. Lambda runs one invocation per container at a time, so a
+# module global is enough and also catches spans from worker threads.
+_active = None
+_NO_SPAN = nullcontext()
+
+
+def span(name):
+    """Times a phase of the invocation when it is profiled; otherwise a shared no-op context."""
+    profile = _active
+    if profile is None:
+        return _NO_SPAN
+    return profile.span(name)
+
+
+def parse_mode(value):
+    """Maps a flag value ('true', 'sampling', 'cprofile', 'spans', 'false', ...) to a mode, or None for off."""
+    value = str(value or '').strip().lower()
+    value = _MODE_ALIASES.get(value, value)
+    return value if value in MODES else None
+
+
+class StackSampler:
+    """Samples the stacks of all other threads every interval seconds and counts them as collapsed stacks."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                # Skip idle pool workers, which only wait on their work queue
+                if len(stack) > 1 and stack[1].startswith('get (queue.py'):
+                    continue
+                stack.append(names.get(ident, str(ident)))
+                self.counts[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        """Returns the samples in collapsed-stack format (one 'frame;frame;frame count' line per stack)."""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+
+class Profile:
+    """Span timings and the optional sampler or cProfile data of one invocation."""
+
+    def __init__(self, mode, name, sample_interval=0.005, clock=time.perf_counter):
+        self.mode = mode
+        self.name = name
+        self.clock = clock
+        self.started = clock()
+        self.stopped = None
+        self.spans = []  # (name, thread name, start, end) in seconds since started
+        self.files = []
+        self._lock = threading.Lock()
+        self.sampler = StackSampler(sample_interval) if mode == 'sampling' else None
+        self.profiler = cProfile.Profile() if mode == 'cprofile' else None
+
+    @contextmanager
+    def span(self, name):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            end = self.clock()
+            with self._lock:
+                self.spans.append((name, threading.current_thread().name, start - self.started, end - self.started))
+
+    def start(self):
+        if self.sampler is not None:
+            self.sampler.start()
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    def stop(self):
+        if self.stopped is not None:
+            return
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.sampler is not None:
+            self.sampler.stop()
+        self.stopped = self.clock()
+
+    def speedscope(self):
+        """Returns the spans as a speedscope evented profile, one track per thread."""
+        names = sorted({name for name, _, _, _ in self.spans})
+        frames = {name: index for index, name in enumerate(names)}
+        end_value = (self.stopped or self.clock()) - self.started
+        tracks = {}
+        for name, thread, start, end in self.spans:
+            events = tracks.setdefault(thread, [])
+            # At equal times, closes sort before opens, inner closes before outer ones and outer opens before inner ones
+            events.append(((start * 1000, 1, -end), {"type": "O", "frame": frames[name], "at": start * 1000}))
+            events.append(((end * 1000, 0, -start), {"type": "C", "frame": frames[name], "at": end * 1000}))
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "shared": {"frames": [{"name": name} for name in names]},
+            "profiles": [{
+                "type": "evented",
+                "name": thread,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": end_value * 1000,
+                "events": [event for _, event in sorted(events, key=lambda item: item[0])],
+            } for thread, events in tracks.items()],
+        }
+
+    def top_functions(self, limit=10):
+        """The functions with the most cumulative time under cProfile."""
+        stats = pstats.Stats(self.profiler, stream=io.StringIO())
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+        return [{
+            "function": f"{function} ({os.path.basename(filename)}:{line})",
+            "calls": calls,
+            "cumulativeMs": round(cumulative * 1000, 2),
+        } for (filename, line, function), (_, calls, _, cumulative, _) in rows]
+
+    def summary(self):
+        """The span timings and output locations attached to the response."""
+        summary = {
+            "mode": self.mode,
+            "totalMs": round(((self.stopped or self.clock()) - self.started) * 1000, 2),
+            "spans": [{
+                "name": name,
+                "thread": thread,
+                "startMs": round(start * 1000, 2),
+                "durationMs": round((end - start) * 1000, 2),
+            } for name, thread, start, end in sorted(self.spans, key=lambda item: item[2])],
+        }
+        if self.sampler is not None:
+            summary["samples"] = self.sampler.samples
+        if self.profiler is not None:
+            summary["topFunctions"] = self.top_functions()
+        if self.files:
+            summary["files"] = self.files
+        return summary
+
+
+class Profiler:
+    """Turns profiling on for single invocations and writes their output.
+
+    An invocation is profiled when its 'profile' action group parameter or session attribute names
+    a mode (see MODES; 'true' means 'sampling'), or for every invocation when default_mode is set.
+    Output goes to a local directory or to an s3://bucket/prefix location: spans as a speedscope
+    JSON file, plus collapsed stacks (sampling) or pstats (cprofile). When no invocation is being
+    profiled, span() costs one global lookup.
+    """
+
+    def __init__(self, default_mode=None, output='/tmp/profiles', sample_interval=0.005, client_factory=None, max_files=50):
+        self.default_mode = parse_mode(default_mode)
+        self.output = output
+        self.sample_interval = sample_interval
+        self.client_factory = client_factory
+        self.max_files = max_files
+
+    def mode(self, event):
+        flag = next((item.get('value') for item in event.get('parameters') or () if item.get('name') == 'profile'), None)
+        if flag is None:
+            flag = (event.get('sessionAttributes') or {}).get('profile')
+        return parse_mode(flag) if flag is not None else self.default_mode
+
+    def start(self, event):
+        """Starts profiling the invocation if the event or the environment asks for it; returns the Profile or None."""
+        global _active
+        if _active is not None:
+            # Left running by an invocation that raised before finish()
+            _active.stop()
+            _active = None
+        mode = self.mode(event)
+        if mode is None:
+            return None
+        name = f"{event.get('apiPath', 'invocation').strip('/') or 'invocation'}-{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        profile = Profile(mode, name, self.sample_interval)
+        _active = profile
+        profile.start()
+        return profile
+
+    def finish(self, profile):
+        """Stops the profile and writes its output files; errors while writing are logged, not raised."""
+        global _active
+        if profile is None:
+            return
+        profile.stop()
+        if _active is profile:
+            _active = None
+
+        outputs = {f"{profile.name}.speedscope.json": json.dumps(profile.speedscope()).encode('utf-8')}
+        if profile.sampler is not None:
+            outputs[f"{profile.name}.collapsed"] = profile.sampler.collapsed().encode('utf-8')
+        if profile.profiler is not None:
+            # The format cProfile.Profile.dump_stats() writes, built in memory
+            profile.profiler.create_stats()
+            outputs[f"{profile.name}.pstats"] = marshal.dumps(profile.profiler.stats)
+
+        try:
+            for filename, data in outputs.items():
+                profile.files.append(self._write(filename, data))
+            if not self.output.startswith('s3://'):
+                self._prune()
+        except Exception as e:
+            print(f"Error writing profile output: {e}")
+
+    def _write(self, filename, data):
+        if self.output.startswith('s3://'):
+            bucket, _, prefix = self.output[len('s3://'):].partition('/')
+            key = f"{prefix.rstrip('/')}/{filename}" if prefix else filename
+            self.client_factory().put_object(Bucket=bucket, Key=key, Body=data)
+            return f"s3://{bucket}/{key}"
+        os.makedirs(self.output, exist_ok=True)
+        path = os.path.join(self.output, filename)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def _prune(self):
+        """Deletes the oldest local output files beyond max_files, so a warm container's /tmp does not fill up."""
+        paths = [entry.path for entry in os.scandir(self.output) if entry.is_file()]
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:max(0, len(paths) - self.max_files)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def attach(self, profile, response, event):
+        """Adds the profile summary to the action group response as the 'profileResult' session attribute."""
+        if profile is None:
+            return response
+        summary = json.dumps(profile.summary())
+        print(f"PROFILE: {summary}")
+        return dict(response, sessionAttributes=dict(event.get('sessionAttributes') or {}, profileResult=summary))
+
+    @classmethod
+    def from_environment(cls, client_factory=None):
+        """Builds the profiler from PROFILE_MODE, PROFILE_OUTPUT, PROFILE_SAMPLE_INTERVAL_MS and PROFILE_MAX_FILES."""
+        return cls(
+            os.environ.get('PROFILE_MODE'),
+            output=os.environ.get('PROFILE_OUTPUT', '/tmp/profiles'),
+            sample_interval=float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', 5)) / 1000,
+            client_factory=client_factory,
+            max_files=int(os.environ.get('PROFILE_MAX_FILES', 50))
+        )
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(model_id, prompt, inference_config, image_etag=None):
+    """Returns a canonical SHA-256 key for a model, prompt and inference config.
+
+    image_etag identifies the image sent with a multimodal prompt, so a changed image is a new key.
+    """
+    entry = {"modelId": model_id, "prompt": prompt, "inferenceConfig": inference_config}
+    if image_etag is not None:
+        entry["imageEtag"] = image_etag
+    canonical = json.dumps(entry, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    """In-process LRU cache with a per-entry TTL and a cap on the total size of the stored values.
+
+    Values must be JSON serializable; their serialized length is what counts against max_bytes.
+    """
+
+    def __init__(self, max_bytes, ttl_seconds, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.size = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= self.clock():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def put(self, key, value):
+        size = len(json.dumps(value))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (self.clock() + self.ttl_seconds, size, value)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
+
+
+class S3CacheTier:
+    """Shared cache tier storing one JSON object per key under a prefix of an S3 bucket."""
+
+    def __init__(self, client_factory, bucket_factory, ttl_seconds, prefix='response-cache/'):
+        self.client_factory = client_factory
+        self.bucket_factory = bucket_factory
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    def get(self, key):
+        try:
+            response = self.client_factory().get_object(Bucket=self.bucket_factory(), Key=self.prefix + key)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                logger.warning(f"Response cache read failed: {str(e)}")
+            return None
+        entry = json.loads(response['Body'].read())
+        if entry['expiresAt'] <= time.time():
+            return None
+        return entry['value']
+
+    def put(self, key, value):
+        body = json.dumps({"expiresAt": time.time() + self.ttl_seconds, "value": value})
+        try:
+            self.client_factory().put_object(
+                Bucket=self.bucket_factory(), Key=self.prefix + key, Body=body, ContentType='application/json'
+            )
+        except ClientError as e:
+            logger.warning(f"Response cache write failed: {str(e)}")
+
+
+class DynamoDBCacheTier:
+    """Shared cache tier backed by a DynamoDB table (or a DynamoDB-compatible local stand-in).
+
+    The table needs a string partition key named cacheKey; expiresAt can be enabled as its TTL attribute.
+    """
+
+    def __init__(self, client_factory, table_name, ttl_seconds):
+        self.client_factory = client_factory
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key):
+        try:
+            item = self.client_factory().get_item(
+                TableName=self.table_name, Key={'cacheKey': {'S': key}}, ConsistentRead=False
+            ).get('Item')
+        except ClientError as e:
+            logger.warning(f"Response cache read failed: {str(e)}")
+            return None
+        # DynamoDB TTL deletion is lazy, so expiry is checked on read as well
+        if item is None or float(item['expiresAt']['N']) <= time.time():
+            return None
+        return json.loads(item['value']['S'])
+
+    def put(self, key, value):
+        try:
+            self.client_factory().put_item(TableName=self.table_name, Item={
+                'cacheKey': {'S': key},
+                'value': {'S': json.dumps(value)},
+                'expiresAt': {'N': str(int(time.time() + self.ttl_seconds))},
+            })
+        except ClientError as e:
+            logger.warning(f"Response cache write failed: {str(e)}")
+
+
+class ResponseCache:
+    """Two-tier response cache: the warm container's LRU first, then an optional shared tier."""
+
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.put(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.local.put(key, value)
+        if self.shared is not None:
+            self.shared.put(key, value)
+
+    def stats(self, hit):
+        """Returns the counters reported in response metadata for one lookup."""
+        return {"hit": hit, "hits": self.hits, "misses": self.misses, "evictions": self.local.evictions}
+
+    @classmethod
+    def from_environment(cls, client_factory, bucket_factory):
+        """Builds the cache from RESPONSE_CACHE_* environment variables, or returns None when disabled.
+
+        client_factory(service_name, endpoint_url) returns a cached boto3 client and bucket_factory()
+        the image bucket name; both are only called when the shared tier is used.
+        """
+        if os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() != 'true':
+            return None
+
+        ttl_seconds = int(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', 3600))
+        local = LRUCache(int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 16 * 1024 * 1024)), ttl_seconds)
+
+        shared_tier = os.environ.get('RESPONSE_CACHE_SHARED', '').lower()
+        endpoint_url = os.environ.get('RESPONSE_CACHE_ENDPOINT_URL')
+        if shared_tier == 's3':
+            cache_bucket = os.environ.get('RESPONSE_CACHE_BUCKET')
+            shared = S3CacheTier(
+                lambda: client_factory('s3', endpoint_url),
+                (lambda: cache_bucket) if cache_bucket else bucket_factory,
+                ttl_seconds,
+                os.environ.get('RESPONSE_CACHE_PREFIX', 'response-cache/')
+            )
+        elif shared_tier == 'dynamodb':
+            shared = DynamoDBCacheTier(
+                lambda: client_factory('dynamodb', endpoint_url),
+                os.environ['RESPONSE_CACHE_TABLE'],
+                ttl_seconds
+            )
+        else:
+            shared = None
+        return cls(local, shared)
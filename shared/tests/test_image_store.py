@@ -0,0 +1,236 @@
+import base64
+import io
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+from image_store import ImageStore, PresignedUrlCache, ReferenceImage, request_key, request_seed
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 32
+JPEG = b'\xff\xd8\xff\xe0' + b'\x00' * 32
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+        self.multipart_uploads = 0
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not Found'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        self.objects[Key] = Body.encode('utf-8') if isinstance(Body, str) else bytes(Body)
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None, Config=None):
+        self.multipart_uploads += 1
+        self.objects[key] = fileobj.read()
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        self.signed = getattr(self, 'signed', 0) + 1
+        return f"https://{Params['Bucket']}/{Params['Key']}?expires={ExpiresIn}&n={self.signed}"
+
+
+@pytest.fixture
+def s3():
+    return FakeS3()
+
+
+@pytest.fixture
+def store(s3):
+    return ImageStore(lambda: s3, lambda: 'test-bucket')
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_request_key_ignores_formatting_and_key_order():
+    body = {"textToImageParams": {"text": "a cat"}, "imageGenerationConfig": {"seed": 1, "cfgScale": 8}}
+    reordered = '{"imageGenerationConfig": {"cfgScale": 8, "seed": 1},\n "textToImageParams": {"text": "a cat"}}'
+
+    assert request_key('model', body) == request_key('model', json.dumps(body)) == request_key('model', reordered.encode())
+    assert request_key('model', body) != request_key('other-model', body)
+    assert request_key('model', body) != request_key('model', dict(body, imageGenerationConfig={"seed": 2, "cfgScale": 8}))
+
+
+def test_request_seed_treats_stability_seed_zero_as_random():
+    assert request_seed({"imageGenerationConfig": {"seed": 0}}) == 0
+    assert request_seed({"imageGenerationConfig": {}}) is None
+    assert request_seed({"seed": 7}) == 7
+    assert request_seed({"seed": 0}) is None
+    assert request_seed('{"prompt": "a cat"}') is None
+
+
+def test_lookup_returns_the_recorded_keys_in_order(store):
+    store.record('request', {"modelId": "model", "seed": 1}, ['b.png', 'a.png'])
+
+    assert store.lookup('request') == ['b.png', 'a.png']
+
+
+def test_lookup_reads_single_image_entries(store, s3):
+    s3.objects['image-requests/request.json'] = json.dumps({"modelId": "model", "imageKey": "old.png"}).encode()
+
+    assert store.lookup('request') == ['old.png']
+
+
+def test_record_keeps_the_single_image_field(store, s3):
+    store.record('request', {"seed": 1}, ['first.png', 'second.png'])
+
+    entry = json.loads(s3.objects['image-requests/request.json'])
+    assert entry['imageKey'] == 'first.png'
+    assert entry['imageKeys'] == ['first.png', 'second.png']
+    assert entry['requestId'] == 'request'
+
+
+def test_lookup_misses_and_errors(store, s3):
+    assert store.lookup('missing') is None
+
+    def denied(**kwargs):
+        raise ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'Denied'}}, 'GetObject')
+    s3.get_object = denied
+    with pytest.raises(ClientError):
+        store.lookup('request')
+
+
+def test_image_key_depends_on_bytes_and_metadata(store):
+    key = store.image_key(PNG, {"seed": 1})
+
+    assert key.startswith('generated-images/') and key.endswith('.png')
+    assert key == store.image_key(PNG, {"seed": 1})
+    assert key != store.image_key(PNG, {"seed": 2})
+    assert store.image_key(JPEG, {"seed": 1}).endswith('.jpeg')
+
+
+def test_put_uploads_and_records(store, s3):
+    key = store.put(PNG, 'request', {"seed": 1})
+
+    assert s3.objects[key] == PNG
+    assert store.lookup('request') == [key]
+
+
+def test_large_images_use_multipart_upload(s3):
+    store = ImageStore(lambda: s3, lambda: 'test-bucket', multipart_threshold=len(PNG))
+
+    store.upload(PNG, 'generated-images/large.png')
+
+    assert s3.multipart_uploads == 1
+    assert s3.objects['generated-images/large.png'] == PNG
+
+
+def encoded(size, mode='RGB', image_format='PNG'):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new(mode, size).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def decoded(fitted):
+    from PIL import Image
+
+    return Image.open(io.BytesIO(base64.b64decode(fitted)))
+
+
+def test_fitting_rgb_image_is_sent_as_stored():
+    data = encoded((640, 480))
+    reference = ReferenceImage(data, '"etag"')
+
+    assert reference.fit_base64(1280, 768) == base64.b64encode(data).decode()
+    assert 'image' not in reference.__dict__
+
+
+@pytest.mark.parametrize('mode', ['RGBA', 'LA', 'P'])
+def test_fitting_image_with_alpha_or_palette_is_converted(mode):
+    reference = ReferenceImage(encoded((640, 480), mode), '"etag"')
+
+    image = decoded(reference.fit_base64(1280, 768))
+    assert image.mode == 'RGB' and image.size == (640, 480)
+
+
+def test_large_image_is_scaled_to_fit():
+    reference = ReferenceImage(encoded((2560, 1536), 'RGBA'), '"etag"')
+
+    image = decoded(reference.fit_base64(1280, 768))
+    assert image.mode == 'RGB' and image.size == (1280, 768)
+
+
+def test_narrow_image_keeps_the_minimum_side():
+    reference = ReferenceImage(encoded((4000, 400)), '"etag"')
+
+    assert decoded(reference.fit_base64(1280, 768)).size == (3200, 320)
+
+
+def test_too_small_image_is_rejected():
+    reference = ReferenceImage(encoded((1000, 200)), '"etag"')
+
+    with pytest.raises(ValueError, match='at least 320 pixels'):
+        reference.fit_base64(1280, 768)
+
+
+def test_fitted_image_is_cached_per_size():
+    reference = ReferenceImage(encoded((2560, 1536)), '"etag"')
+
+    assert reference.fit_base64(1280, 768) is reference.fit_base64(1280, 768)
+
+
+def test_jpeg_is_rgb():
+    assert ReferenceImage(encoded((640, 480), image_format='JPEG'), '"etag"').is_rgb
+
+
+def test_presigned_url_is_reused_while_half_its_lifetime_remains(s3, clock):
+    urls = PresignedUrlCache(lambda: s3, clock=clock)
+    first = urls.get_url('test-bucket', 'a.png', 3600)
+
+    clock.now += 1799
+    assert urls.get_url('test-bucket', 'a.png', 3600) == first
+    clock.now += 1
+    assert urls.get_url('test-bucket', 'a.png', 3600) != first
+    assert s3.signed == 2
+
+
+def test_short_presigned_urls_keep_the_margin(s3, clock):
+    urls = PresignedUrlCache(lambda: s3, margin_seconds=300, clock=clock)
+    first = urls.get_url('test-bucket', 'a.png', 400)
+
+    clock.now += 99
+    assert urls.get_url('test-bucket', 'a.png', 400) == first
+    clock.now += 1
+    assert urls.get_url('test-bucket', 'a.png', 400) != first
+
+    urls.get_url('test-bucket', 'b.png', 200)
+    urls.get_url('test-bucket', 'b.png', 200)
+    assert s3.signed == 4
+
+
+def test_presigned_url_reuse_is_capped_at_max_age(s3, clock):
+    urls = PresignedUrlCache(lambda: s3, max_age_seconds=3600, clock=clock)
+    first = urls.get_url('test-bucket', 'a.png', 604800)
+
+    clock.now += 3599
+    assert urls.get_url('test-bucket', 'a.png', 604800) == first
+    clock.now += 1
+    assert urls.get_url('test-bucket', 'a.png', 604800) != first
+
+
+def test_presigned_urls_are_cached_per_expiry_and_bounded(s3, clock):
+    urls = PresignedUrlCache(lambda: s3, max_entries=2, clock=clock)
+    first = urls.get_urls('test-bucket', ['a.png', 'b.png'], 3600)
+    assert urls.get_url('test-bucket', 'a.png', 3600) == first[0]
+    assert urls.get_url('test-bucket', 'a.png', 60) not in first
+
+    # The one-minute URL for a.png pushed out the least recently used entry, the one for b.png
+    assert urls.get_url('test-bucket', 'a.png', 3600) == first[0]
+    assert urls.get_url('test-bucket', 'b.png', 3600) != first[1]
+    assert s3.signed == 4
@@ -0,0 +1,80 @@
+import json
+
+from metrics import MetricsLogger
+
+
+def logger():
+    lines = []
+    return MetricsLogger('Test', emit=lambda line: lines.append(json.loads(line)), clock=lambda: 1700000000.5), lines
+
+
+def test_flush_writes_one_emf_line_per_model():
+    metrics, lines = logger()
+    metrics.record('model-a', LatencyMs=120, InputTokens=12)
+    metrics.record('model-a', LatencyMs=80, InputTokens=None)
+    metrics.record('model-b', Errors=1)
+
+    metrics.flush(ApiPath='/callModel')
+
+    assert len(lines) == 2
+    line = lines[0]
+    assert line['ModelId'] == 'model-a' and line['ApiPath'] == '/callModel'
+    assert line['LatencyMs'] == [120, 80] and line['InputTokens'] == [12]
+    assert line['_aws'] == {
+        'Timestamp': 1700000000500,
+        'CloudWatchMetrics': [{
+            'Namespace': 'Test',
+            'Dimensions': [['ModelId'], []],
+            'Metrics': [{'Name': 'LatencyMs', 'Unit': 'Milliseconds'}, {'Name': 'InputTokens', 'Unit': 'Count'}],
+        }],
+    }
+    assert lines[1]['Errors'] == [1]
+
+
+def test_flush_clears_the_collected_values():
+    metrics, lines = logger()
+    metrics.record('model', LatencyMs=1)
+    metrics.flush()
+    metrics.flush()
+
+    assert len(lines) == 1
+
+
+def test_series_longer_than_100_values_are_split():
+    metrics, lines = logger()
+    for value in range(150):
+        metrics.record('model', LatencyMs=value, Errors=1 if value < 10 else None)
+
+    metrics.flush()
+
+    assert [len(line['LatencyMs']) for line in lines] == [100, 50]
+    assert len(lines[0]['Errors']) == 10
+    assert 'Errors' not in lines[1]
+    assert [metric['Name'] for metric in lines[1]['_aws']['CloudWatchMetrics'][0]['Metrics']] == ['LatencyMs']
+
+
+def test_unknown_metrics_have_no_unit():
+    metrics, lines = logger()
+    metrics.record('model', Custom=3)
+    metrics.flush()
+
+    assert lines[0]['_aws']['CloudWatchMetrics'][0]['Metrics'] == [{'Name': 'Custom', 'Unit': 'None'}]
+
+
+def test_timer_records_milliseconds():
+    metrics, lines = logger()
+    with metrics.timer('model', 'S3Ms'):
+        pass
+    metrics.flush()
+
+    (elapsed,) = lines[0]['S3Ms']
+    assert isinstance(elapsed, int) and elapsed >= 0
+
+
+def test_disabled_logger_records_nothing():
+    lines = []
+    metrics = MetricsLogger('Test', enabled=False, emit=lines.append)
+    metrics.record('model', LatencyMs=1)
+    metrics.flush()
+
+    assert lines == []
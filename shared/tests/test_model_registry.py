@@ -0,0 +1,117 @@
+import json
+
+import pytest
+
+from model_registry import (CONDITIONING, IMAGE, MODELS, MULTI_IMAGE, TEXT, custom_text_model, get_model, image_request_overrides,
+                            model_ids, parse_seeds, stream_converse, titan_conditioned_request)
+
+TITAN_V1 = get_model('amazon.titan-image-generator-v1')
+TITAN_V2 = get_model('amazon.titan-image-generator-v2:0')
+SD3 = get_model('stability.sd3-large-v1:0')
+
+
+def test_lookup_and_capabilities():
+    assert TITAN_V2.supports(IMAGE) and TITAN_V2.supports(MULTI_IMAGE) and TITAN_V2.supports(CONDITIONING)
+    assert not TITAN_V1.supports(CONDITIONING)
+    assert get_model('unknown') is None
+    assert custom_text_model('my-model').supports(TEXT)
+    assert 'stability.sd3-large-v1:0' in model_ids(IMAGE)
+
+
+@pytest.mark.parametrize('value, expected', [
+    (None, None),
+    ('', None),
+    ('[7, 11, 7]', [7, 11]),
+    ('7, 11', [7, 11]),
+    ('[7, 11', [7, 11]),
+    ('42', [42]),
+    (5, [5]),
+    ([3, '4'], [3, 4]),
+])
+def test_parse_seeds(value, expected):
+    assert parse_seeds(value) == expected
+
+
+def test_parse_seeds_rejects_non_integers():
+    with pytest.raises(ValueError):
+        parse_seeds('7, seven')
+
+
+def test_multi_image_models_take_one_request_per_seed():
+    assert image_request_overrides(TITAN_V1, 3) == [{"numberOfImages": 3}]
+    assert image_request_overrides(TITAN_V1, 2, [7, 11]) == [{"numberOfImages": 2, "seed": 7}, {"numberOfImages": 2, "seed": 11}]
+
+
+def test_multi_image_requests_are_split_into_at_most_five_images():
+    default_seed = TITAN_V1.defaults['seed']
+
+    assert image_request_overrides(TITAN_V1, 8) == [{"numberOfImages": 5}, {"numberOfImages": 3, "seed": default_seed + 1}]
+    assert image_request_overrides(TITAN_V1, 10, [7, 8]) == [
+        {"numberOfImages": 5, "seed": 7}, {"numberOfImages": 5, "seed": 9},
+        {"numberOfImages": 5, "seed": 8}, {"numberOfImages": 5, "seed": 10},
+    ]
+    assert image_request_overrides(TITAN_V1, 6, [2147483646]) == [
+        {"numberOfImages": 5, "seed": 2147483646}, {"numberOfImages": 1, "seed": 0}
+    ]
+
+
+def test_single_image_models_take_one_request_per_image():
+    assert image_request_overrides(SD3, 3) == [{}, {}, {}]
+    assert image_request_overrides(SD3, 1, [7, 11]) == [{"seed": 7}, {"seed": 11}]
+    with pytest.raises(ValueError):
+        image_request_overrides(SD3, 2, [7])
+    with pytest.raises(ValueError):
+        image_request_overrides(SD3, 0)
+
+
+def test_text_requests_use_the_entry_defaults_and_attach_images():
+    claude = get_model('anthropic.claude-3-haiku-20240307-v1:0')
+    request = claude.request('Describe it', image=b'PNG', image_format='png')
+
+    assert request['inferenceConfig'] == claude.defaults
+    assert request['messages'][0]['content'] == [{"text": "Describe it"}, {"image": {"format": "png", "source": {"bytes": b'PNG'}}}]
+    assert get_model('ai21.j2-ultra-v1').defaults['topP'] == 0.5
+    assert all(spec.defaults['temperature'] == 0 for spec in MODELS.values() if spec.supports(TEXT))
+
+
+def test_titan_request_applies_overrides_to_the_defaults():
+    body = json.loads(TITAN_V1.request('a cat', numberOfImages=2, seed=7))
+
+    assert body['textToImageParams'] == {"text": "a cat"}
+    assert body['imageGenerationConfig'] == dict(TITAN_V1.defaults, numberOfImages=2, seed=7)
+
+
+def test_conditioned_requests():
+    variation = json.loads(titan_conditioned_request(TITAN_V2, 'a cat', 'BASE64', 'variation', 0.7))
+    canny = json.loads(titan_conditioned_request(TITAN_V2, 'a cat', 'BASE64', 'canny'))
+
+    assert variation['taskType'] == 'IMAGE_VARIATION'
+    assert variation['imageVariationParams'] == {"text": "a cat", "images": ["BASE64"], "similarityStrength": 0.7}
+    assert canny['taskType'] == 'TEXT_IMAGE'
+    assert canny['textToImageParams'] == {"text": "a cat", "conditionImage": "BASE64", "controlMode": "CANNY_EDGE"}
+
+
+class StreamingClient:
+    def __init__(self, *deltas):
+        self.deltas = deltas
+        self.requests = []
+
+    def converse_stream(self, **request):
+        self.requests.append(request)
+        events = [{'messageStart': {'role': 'assistant'}}]
+        events += [{'contentBlockDelta': {'delta': {'text': delta}}} for delta in self.deltas]
+        events += [{'messageStop': {'stopReason': 'end_turn'}},
+                   {'metadata': {'usage': {'inputTokens': 3, 'outputTokens': 2}, 'metrics': {'latencyMs': 42}}}]
+        return {'stream': iter(events)}
+
+
+def test_stream_converse_yields_deltas_and_fills_metrics():
+    client = StreamingClient('Hel', '', 'lo')
+    request = get_model('amazon.titan-text-express-v1').request('Hi')
+    metrics = {}
+
+    assert list(stream_converse(client, request, metrics)) == ['Hel', 'lo']
+    assert client.requests == [request]
+    assert metrics['latencyMs'] == 42
+    assert metrics['usage'] == {'inputTokens': 3, 'outputTokens': 2}
+    assert metrics['timeToFirstTokenMs'] >= 0
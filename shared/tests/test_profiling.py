@@ -0,0 +1,54 @@
+import os
+
+from profiling import Profiler, parse_mode, span
+
+
+def event(profile=None):
+    return {'apiPath': '/callModel', 'parameters': [{'name': 'profile', 'value': profile}] if profile else []}
+
+
+def test_parse_mode():
+    assert parse_mode('true') == 'sampling'
+    assert parse_mode(' Spans ') == 'spans'
+    assert parse_mode('false') is None
+    assert parse_mode(None) is None
+
+
+def test_unprofiled_invocations_record_nothing(tmp_path):
+    profiler = Profiler(output=str(tmp_path))
+    profile = profiler.start(event())
+
+    with span('params'):
+        pass
+    profiler.finish(profile)
+
+    assert profile is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_spans_are_written_as_speedscope(tmp_path):
+    profiler = Profiler(output=str(tmp_path))
+    profile = profiler.start(event('spans'))
+    with span('params'):
+        pass
+    profiler.finish(profile)
+
+    summary = profile.summary()
+    assert [item['name'] for item in summary['spans']] == ['params']
+    assert summary['files'] == [os.path.join(str(tmp_path), f"{profile.name}.speedscope.json")]
+
+    response = profiler.attach(profile, {'response': {}}, {'sessionAttributes': {'a': 'b'}})
+    assert response['sessionAttributes']['a'] == 'b' and 'profileResult' in response['sessionAttributes']
+
+
+def test_local_output_keeps_the_newest_files(tmp_path):
+    profiler = Profiler(output=str(tmp_path), max_files=3)
+    for index in range(5):
+        old = tmp_path / f"old-{index}.speedscope.json"
+        old.write_text('{}')
+        os.utime(old, (index, index))
+
+    profile = profiler.start(event('spans'))
+    profiler.finish(profile)
+
+    assert sorted(os.listdir(tmp_path)) == sorted(['old-3.speedscope.json', 'old-4.speedscope.json', f"{profile.name}.speedscope.json"])
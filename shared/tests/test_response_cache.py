@@ -0,0 +1,152 @@
+import io
+import json
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from response_cache import DynamoDBCacheTier, LRUCache, ResponseCache, S3CacheTier, cache_key
+
+CONFIG = {"maxTokens": 2000, "temperature": 0, "topP": 0.9}
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not Found'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        self.objects[Key] = Body.encode('utf-8')
+
+
+class FakeDynamoDB:
+    def __init__(self):
+        self.items = {}
+
+    def get_item(self, TableName, Key, ConsistentRead=False):
+        item = self.items.get(Key['cacheKey']['S'])
+        return {'Item': item} if item else {}
+
+    def put_item(self, TableName, Item):
+        self.items[Item['cacheKey']['S']] = Item
+
+
+def test_cache_key_is_canonical():
+    assert cache_key('m', 'p', CONFIG) == cache_key('m', 'p', dict(reversed(list(CONFIG.items()))))
+    assert cache_key('m', 'p', CONFIG) != cache_key('m', 'p', dict(CONFIG, topP=1))
+    assert cache_key('m', 'p', CONFIG) != cache_key('m', 'p', CONFIG, image_etag='"abc"')
+
+
+def test_lru_entries_expire_after_their_ttl():
+    clock = Clock()
+    cache = LRUCache(max_bytes=1000, ttl_seconds=60, clock=clock)
+    cache.put('a', {'result': 'answer'})
+
+    clock.now += 59
+    assert cache.get('a') == {'result': 'answer'}
+    clock.now += 1
+    assert cache.get('a') is None
+    assert cache.size == 0
+
+
+def test_lru_evicts_least_recently_used_entries_past_the_byte_cap():
+    value = {'result': 'x' * 80}
+    size = len(json.dumps(value))
+    cache = LRUCache(max_bytes=size * 2, ttl_seconds=60, clock=Clock())
+    cache.put('a', value)
+    cache.put('b', value)
+    cache.get('a')
+
+    cache.put('c', value)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == value and cache.get('c') == value
+    assert cache.size == size * 2 and cache.evictions == 1
+
+
+def test_lru_skips_values_larger_than_the_cap():
+    cache = LRUCache(max_bytes=10, ttl_seconds=60, clock=Clock())
+    cache.put('a', {'result': 'far too long for the cache'})
+
+    assert cache.get('a') is None and cache.size == 0
+
+
+def test_s3_tier_round_trip_and_expiry():
+    s3 = FakeS3()
+    tier = S3CacheTier(lambda: s3, lambda: 'bucket', ttl_seconds=60)
+    tier.put('key', {'result': 'answer'})
+
+    assert list(s3.objects) == ['response-cache/key']
+    assert tier.get('key') == {'result': 'answer'}
+    assert tier.get('missing') is None
+
+    s3.objects['response-cache/old'] = json.dumps({'expiresAt': time.time() - 1, 'value': {}}).encode()
+    assert tier.get('old') is None
+
+
+def test_dynamodb_tier_round_trip_and_expiry():
+    dynamodb = FakeDynamoDB()
+    tier = DynamoDBCacheTier(lambda: dynamodb, 'cache-table', ttl_seconds=60)
+    tier.put('key', {'result': 'answer'})
+
+    assert tier.get('key') == {'result': 'answer'}
+    assert tier.get('missing') is None
+
+    dynamodb.items['key']['expiresAt'] = {'N': str(int(time.time()) - 1)}
+    assert tier.get('key') is None
+
+
+def test_shared_hits_are_copied_to_the_local_tier():
+    dynamodb = FakeDynamoDB()
+    shared = DynamoDBCacheTier(lambda: dynamodb, 'cache-table', ttl_seconds=60)
+    shared.put('key', {'result': 'answer'})
+    cache = ResponseCache(LRUCache(1000, 60, clock=Clock()), shared)
+
+    assert cache.get('missing') is None
+    assert cache.get('key') == {'result': 'answer'}
+    dynamodb.items.clear()
+    assert cache.get('key') == {'result': 'answer'}
+    assert cache.stats(hit=True) == {'hit': True, 'hits': 2, 'misses': 1, 'evictions': 0}
+
+
+def test_put_writes_both_tiers():
+    s3 = FakeS3()
+    cache = ResponseCache(LRUCache(1000, 60, clock=Clock()), S3CacheTier(lambda: s3, lambda: 'bucket', 60))
+    cache.put('key', {'result': 'answer'})
+
+    assert cache.local.get('key') == {'result': 'answer'}
+    assert 'response-cache/key' in s3.objects
+
+
+@pytest.mark.parametrize('environment, shared', [
+    ({}, type(None)),
+    ({'RESPONSE_CACHE_SHARED': 's3'}, S3CacheTier),
+    ({'RESPONSE_CACHE_SHARED': 'dynamodb', 'RESPONSE_CACHE_TABLE': 'cache-table'}, DynamoDBCacheTier),
+])
+def test_from_environment_builds_the_configured_tiers(monkeypatch, environment, shared):
+    for name in ('RESPONSE_CACHE_ENABLED', 'RESPONSE_CACHE_SHARED', 'RESPONSE_CACHE_TABLE'):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in environment.items():
+        monkeypatch.setenv(name, value)
+
+    cache = ResponseCache.from_environment(lambda service_name, endpoint_url=None: None, lambda: 'bucket')
+
+    assert isinstance(cache.shared, shared)
+
+
+def test_from_environment_can_disable_the_cache(monkeypatch):
+    monkeypatch.setenv('RESPONSE_CACHE_ENABLED', 'false')
+
+    assert ResponseCache.from_environment(lambda service_name, endpoint_url=None: None, lambda: 'bucket') is None
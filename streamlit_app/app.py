@@ -1,4 +1,5 @@
 import invoke_agent as agenthelper
+from model_registry import MODELS, STREAMING, model_ids
 import streamlit as st
 import json
 import pandas as pd
@@ -32,9 +33,16 @@ end_session_button = st.button("End Session")
 # Sidebar for user input
 st.sidebar.title("Trace Data")
 
+# Ask the agent, or stream the answer of one text model directly as it is generated
+AGENT = "Agent"
+target = st.sidebar.selectbox("Answer with", [AGENT] + model_ids(STREAMING))
+
 # Session State Management
 if 'history' not in st.session_state:
     st.session_state['history'] = []
+# One trace collector per chat session, so the trace size limit applies to the session
+if 'trace_collector' not in st.session_state:
+    st.session_state['trace_collector'] = agenthelper.TraceCollector()
 
 # Function to parse and format response
 def format_response(response_body):
@@ -51,12 +59,16 @@ def format_response(response_body):
         return response_body
 
 # Handling user input and responses
-if submit_button and prompt:
+if submit_button and prompt and target != AGENT:
+    st.write(f"### {target}")
+    answer = st.write_stream(agenthelper.stream_model(target, prompt))
+    st.session_state['history'].append({"question": prompt, "answer": answer})
+elif submit_button and prompt:
     event = {
         "sessionId": "MYSESSION",
         "question": prompt
     }
-    response = agenthelper.lambda_handler(event, None)
+    response = agenthelper.lambda_handler(event, None, st.session_state['trace_collector'])
     
     try:
         # Parse the JSON string
@@ -92,6 +104,7 @@ if end_session_button:
     }
     agenthelper.lambda_handler(event, None)
     st.session_state['history'].clear()
+    st.session_state['trace_collector'] = agenthelper.TraceCollector()
 
 # Display conversation history
 st.write("## Conversation History")
@@ -126,28 +139,13 @@ for index, chat in enumerate(reversed(st.session_state['history'])):
             # Generate a unique key for each answer text area
             st.text_area("A:", value=chat["answer"], height=100, key=f"answer_{index}")
 
-# Model prompts structured for Streamlit display
+# Model prompts structured for Streamlit display, generated from the model registry
 model_prompts = [
     {
         'Models': [
-            {"amazon.titan-text-premier-v1:0"},
-            {"amazon.titan-text-express-v1"},
-            {"amazon.titan-text-lite-v1"},
-            {"ai21.j2-ultra-v1"},
-            {"ai21.j2-mid-v1"},
-            {"anthropic.claude-3-sonnet-20240229-v1:0"},
-            {"anthropic.claude-3-haiku-20240307-v1:0"},
-            {"cohere.command-r-plus-v1:0"},
-            {"cohere.command-r-v1:0"},
-            {"meta.llama3-70b-instruct-v1:0"},
-            {"meta.llama3-8b-instruct-v1:0"},
-            {"mistral.mistral-large-2402-v1:0"},
-            {"mistral.mixtral-8x7b-instruct-v0:1"},
-            {"mistral.mistral-7b-instruct-v0:2"},
-            {"mistral.mistral-small-2402-v1:0"},
-            {"Amazon Titan": "amazon.titan-image-generator-v1"}
-            
-        ]     
+            {"Model": spec.label, "Model ID": spec.model_id, "Capabilities": ", ".join(sorted(spec.capabilities))}
+            for spec in MODELS.values()
+        ]
     }
 ]
 
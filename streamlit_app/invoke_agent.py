@@ -4,10 +4,15 @@ from botocore.awsrequest import AWSRequest
 from botocore.credentials import Credentials
 import json
 import os
-from requests import request
+import requests
+from requests.adapters import HTTPAdapter
 import base64
-import io
-import sys
+import codecs
+import struct
+import threading
+import zlib
+from collections import namedtuple
+from model_registry import STREAMING, get_model, stream_converse
 
 #For this to run on a local machine in VScode, you need to set the AWS_PROFILE environment variable to the name of the profile/credentials you want to use. 
 
@@ -24,6 +29,76 @@ os.environ["AWS_REGION"] = theRegion
 region = os.environ.get("AWS_REGION")
 llm_response = ""
 
+# Bytes read from the HTTP response per iteration while decoding the agent's event stream
+READ_CHUNK_SIZE = 64 * 1024
+# Keep-alive connections pooled per host by each SigV4Transport
+HTTP_POOL_SIZE = int(os.environ.get("AGENT_HTTP_POOL_SIZE", 10))
+# Upper bound on the trace text kept for one chat session
+TRACE_MAX_BYTES = int(os.environ.get("AGENT_TRACE_MAX_BYTES", 256 * 1024))
+
+class SigV4Transport:
+    """Sends SigV4-signed requests over a pooled, keep-alive requests.Session.
+
+    Credentials are read from the boto3 session when each request is signed, so refreshable
+    credentials (SSO, assumed roles, instance profiles) keep working in long-running processes.
+    """
+
+    def __init__(self, service='execute-api', region=None, pool_size=HTTP_POOL_SIZE, session=None):
+        self.service = service
+        self.region = region or os.environ['AWS_REGION']
+        self._credentials = (session or Session()).get_credentials()
+        self._http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._http.mount('https://', adapter)
+        self._http.mount('http://', adapter)
+
+    def request(self, url, method='GET', body=None, params=None, headers=None, credentials=None, stream=False):
+        """Signs and sends a request; with stream=True the body is read lazily via iter_content()."""
+        if credentials is None:
+            if self._credentials is None:
+                raise RuntimeError("No AWS credentials found; set AWS_PROFILE or the AWS_* environment variables")
+            credentials = self._credentials.get_frozen_credentials()
+
+        # sign request
+        req = AWSRequest(
+            method=method,
+            url=url,
+            data=body,
+            params=params,
+            headers=headers
+        )
+        SigV4Auth(credentials, self.service, self.region).add_auth(req)
+        req = req.prepare()
+
+        # send request
+        return self._http.request(
+            method=req.method,
+            url=req.url,
+            headers=req.headers,
+            data=req.body,
+            stream=stream
+        )
+
+    def close(self):
+        self._http.close()
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(service='execute-api', region=None):
+    """Returns the process-wide SigV4Transport for a service and region, creating it on first use."""
+    key = (service, region or os.environ['AWS_REGION'])
+    transport = _transports.get(key)
+    if transport is None:
+        with _transports_lock:
+            transport = _transports.get(key)
+            if transport is None:
+                transport = _transports[key] = SigV4Transport(service, key[1])
+    return transport
+
+
 def sigv4_request(
     url,
     method='GET',
@@ -31,8 +106,9 @@ def sigv4_request(
     params=None,
     headers=None,
     service='execute-api',
-    region=os.environ['AWS_REGION'],
-    credentials=Session().get_credentials().get_frozen_credentials()
+    region=None,
+    credentials=None,
+    stream=False
 ):
     """Sends an HTTP request signed with SigV4
     Args:
@@ -43,33 +119,23 @@ def sigv4_request(
     headers: The request headers (e.g. { 'content-type': 'application/json' }). Defaults to None.
     service: The AWS service name. Defaults to 'execute-api'.
     region: The AWS region id. Defaults to the env var 'AWS_REGION'.
-    credentials: The AWS credentials. Defaults to the current boto3 session's credentials.
+    credentials: The AWS credentials. Defaults to the current boto3 session's credentials, refreshed per request.
+    stream: Whether to stream the response body instead of downloading it up front. Defaults to False.
     Returns:
      The HTTP response
     """
-
-    # sign request
-    req = AWSRequest(
+    return get_transport(service, region).request(
+        url,
         method=method,
-        url=url,
-        data=body,
+        body=body,
         params=params,
-        headers=headers
+        headers=headers,
+        credentials=credentials,
+        stream=stream
     )
-    SigV4Auth(credentials, service, region).add_auth(req)
-    req = req.prepare()
 
-    # send request
-    return request(
-        method=req.method,
-        url=req.url,
-        headers=req.headers,
-        data=req.body
-    )
-    
-    
 
-def askQuestion(question, url, endSession=False):
+def askQuestion(question, url, endSession=False, collector=None):
     myobj = {
         "inputText": question,   
         "enableTrace": True,
@@ -86,72 +152,253 @@ def askQuestion(question, url, endSession=False):
             'accept': 'application/json',
         },
         region=theRegion,
-        body=json.dumps(myobj)
+        body=json.dumps(myobj),
+        stream=True
     )
-    
-    return decode_response(response)
+
+    # Closing hands the keep-alive connection back to the pool once the stream is consumed
+    with response:
+        response.raise_for_status()
+        return decode_response(response, collector)
+
+
+
+
+class EventStreamError(Exception):
+    """Raised when the agent's event stream is malformed, truncated or reports an exception."""
+
+
+EventStreamMessage = namedtuple('EventStreamMessage', ['headers', 'payload'])
+AgentEvent = namedtuple('AgentEvent', ['event_type', 'data'])
+
+_PRELUDE = struct.Struct('>III')  # total length, headers length, prelude CRC
+_PRELUDE_LENGTH = _PRELUDE.size
+_MESSAGE_CRC = struct.Struct('>I')
+_MIN_MESSAGE_LENGTH = _PRELUDE_LENGTH + _MESSAGE_CRC.size
+_MAX_MESSAGE_LENGTH = 16 * 1024 * 1024
+
+# Fixed-width header value types of the event stream encoding
+_HEADER_VALUES = {
+    2: struct.Struct('>b'),  # byte
+    3: struct.Struct('>h'),  # short
+    4: struct.Struct('>i'),  # integer
+    5: struct.Struct('>q'),  # long
+    8: struct.Struct('>q'),  # timestamp (ms since epoch)
+}
+_HEADER_LENGTH = struct.Struct('>H')
+
+
+def _decode_headers(data):
+    """Decodes the header section of an event stream message into a dict."""
+    headers = {}
+    offset = 0
+    while offset < len(data):
+        name_length = data[offset]
+        offset += 1
+        name = bytes(data[offset:offset + name_length]).decode('utf-8')
+        offset += name_length
+        value_type = data[offset]
+        offset += 1
+        if value_type in (0, 1):  # boolean true / false
+            value = value_type == 0
+        elif value_type in _HEADER_VALUES:
+            fmt = _HEADER_VALUES[value_type]
+            value = fmt.unpack_from(data, offset)[0]
+            offset += fmt.size
+        elif value_type in (6, 7):  # byte array / string
+            (length,) = _HEADER_LENGTH.unpack_from(data, offset)
+            offset += _HEADER_LENGTH.size
+            value = bytes(data[offset:offset + length])
+            if value_type == 7:
+                value = value.decode('utf-8')
+            offset += length
+        elif value_type == 9:  # uuid
+            value = bytes(data[offset:offset + 16])
+            offset += 16
+        else:
+            raise EventStreamError(f"Unknown event stream header type {value_type} for {name}")
+        headers[name] = value
+    return headers
+
+
+class EventStreamDecoder:
+    """Incremental decoder for the AWS application/vnd.amazon.eventstream framing.
+
+    Chunks of any size are appended to a reusable buffer; every complete, CRC-checked frame is
+    returned from feed() and partial frames stay buffered until the rest of their bytes arrive.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """Adds a chunk of bytes and returns the list of messages it completed."""
+        self._buffer += data
+        messages = []
+        offset = 0
+        buffered = len(self._buffer)
+        with memoryview(self._buffer) as view:
+            while buffered - offset >= _PRELUDE_LENGTH:
+                total_length, headers_length, prelude_crc = _PRELUDE.unpack_from(view, offset)
+                if zlib.crc32(view[offset:offset + 8]) != prelude_crc:
+                    raise EventStreamError("Event stream prelude CRC mismatch")
+                if not _MIN_MESSAGE_LENGTH <= total_length <= _MAX_MESSAGE_LENGTH \
+                        or headers_length > total_length - _MIN_MESSAGE_LENGTH:
+                    raise EventStreamError(f"Invalid event stream frame length {total_length}")
+                if buffered - offset < total_length:
+                    break
+
+                end = offset + total_length
+                (message_crc,) = _MESSAGE_CRC.unpack_from(view, end - _MESSAGE_CRC.size)
+                if zlib.crc32(view[offset:end - _MESSAGE_CRC.size]) != message_crc:
+                    raise EventStreamError("Event stream message CRC mismatch")
+
+                headers_start = offset + _PRELUDE_LENGTH
+                payload_start = headers_start + headers_length
+                messages.append(EventStreamMessage(
+                    _decode_headers(view[headers_start:payload_start]),
+                    bytes(view[payload_start:end - _MESSAGE_CRC.size])
+                ))
+                offset = end
+        del self._buffer[:offset]
+        return messages
+
+    def close(self):
+        """Checks that the stream did not end in the middle of a frame."""
+        if self._buffer:
+            raise EventStreamError(f"Event stream ended with {len(self._buffer)} bytes of an incomplete frame")
+
+
+def iter_agent_events(chunks):
+    """Yields AgentEvent('chunk', text) and AgentEvent('trace', dict) from raw response chunks as they arrive.
+
+    Answer bytes go through an incremental UTF-8 decoder, so multi-byte characters split across
+    chunk events are reassembled instead of dropped.
+    """
+    decoder = EventStreamDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    for data in chunks:
+        for message in decoder.feed(data):
+            headers = message.headers
+            if headers.get(':message-type') == 'exception':
+                raise EventStreamError(f"{headers.get(':exception-type')}: {message.payload.decode('utf-8', 'replace')}")
+
+            event_type = headers.get(':event-type')
+            body = json.loads(message.payload)
+            if event_type == 'chunk':
+                text = text_decoder.decode(base64.b64decode(body.get('bytes', '')))
+                if text:
+                    yield AgentEvent('chunk', text)
+            elif event_type == 'trace':
+                yield AgentEvent('trace', body.get('trace', body))
+    decoder.close()
+    tail = text_decoder.decode(b'', final=True)
+    if tail:
+        yield AgentEvent('chunk', tail)
 
 
+TraceRecord = namedtuple('TraceRecord', ['kind', 'text'])
 
 
-def decode_response(response):
-    # Create a StringIO object to capture print statements
-    captured_output = io.StringIO()
-    sys.stdout = captured_output
+def _compact_json(value):
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
 
-    # Your existing logic
-    string = ""
-    for line in response.iter_content():
-        try:
-            string += line.decode(encoding='utf-8')
-        except:
+
+def _trace_records(trace):
+    """Maps one agent trace event to compact (kind, text) records."""
+    for trace_type, step in trace.items():
+        if trace_type != 'orchestrationTrace':
+            if trace_type == 'failureTrace':
+                yield TraceRecord('failure', step.get('failureReason', ''))
+            else:
+                parsed = step.get('modelInvocationOutput', {}).get('parsedResponse')
+                if parsed is not None:
+                    yield TraceRecord(trace_type, _compact_json(parsed))
             continue
 
-    print("Decoded response", string)
-    split_response = string.split(":message-type")
-    print(f"Split Response: {split_response}")
-    print(f"length of split: {len(split_response)}")
-
-    for idx in range(len(split_response)):
-        if "bytes" in split_response[idx]:
-            #print(f"Bytes found index {idx}")
-            encoded_last_response = split_response[idx].split("\"")[3]
-            decoded = base64.b64decode(encoded_last_response)
-            final_response = decoded.decode('utf-8')
-            print(final_response)
+        if 'modelInvocationInput' in step:
+            # The full orchestration prompt is large and identical in shape every step; keep its size only
+            model_input = step['modelInvocationInput']
+            yield TraceRecord('orchestration', f"{model_input.get('type', 'ORCHESTRATION')} prompt ({len(model_input.get('text', ''))} chars)")
+        if 'rationale' in step:
+            yield TraceRecord('rationale', step['rationale'].get('text', ''))
+        if 'invocationInput' in step:
+            invocation_input = step['invocationInput']
+            details = {key: value for key, value in invocation_input.items() if key not in ('traceId', 'invocationType')}
+            yield TraceRecord('invocationInput', f"{invocation_input.get('invocationType', '')} {_compact_json(details)}")
+        if 'observation' in step:
+            observation = step['observation']
+            if 'finalResponse' in observation:
+                yield TraceRecord('finalResponse', observation['finalResponse'].get('text', ''))
+            elif 'actionGroupInvocationOutput' in observation:
+                yield TraceRecord('invocationOutput', observation['actionGroupInvocationOutput'].get('text', ''))
+            else:
+                details = {key: value for key, value in observation.items() if key not in ('traceId', 'type')}
+                yield TraceRecord('invocationOutput', f"{observation.get('type', '')} {_compact_json(details)}")
+
+
+class TraceCollector:
+    """Collects an agent's trace events as compact records over a chat session.
+
+    begin() starts the records of the next question. The max_bytes budget covers the whole
+    session: once the next record would exceed it, records are only counted. The human-readable
+    text of the current question is only built when render() is called.
+    """
+
+    def __init__(self, max_bytes=TRACE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.records = []
+        self.size = 0
+        self.dropped = 0
+        self.final_response = ""
+
+    def begin(self):
+        """Starts a new question; the session's byte budget carries over."""
+        self.records = []
+        self.dropped = 0
+        self.final_response = ""
+
+    def add(self, trace):
+        for record in _trace_records(trace):
+            if record.kind == 'finalResponse':
+                self.final_response = record.text
+            size = len(record.text.encode('utf-8'))
+            if self.dropped or self.size + size > self.max_bytes:
+                self.dropped += 1
+                continue
+            self.records.append(record)
+            self.size += size
+
+    def render(self):
+        lines = [f"[{record.kind}] {record.text}" for record in self.records]
+        if self.dropped:
+            lines.append(f"... {self.dropped} trace records omitted after {self.max_bytes} bytes of session trace")
+        return "\n".join(lines)
+
+
+def decode_response(response, collector=None):
+    """Decodes an agent response into (trace text, answer) without touching sys.stdout.
+
+    Pass the session's TraceCollector so TRACE_MAX_BYTES bounds the trace kept over the session.
+    """
+    if collector is None:
+        collector = TraceCollector()
+    collector.begin()
+    answer_parts = []
+    for event in iter_agent_events(response.iter_content(chunk_size=READ_CHUNK_SIZE)):
+        if event.event_type == 'chunk':
+            answer_parts.append(event.data)
         else:
-            print(f"no bytes at index {idx}")
-            print(split_response[idx])
-            
-    last_response = split_response[-1]
-    print(f"Lst Response: {last_response}")
-    if "bytes" in last_response:
-        print("Bytes in last response")
-        encoded_last_response = last_response.split("\"")[3]
-        decoded = base64.b64decode(encoded_last_response)
-        final_response = decoded.decode('utf-8')
-    else:
-        print("no bytes in last response")
-        part1 = string[string.find('finalResponse')+len('finalResponse":'):] 
-        part2 = part1[:part1.find('"}')+2]
-        final_response = json.loads(part2)['text']
-
-    final_response = final_response.replace("\"", "")
-    final_response = final_response.replace("{input:{value:", "")
-    final_response = final_response.replace(",source:null}}", "")
-    llm_response = final_response
-
-    # Restore original stdout
-    sys.stdout = sys.__stdout__
-
-    # Get the string from captured output
-    captured_string = captured_output.getvalue()
-
-    # Return both the captured output and the final response
-    return captured_string, llm_response
-
-
-def lambda_handler(event, context):
+            collector.add(event.data)
+
+    # Prefer the streamed answer chunks; fall back to the final response recorded in the trace
+    llm_response = "".join(answer_parts) if answer_parts else collector.final_response
+
+    # Return both the trace text and the final response
+    return collector.render(), llm_response
+
+
+def lambda_handler(event, context, collector=None):
     
     sessionId = event["sessionId"]
     question = event["question"]
@@ -169,7 +416,7 @@ def lambda_handler(event, context):
 
     
     try: 
-        response, trace_data = askQuestion(question, url, endSession)
+        response, trace_data = askQuestion(question, url, endSession, collector)
         
         return {
             "status_code": 200,
@@ -183,3 +430,28 @@ def lambda_handler(event, context):
         }
 
 
+_bedrock_runtime = None
+
+
+def get_bedrock_runtime():
+    """Returns the process-wide bedrock-runtime client, creating it on first use."""
+    global _bedrock_runtime
+    if _bedrock_runtime is None:
+        _bedrock_runtime = Session().client('bedrock-runtime', region_name=theRegion)
+    return _bedrock_runtime
+
+
+def stream_model(model_id, prompt, client=None, clean=False):
+    """Streams a text model's answer straight from ConverseStream, bypassing the agent.
+
+    Yields the answer text as it is generated, for st.write_stream, followed by the latency,
+    time to first token and token footer unless clean is set.
+    """
+    spec = get_model(model_id)
+    if spec is None or not spec.supports(STREAMING):
+        raise ValueError(f"Unsupported streaming model ID: {model_id}")
+    metrics = {}
+    yield from stream_converse(client or get_bedrock_runtime(), spec.request(prompt), metrics)
+    if not clean and 'usage' in metrics:
+        yield (f"\n--- Latency: {metrics['latencyMs']}ms - First token: {metrics.get('timeToFirstTokenMs')}ms"
+               f" - Input tokens:{metrics['usage']['inputTokens']} - Output tokens:{metrics['usage']['outputTokens']} ---\n")
@@ -0,0 +1,100 @@
+import base64
+import json
+import struct
+import zlib
+
+import pytest
+from botocore.eventstream import EventStreamBuffer
+
+from invoke_agent import EventStreamDecoder, EventStreamError, iter_agent_events
+
+
+def encode_frame(headers, payload):
+    """Encodes one application/vnd.amazon.eventstream message with string headers."""
+    encoded_headers = b''.join(
+        bytes([len(name)]) + name.encode() + b'\x07' + struct.pack('>H', len(value.encode())) + value.encode()
+        for name, value in headers.items()
+    )
+    total_length = 12 + len(encoded_headers) + len(payload) + 4
+    prelude = struct.pack('>II', total_length, len(encoded_headers))
+    prelude += struct.pack('>I', zlib.crc32(prelude))
+    message = prelude + encoded_headers + payload
+    return message + struct.pack('>I', zlib.crc32(message))
+
+
+def agent_frame(event_type, body):
+    return encode_frame({':message-type': 'event', ':event-type': event_type}, json.dumps(body).encode())
+
+
+def chunk_frame(data):
+    return agent_frame('chunk', {'bytes': base64.b64encode(data).decode()})
+
+
+def test_decodes_a_frame_like_botocore():
+    frame = encode_frame({':event-type': 'chunk', ':content-type': 'application/json'}, b'{"a": 1}')
+    reference = EventStreamBuffer()
+    reference.add_data(frame)
+    expected = next(iter(reference))
+
+    (message,) = EventStreamDecoder().feed(frame)
+
+    assert message.headers == expected.headers
+    assert message.payload == expected.payload
+
+
+def test_partial_frames_stay_buffered():
+    frames = chunk_frame(b'Hello') + chunk_frame(b' world')
+    decoder = EventStreamDecoder()
+
+    messages = [message for offset in range(len(frames)) for message in decoder.feed(frames[offset:offset + 1])]
+
+    assert len(messages) == 2
+    decoder.close()
+
+
+def test_prelude_crc_mismatch_is_rejected():
+    frame = bytearray(chunk_frame(b'Hello'))
+    frame[8] ^= 0xFF
+
+    with pytest.raises(EventStreamError, match='prelude CRC'):
+        EventStreamDecoder().feed(bytes(frame))
+
+
+def test_message_crc_mismatch_is_rejected():
+    frame = bytearray(chunk_frame(b'Hello'))
+    frame[-6] ^= 0xFF
+
+    with pytest.raises(EventStreamError, match='message CRC'):
+        EventStreamDecoder().feed(bytes(frame))
+
+
+def test_invalid_frame_length_is_rejected():
+    prelude = struct.pack('>II', 8, 0)
+    frame = prelude + struct.pack('>I', zlib.crc32(prelude))
+
+    with pytest.raises(EventStreamError, match='frame length'):
+        EventStreamDecoder().feed(frame)
+
+
+def test_truncated_stream_is_rejected_on_close():
+    decoder = EventStreamDecoder()
+    decoder.feed(chunk_frame(b'Hello')[:-3])
+
+    with pytest.raises(EventStreamError, match='incomplete frame'):
+        decoder.close()
+
+
+def test_multibyte_characters_split_across_chunks_are_reassembled():
+    text = 'Grüße 🌍'.encode()
+    chunks = [chunk_frame(text[:3]), chunk_frame(text[3:9]), chunk_frame(text[9:])]
+
+    events = list(iter_agent_events(chunks))
+
+    assert ''.join(event.data for event in events if event.event_type == 'chunk') == 'Grüße 🌍'
+
+
+def test_exception_messages_raise():
+    frame = encode_frame({':message-type': 'exception', ':exception-type': 'throttlingException'}, b'Slow down')
+
+    with pytest.raises(EventStreamError, match='throttlingException: Slow down'):
+        list(iter_agent_events([frame]))
@@ -0,0 +1,46 @@
+import pytest
+
+import invoke_agent
+from invoke_agent import stream_model
+
+MODEL = 'anthropic.claude-3-haiku-20240307-v1:0'
+
+
+class StreamingClient:
+    def __init__(self, *deltas):
+        self.deltas = deltas
+        self.requests = []
+
+    def converse_stream(self, **request):
+        self.requests.append(request)
+        events = [{'contentBlockDelta': {'delta': {'text': delta}}} for delta in self.deltas]
+        events.append({'metadata': {'usage': {'inputTokens': 3, 'outputTokens': 2}, 'metrics': {'latencyMs': 42}}})
+        return {'stream': iter(events)}
+
+
+def test_stream_model_yields_the_answer_then_the_footer():
+    client = StreamingClient('Hel', 'lo')
+
+    parts = list(stream_model(MODEL, 'Hi', client=client))
+
+    assert parts[:2] == ['Hel', 'lo']
+    assert 'Latency: 42ms' in parts[2] and 'Output tokens:2' in parts[2]
+    assert client.requests[0]['modelId'] == MODEL
+    assert client.requests[0]['messages'][0]['content'] == [{'text': 'Hi'}]
+
+
+def test_clean_stream_has_no_footer():
+    assert list(stream_model(MODEL, 'Hi', client=StreamingClient('Hello'), clean=True)) == ['Hello']
+
+
+def test_stream_model_uses_the_shared_client(monkeypatch):
+    client = StreamingClient('Hello')
+    monkeypatch.setattr(invoke_agent, '_bedrock_runtime', client)
+
+    assert list(stream_model(MODEL, 'Hi', clean=True)) == ['Hello']
+
+
+@pytest.mark.parametrize('model_id', ['ai21.j2-mid-v1', 'amazon.titan-image-generator-v1', 'unknown.model'])
+def test_stream_model_rejects_models_without_streaming(model_id):
+    with pytest.raises(ValueError, match='Unsupported streaming model ID'):
+        list(stream_model(model_id, 'Hi', client=StreamingClient()))
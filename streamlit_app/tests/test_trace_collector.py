@@ -0,0 +1,65 @@
+import base64
+import json
+import struct
+import zlib
+
+from invoke_agent import TraceCollector, decode_response
+
+
+def agent_frame(event_type, body):
+    headers = b''.join(
+        bytes([len(name)]) + name.encode() + b'\x07' + struct.pack('>H', len(value)) + value.encode()
+        for name, value in ((':message-type', 'event'), (':event-type', event_type))
+    )
+    payload = json.dumps(body).encode()
+    prelude = struct.pack('>II', 16 + len(headers) + len(payload), len(headers))
+    message = prelude + struct.pack('>I', zlib.crc32(prelude)) + headers + payload
+    return message + struct.pack('>I', zlib.crc32(message))
+
+
+class StreamedResponse:
+    def __init__(self, *frames):
+        self.data = b''.join(frames)
+
+    def iter_content(self, chunk_size=1):
+        for offset in range(0, len(self.data), chunk_size):
+            yield self.data[offset:offset + chunk_size]
+
+
+def rationale(text):
+    return agent_frame('trace', {'trace': {'orchestrationTrace': {'rationale': {'text': text}}}})
+
+
+def answer(text):
+    return agent_frame('chunk', {'bytes': base64.b64encode(text.encode()).decode()})
+
+
+def test_decode_response_renders_the_current_question():
+    collector = TraceCollector()
+
+    decode_response(StreamedResponse(rationale('first'), answer('One')), collector)
+    trace, text = decode_response(StreamedResponse(rationale('second'), answer('Two')), collector)
+
+    assert trace == '[rationale] second'
+    assert text == 'Two'
+
+
+def test_trace_budget_covers_the_session():
+    collector = TraceCollector(max_bytes=10)
+
+    first, _ = decode_response(StreamedResponse(rationale('a' * 8), answer('One')), collector)
+    second, _ = decode_response(StreamedResponse(rationale('b' * 8), answer('Two')), collector)
+
+    assert first == '[rationale] ' + 'a' * 8
+    assert second == '... 1 trace records omitted after 10 bytes of session trace'
+
+
+def test_final_response_falls_back_per_question():
+    collector = TraceCollector()
+    final = agent_frame('trace', {'trace': {'orchestrationTrace': {'observation': {'finalResponse': {'text': 'Done'}}}}})
+
+    _, first = decode_response(StreamedResponse(final), collector)
+    _, second = decode_response(StreamedResponse(rationale('thinking')), collector)
+
+    assert first == 'Done'
+    assert second == ''